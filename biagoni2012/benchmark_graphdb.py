@@ -0,0 +1,144 @@
+#
+# Benchmark of graph database writing: the previous one-INSERT-per-row code
+# (string-concatenated statements, default pragmas) against the bulk writer in
+# pylibs/graphdb_writer.py, writing either schema version, on the same
+# synthetic graph.
+#
+# The synthetic graph is a chain of two-way segments, like graph_extract.py
+# writes: every segment has num_segment_edges edges each way.
+#
+
+import sys, os, getopt, time, sqlite3
+import numpy as np
+from pylibs.graphdb_writer import write_graphdb
+from pylibs import graphdb_reader
+
+def synthetic_graph(num_edges, num_segment_edges, seed):
+    random_state = np.random.RandomState(seed)
+    
+    num_nodes = (num_edges / 2) + 1
+    coords = np.cumsum(random_state.normal(0.0, 0.0001, (num_nodes, 2)), axis=0) + np.array([41.87, -87.65])
+    weights = random_state.uniform(1.0, 1024.0, num_nodes)
+    
+    node_rows = [(i, float(coords[i, 0]), float(coords[i, 1]), float(weights[i])) for i in range(0, num_nodes)]
+    edge_rows = []
+    segment_rows = []
+    
+    for first_node in range(0, num_nodes - 1, num_segment_edges):
+        segment_nodes = range(first_node, min(first_node + num_segment_edges, num_nodes - 1) + 1)
+        segment_weight = float(weights[first_node])
+        
+        outbound_edge_ids = []
+        for i in range(0, len(segment_nodes) - 1):
+            outbound_edge_ids.append(len(edge_rows))
+            edge_rows.append((len(edge_rows), segment_nodes[i], segment_nodes[i + 1], segment_weight))
+        
+        inbound_edge_ids = []
+        for i in range(0, len(segment_nodes) - 1):
+            inbound_edge_ids.append(len(edge_rows))
+            edge_rows.append((len(edge_rows), segment_nodes[i + 1], segment_nodes[i], segment_weight))
+        
+        inbound_edge_ids.reverse()
+        
+        segment_rows.append((len(segment_rows), outbound_edge_ids))
+        segment_rows.append((len(segment_rows), inbound_edge_ids))
+    
+    intersection_ids = range(0, num_nodes, num_segment_edges)
+    
+    return (node_rows, edge_rows, segment_rows, intersection_ids)
+
+def write_per_row(graphdb_filename, node_rows, edge_rows, segment_rows, intersection_ids):
+    try:
+        os.remove(graphdb_filename)
+    except OSError:
+        pass
+    
+    conn = sqlite3.connect(graphdb_filename)
+    cur = conn.cursor()
+    
+    cur.execute("CREATE TABLE nodes (id INTEGER, latitude FLOAT, longitude FLOAT, weight FLOAT)")
+    cur.execute("CREATE TABLE edges (id INTEGER, in_node INTEGER, out_node INTEGER, weight FLOAT)")
+    cur.execute("CREATE TABLE segments (id INTEGER, edge_ids TEXT)")
+    cur.execute("CREATE TABLE intersections (node_id INTEGER)")
+    conn.commit()
+    
+    for (node_id, latitude, longitude, weight) in node_rows:
+        cur.execute("INSERT INTO nodes VALUES (" + str(node_id) + "," + str(latitude) + "," + str(longitude) + "," + str(weight) + ")")
+    
+    for (edge_id, in_node, out_node, weight) in edge_rows:
+        cur.execute("INSERT INTO edges VALUES (" + str(edge_id) + "," + str(in_node) + "," + str(out_node) + "," + str(weight) + ")")
+    
+    for (segment_id, edge_ids) in segment_rows:
+        cur.execute("INSERT INTO segments VALUES (" + str(segment_id) + ",'" + str(edge_ids) + "')")
+    
+    for node_id in intersection_ids:
+        cur.execute("INSERT INTO intersections VALUES (" + str(node_id) + ")")
+    
+    conn.commit()
+    conn.close()
+
+def table_sizes(graphdb_filename):
+    conn = sqlite3.connect(graphdb_filename)
+    cur = conn.cursor()
+    
+    sizes = [cur.execute("SELECT COUNT(*) FROM " + table).fetchone()[0] for table in ("nodes", "edges", "segments", "intersections")]
+    
+    # segment edges: rows of segment_edges (schema version 2) or list entries (version 1)
+    if (graphdb_reader.schema_version(cur) == 2):
+        sizes.append(cur.execute("SELECT COUNT(*) FROM segment_edges").fetchone()[0])
+    else:
+        sizes.append(sum(len(edge_ids) for (_, edge_ids) in graphdb_reader.read_segments(cur)))
+    
+    conn.close()
+    
+    return sizes
+
+if __name__ == '__main__':
+    num_edges = 1000000
+    num_segment_edges = 20
+    seed = 0
+    output_directory = "."
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"e:l:s:o:h")
+    
+    for o,a in opts:
+        if o == "-e":
+            num_edges = int(a)
+        elif o == "-l":
+            num_segment_edges = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-o":
+            output_directory = str(a)
+        elif o == "-h":
+            print "Usage: python benchmark_graphdb.py [-e <num_edges>] [-l <num_segment_edges>] [-s <seed>] [-o <output_directory>] [-h]"
+            exit()
+    
+    (node_rows, edge_rows, segment_rows, intersection_ids) = synthetic_graph(num_edges, num_segment_edges, seed)
+    
+    print "Synthetic graph: " + str(len(node_rows)) + " nodes, " + str(len(edge_rows)) + " edges, " + str(len(segment_rows)) + " segments, " + str(len(intersection_ids)) + " intersections"
+    
+    per_row_filename = os.path.join(output_directory, "benchmark_per_row.db")
+    
+    start_time = time.time()
+    write_per_row(per_row_filename, node_rows, edge_rows, segment_rows, intersection_ids)
+    per_row_time = time.time() - start_time
+    
+    print "one INSERT per row: " + str(round(per_row_time, 2)) + "s, " + str(os.path.getsize(per_row_filename) / 1024) + " KiB"
+    
+    for schema_version in (1, 2):
+        bulk_filename = os.path.join(output_directory, "benchmark_bulk_v" + str(schema_version) + ".db")
+        
+        start_time = time.time()
+        write_graphdb(bulk_filename, node_rows, edge_rows, segment_rows, intersection_ids, schema_version=schema_version)
+        bulk_time = time.time() - start_time
+        
+        print "bulk writer, schema version " + str(schema_version) + " (indexes included): " + str(round(bulk_time, 2)) + "s, " + str(os.path.getsize(bulk_filename) / 1024) + " KiB"
+        
+        if (table_sizes(per_row_filename) != table_sizes(bulk_filename)):
+            print "Error! Row counts differ."
+            sys.exit(1)
+        
+        os.remove(bulk_filename)
+    
+    os.remove(per_row_filename)
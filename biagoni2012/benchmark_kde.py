@@ -0,0 +1,68 @@
+#
+# Benchmark of the KDE histogram backends (OpenCV per-trip images vs.
+# vectorized rasterization) on the same trips and raster grid.
+#
+
+import sys, getopt, time
+import numpy as np
+import kde
+from location import TripLoader, TripStore
+
+if __name__ == '__main__':
+    trips_path = kde.trips_path
+    trip_max = None
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"c:p:n:h")
+    
+    for o,a in opts:
+        if o == "-c":
+            kde.cell_size = int(a)
+        elif o == "-p":
+            trips_path = str(a)
+        elif o == "-n":
+            trip_max = int(a)
+        elif o == "-h":
+            print "Usage: python benchmark_kde.py [-c <cell_size>] [-p <trips_path>] [-n <trip_max>] [-h]"
+            exit()
+    
+    trip_store = TripLoader.load_trip_store(trips_path)
+    
+    if (trip_max is not None):
+        trip_store = trip_store.subset(0, min(trip_max, trip_store.num_trips))
+    
+    k = kde.KDE()
+    grid = k.find_raster_grid(*k.find_bounding_box(trip_store))
+    
+    print "trips: " + str(trip_store.num_trips) + ", locations: " + str(trip_store.num_locations)
+    print "raster: " + str(grid.height) + " x " + str(grid.width) + " at " + str(kde.cell_size) + " m cells"
+    
+    start_time = time.time()
+    opencv_histogram = np.asarray(k.create_histogram_opencv(trip_store, grid)).astype(np.int64)
+    opencv_time = time.time() - start_time
+    
+    start_time = time.time()
+    numpy_histogram = k.create_histogram(trip_store, grid).astype(np.int64)
+    numpy_time = time.time() - start_time
+    
+    print "\nopencv: " + str(round(opencv_time, 3)) + " seconds"
+    print "numpy: " + str(round(numpy_time, 3)) + " seconds (" + str(round(opencv_time / max(numpy_time, 1e-9), 1)) + "x)"
+    
+    # both backends anti-alias differently, so compare footprint and mass rather than exact values
+    opencv_footprint = (opencv_histogram > 0)
+    numpy_footprint = (numpy_histogram > 0)
+    
+    print "\nnonzero pixels: opencv " + str(opencv_footprint.sum()) + ", numpy " + str(numpy_footprint.sum()) + ", shared " + str((opencv_footprint & numpy_footprint).sum())
+    print "histogram sum: opencv " + str(opencv_histogram.sum()) + ", numpy " + str(numpy_histogram.sum())
+    print "histogram max: opencv " + str(opencv_histogram.max()) + ", numpy " + str(numpy_histogram.max())
+    print "max abs difference: " + str(np.abs(opencv_histogram - numpy_histogram).max())
+    
+    # trips without locations (leading, inner and trailing) must not change the histogram
+    offsets = trip_store.offsets
+    empty_offsets = np.concatenate(([0], offsets[0:2], offsets[1:], [offsets[-1]]))
+    empty_trip_store = TripStore(trip_store.latitudes, trip_store.longitudes, trip_store.times, empty_offsets, trip_store.ids)
+    
+    if (not np.array_equal(k.create_histogram(empty_trip_store, grid).astype(np.int64), numpy_histogram)):
+        print "Error! Empty trips change the histogram."
+        sys.exit(1)
+    
+    print "empty trips: histogram unchanged"
@@ -0,0 +1,210 @@
+#
+# Benchmark of OSM database loading: the previous StreetMap.load_osmdb (eval of
+# every way's tags and node list, list membership tests) against the current
+# one, on an OSM database in the older Python literal format and on the same
+# database converted by osmdb_migrate.py. Only loading is timed; indexing is
+# the same for all and is skipped.
+#
+# The synthetic extract is shaped like a metro OSM extract: a street grid of
+# residential, tertiary, secondary and primary ways (some of them one-way),
+# footways and service roads that are not loaded, and many more building ways
+# than highway ways, all with name and other tags.
+#
+
+import sys, os, getopt, time, sqlite3, StringIO
+import numpy as np
+import osmdb_migrate
+from streetmap import StreetMap, Node, Edge
+
+highway_types = ["residential"] * 12 + ["tertiary"] * 3 + ["secondary"] * 2 + ["primary", "footway", "footway", "service", "service", "service"]
+
+def write_synthetic_osmdb(osmdb_filename, grid_size, buildings_per_block, seed):
+    random_state = np.random.RandomState(seed)
+    
+    try:
+        os.remove(osmdb_filename)
+    except OSError:
+        pass
+    
+    conn = sqlite3.connect(osmdb_filename)
+    cur = conn.cursor()
+    
+    # tables of the older format (ids as text, as they were written)
+    cur.execute("CREATE TABLE nodes (id TEXT, tags TEXT, lat FLOAT, lon FLOAT, endnode_refs INTEGER DEFAULT 1)")
+    cur.execute("CREATE TABLE ways (id TEXT, tags TEXT, nds TEXT)")
+    
+    node_rows = []
+    way_rows = []
+    
+    next_node_id = [2000000000]
+    next_way_id = [100000000]
+    
+    def add_node(lat, lon):
+        node_rows.append((str(next_node_id[0]), "{}", lat, lon))
+        next_node_id[0] += 1
+        return str(next_node_id[0] - 1)
+    
+    def add_way(tags, node_ids):
+        way_rows.append((str(next_way_id[0]), str(tags), str(node_ids)))
+        next_way_id[0] += 1
+    
+    # street grid, with 4 nodes along every block
+    grid = [[add_node(41.85 + (row * 0.001), -87.65 + (col * 0.001)) for col in range(0, (grid_size * 4) + 1)] for row in range(0, (grid_size * 4) + 1)]
+    
+    for i in range(0, (grid_size * 4) + 1, 4):
+        for (street_nodes, street_name) in ((grid[i], "West " + str(i) + "th Street"), ([grid_row[i] for grid_row in grid], "North Avenue " + str(i))):
+            tags = {'highway': highway_types[random_state.randint(len(highway_types))], 'name': street_name, 'tiger:county': 'Cook, IL', 'tiger:cfcc': 'A41'}
+            
+            # older extracts also have tags with other literal values, which are decoded whole
+            if (random_state.uniform() < 0.2):
+                tags['oneway'] = ('yes' if (random_state.uniform() < 0.5) else True)
+            
+            if (random_state.uniform() < 0.3):
+                tags['lanes'] = random_state.randint(1, 5)
+            
+            add_way(tags, street_nodes)
+    
+    # buildings
+    for i in range(0, grid_size * grid_size * buildings_per_block):
+        (lat, lon) = (41.85 + random_state.uniform(0.0, grid_size * 0.004), -87.65 + random_state.uniform(0.0, grid_size * 0.004))
+        corners = [add_node(lat, lon), add_node(lat + 0.0001, lon), add_node(lat + 0.0001, lon + 0.0001), add_node(lat, lon + 0.0001)]
+        
+        add_way({'building': 'yes', 'addr:housenumber': str(i), 'addr:street': "O'Brien Street", 'source': 'Cook County GIS'}, corners + corners[0:1])
+    
+    cur.executemany("INSERT INTO nodes (id, tags, lat, lon) VALUES (?, ?, ?, ?)", node_rows)
+    cur.executemany("INSERT INTO ways VALUES (?, ?, ?)", way_rows)
+    conn.commit()
+    conn.close()
+    
+    return (len(node_rows), len(way_rows))
+
+class LoadingStreetMap(StreetMap):
+    # loading only
+    def _index_nodes(self):
+        pass
+    
+    def _index_edges(self):
+        pass
+    
+    def _find_and_index_intersections(self):
+        pass
+
+class EvalStreetMap(LoadingStreetMap):
+    # the previous load_osmdb
+    def load_osmdb(self, osmdb_filename):
+        conn = sqlite3.connect(osmdb_filename)
+        cur = conn.cursor()
+        
+        cur.execute("select id, lat, lon from nodes")
+        
+        for id, lat, lon in cur.fetchall():
+            self.nodes[int(id)] = Node(float(lat), float(lon), int(id))
+        
+        cur.execute("select id, tags, nds from ways")
+        
+        valid_edge_nodes = {}
+        
+        for id, tags, nodes in cur.fetchall():
+            way_tags_dict = eval(tags)
+            
+            if ('highway' in way_tags_dict.keys() and self._valid_highway_edge(way_tags_dict['highway'])):
+                way_nodes_list = eval(nodes)
+                
+                for i in range(1, len(way_nodes_list)):
+                    in_node = self.nodes[int(way_nodes_list[i - 1])]
+                    out_node = self.nodes[int(way_nodes_list[i])]
+                    edge_id = int(str(id) + str(i - 1) + "000000")
+                    
+                    self.edges[int(edge_id)] = Edge(in_node, out_node,int(edge_id))
+                    
+                    if (in_node not in out_node.in_nodes):
+                        out_node.in_nodes.append(in_node)
+                    
+                    if (out_node not in in_node.out_nodes):
+                        in_node.out_nodes.append(out_node)
+                    
+                    if ('oneway' not in way_tags_dict.keys()):
+                        symmetric_edge_id = int(str(edge_id / 10) + "1")
+                        
+                        self.edges[int(symmetric_edge_id)] = Edge(out_node, in_node, int(symmetric_edge_id))
+                        
+                        if (in_node not in out_node.out_nodes):
+                            out_node.out_nodes.append(in_node)
+                        
+                        if (out_node not in in_node.in_nodes):
+                            in_node.in_nodes.append(out_node)
+                    
+                    if (in_node.id not in valid_edge_nodes.keys()):
+                        valid_edge_nodes[in_node.id] = in_node
+                    
+                    if (out_node.id not in valid_edge_nodes.keys()):
+                        valid_edge_nodes[out_node.id] = out_node
+        
+        conn.close()
+        
+        self.nodes = valid_edge_nodes
+
+def timed_load(street_map_class, osmdb_filename):
+    street_map = street_map_class()
+    
+    # keep loading output out of the results
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    
+    start_time = time.time()
+    
+    try:
+        street_map.load_osmdb(osmdb_filename)
+    finally:
+        sys.stdout = stdout
+    
+    return (street_map, time.time() - start_time)
+
+def map_summary(street_map):
+    edges = sorted((edge.id, edge.in_node.id, edge.out_node.id) for edge in street_map.edges.values())
+    nodes = sorted((node.id, node.latitude, node.longitude, sorted(in_node.id for in_node in node.in_nodes), sorted(out_node.id for out_node in node.out_nodes)) for node in street_map.nodes.values())
+    
+    return (edges, nodes)
+
+if __name__ == '__main__':
+    grid_size = 40
+    buildings_per_block = 30
+    seed = 0
+    output_directory = "."
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"g:b:s:o:h")
+    
+    for o,a in opts:
+        if o == "-g":
+            grid_size = int(a)
+        elif o == "-b":
+            buildings_per_block = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-o":
+            output_directory = str(a)
+        elif o == "-h":
+            print "Usage: python benchmark_osmdb.py [-g <grid_size>] [-b <buildings_per_block>] [-s <seed>] [-o <output_directory>] [-h]"
+            exit()
+    
+    literal_filename = os.path.join(output_directory, "benchmark_osmdb_literal.db")
+    json_filename = os.path.join(output_directory, "benchmark_osmdb_json.db")
+    
+    (num_nodes, num_ways) = write_synthetic_osmdb(literal_filename, grid_size, buildings_per_block, seed)
+    osmdb_migrate.migrate(literal_filename, json_filename)
+    
+    print "Synthetic extract: " + str(num_nodes) + " nodes, " + str(num_ways) + " ways"
+    
+    (eval_map, eval_time) = timed_load(EvalStreetMap, literal_filename)
+    print "eval (previous load_osmdb), literal format: " + str(round(eval_time, 2)) + "s, " + str(len(eval_map.edges)) + " edges"
+    
+    for (format_name, osmdb_filename) in (("literal format", literal_filename), ("JSON format with ways_nodes", json_filename)):
+        (street_map, load_time) = timed_load(LoadingStreetMap, osmdb_filename)
+        print "load_osmdb, " + format_name + ": " + str(round(load_time, 2)) + "s, " + str(len(street_map.edges)) + " edges"
+        
+        if (map_summary(street_map) != map_summary(eval_map)):
+            print "Error! Maps differ."
+            sys.exit(1)
+    
+    os.remove(literal_filename)
+    os.remove(json_filename)
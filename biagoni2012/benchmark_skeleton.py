@@ -0,0 +1,92 @@
+#
+# Benchmark of skeleton.py peak memory: the previous np.int pipeline (int32
+# input, 64-bit sum images and binary skeleton) against the uint8 pipeline,
+# on the same synthetic KDE image.
+#
+# Every run happens in its own process, so the peak resident set size
+# (ru_maxrss) of one run does not hide the other.
+#
+
+import sys, os, getopt, time, resource
+import numpy as np
+import scipy.ndimage as nd
+from multiprocessing import Process, Queue
+import skeleton
+
+def synthetic_kde(size, num_roads, seed):
+    random_state = np.random.RandomState(seed)
+    image = np.zeros((size, size), dtype=np.float32)
+    
+    # straight roads of random intensity, blurred like the KDE
+    for k in range(0, num_roads):
+        (row0, col0, row1, col1) = random_state.randint(0, size, 4)
+        num_points = max(abs(row1 - row0), abs(col1 - col0)) + 1
+        
+        image[np.linspace(row0, row1, num_points).astype(np.int), np.linspace(col0, col1, num_points).astype(np.int)] += random_state.randint(1, 20000)
+    
+    # 16-bit PNGs come back from imread as int32
+    return np.minimum(nd.gaussian_filter(image, 2.5), 65535).astype(np.int32)
+
+def run_skeleton(lean, size, num_roads, seed, results):
+    image = synthetic_kde(size, num_roads, seed)
+    
+    if (not lean):
+        
+        # previous pipeline: 64-bit sum images on the int32 input
+        skeleton.skeleton_dtype = np.int
+        skeleton.narrow_kde = lambda image: image
+    
+    # keep the per-level log out of the report
+    sys.stdout = open(os.devnull, 'w')
+    
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.time()
+    
+    skeleton_image = skeleton.GrayscaleSkeleton().skeletonize(image, 16)
+    
+    # binary skeleton handed to graph_extract.py
+    if (lean):
+        binary_skeleton = (skeleton_image > 0).astype(np.int8)
+    else:
+        binary_skeleton = skeleton_image.astype(np.bool).astype(np.int)
+    
+    elapsed_time = time.time() - start_time
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    results.put((peak_rss - start_rss, elapsed_time, int((skeleton_image > 0).sum()), binary_skeleton.nbytes))
+
+def measure(lean, size, num_roads, seed):
+    results = Queue()
+    
+    p = Process(target=run_skeleton, args=(lean, size, num_roads, seed, results))
+    p.start()
+    result = results.get()
+    p.join()
+    
+    return result
+
+if __name__ == '__main__':
+    size = 4000
+    num_roads = 200
+    seed = 0
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"s:n:r:h")
+    
+    for o,a in opts:
+        if o == "-s":
+            size = int(a)
+        elif o == "-n":
+            num_roads = int(a)
+        elif o == "-r":
+            seed = int(a)
+        elif o == "-h":
+            print "Usage: python benchmark_skeleton.py [-s <image_size>] [-n <num_roads>] [-r <seed>] [-h]"
+            exit()
+    
+    print "image: " + str(size) + " x " + str(size) + ", " + str(num_roads) + " roads"
+    
+    for (name, lean) in (("np.int", False), ("uint8", True)):
+        (peak_kilobytes, elapsed_time, num_skeleton_pixels, binary_bytes) = measure(lean, size, num_roads, seed)
+        
+        # ru_maxrss is in kilobytes on Linux
+        print name + ": peak " + str(round(peak_kilobytes / 1024.0, 1)) + " MB above the input, binary skeleton " + str(round(binary_bytes / (1024.0 ** 2), 1)) + " MB, " + str(num_skeleton_pixels) + " skeleton pixels, " + str(round(elapsed_time, 2)) + " seconds"
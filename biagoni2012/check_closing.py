@@ -0,0 +1,78 @@
+#
+# Conformance check: the decomposed disk closing (morphology.py) must give the
+# same images as scipy's grey_closing with the circle footprint, in one pass
+# and tile by tile.
+#
+# Runs both on random 16-bit images and optionally on a KDE image, and prints
+# the time each takes. Exits with status 1 on the first mismatch.
+#
+
+import sys, getopt, time
+import numpy as np
+import scipy.ndimage as nd
+from scipy.ndimage.morphology import grey_closing
+from skeleton import circle
+from morphology import grey_closing_disk
+
+def random_image(random_state, size):
+    image = nd.gaussian_filter(random_state.rand(size, size), random_state.uniform(1, 6)) * random_state.rand(size, size) * 65535
+    image[random_state.rand(size, size) < 0.3] = 0
+    
+    return image.astype(np.uint16)
+
+def check_image(name, image, radius, tile_size):
+    start_time = time.time()
+    reference = grey_closing(image, footprint=circle(radius), mode='constant', cval=0.0)
+    reference_time = time.time() - start_time
+    
+    start_time = time.time()
+    result = grey_closing_disk(image, radius)
+    result_time = time.time() - start_time
+    
+    start_time = time.time()
+    tiled_result = grey_closing_disk(image, radius, tile_size)
+    tiled_time = time.time() - start_time
+    
+    num_different = int((reference != result).sum()) + int((reference != tiled_result).sum())
+    
+    print name + ": " + str(image.shape[0]) + " x " + str(image.shape[1]) + ", " + str(num_different) + " different pixels, grey_closing " + str(round(reference_time, 3)) + "s, rectangles " + str(round(result_time, 3)) + "s, " + str(tile_size) + " pixel tiles " + str(round(tiled_time, 3)) + "s"
+    
+    if (num_different > 0):
+        print "Error! Closings differ."
+        sys.exit(1)
+
+if __name__ == '__main__':
+    num_images = 10
+    seed = 0
+    kde_filename = None
+    radius = 8
+    tile_size = 64
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"n:s:k:r:t:h")
+    
+    for o,a in opts:
+        if o == "-n":
+            num_images = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-k":
+            kde_filename = str(a)
+        elif o == "-r":
+            radius = int(a)
+        elif o == "-t":
+            tile_size = int(a)
+        elif o == "-h":
+            print "Usage: python check_closing.py [-n <num_random_images>] [-s <seed>] [-k <kde_filename>] [-r <radius>] [-t <tile_size>] [-h]"
+            exit()
+    
+    random_state = np.random.RandomState(seed)
+    
+    for i in range(0, num_images):
+        check_image("random image " + str(i), random_image(random_state, random_state.randint(30, 500)), radius, tile_size)
+    
+    if (kde_filename is not None):
+        from scipy.ndimage import imread
+        
+        check_image(kde_filename, imread(kde_filename), radius, tile_size)
+    
+    print "All closings identical."
@@ -0,0 +1,214 @@
+#
+# Conformance check: the vectorized graph extraction steps in graph_extract.py
+# must give the same results as the original per-pixel code.
+#
+#   crossing points   Graph.identify_crossing_points (fringe code lookup table)
+#                     against Graph.identify_crossing_points_per_pixel
+#   segments          Graph.find_main_crossings_and_segments (labelled components,
+#                     traced breadth-first all at once) against
+#                     Graph.find_main_crossings_and_segments_per_pixel
+#   simplification    pylibs.simplify.douglas_peucker (iterative, vectorized)
+#                     against douglas_peucker_recursive
+#   sparse skeletons  Graph.extract_sparse (from the skeleton pixels only)
+#                     against Graph.extract on the full-size images
+#
+# Runs both on skeletons of random blob images (thinned with thinning.py) and
+# optionally on a skeleton image, and the simplifiers on random polylines.
+# Exits with status 1 on the first mismatch.
+#
+
+import sys, getopt, time, os, shutil, sqlite3, tempfile
+import numpy as np
+import scipy.ndimage as nd
+from graph_extract import Graph, Node, douglas_peucker_recursive, set_raster
+from sparse_skeleton import SparseSkeleton
+from pylibs.simplify import douglas_peucker
+import thinning
+
+def random_skeleton(random_state, size):
+    noise = nd.gaussian_filter(random_state.rand(size, size), random_state.uniform(1, 6))
+    image = (noise > np.percentile(noise, random_state.uniform(30, 80))).astype(np.int8)
+    
+    # keep a zero border of two pixels, which the 5 x 5 neighbourhoods need
+    image[:2, :] = 0
+    image[-2:, :] = 0
+    image[:, :2] = 0
+    image[:, -2:] = 0
+    
+    return thinning.thin(image)
+
+def check_crossing_points(name, skeleton):
+    g = Graph()
+    
+    start_time = time.time()
+    reference = g.identify_crossing_points_per_pixel(skeleton.copy())
+    reference_time = time.time() - start_time
+    
+    start_time = time.time()
+    result = g.identify_crossing_points(skeleton.copy())
+    result_time = time.time() - start_time
+    
+    num_different = int((reference != result).sum())
+    
+    print "\n" + name + ": " + str(skeleton.shape[0]) + " x " + str(skeleton.shape[1]) + ", " + str(int((skeleton == 1).sum())) + " skeleton pixels, " + str(num_different) + " different crossing pixels, per pixel " + str(round(reference_time, 3)) + "s, lookup table " + str(round(result_time, 3)) + "s"
+    
+    if (num_different > 0):
+        print "Error! Crossing points differ."
+        sys.exit(1)
+    
+    return result
+
+def same_main_crossings(reference, result):
+    if (sorted(reference.keys()) != sorted(result.keys())):
+        return False
+    
+    # same locations, and pixels share a main crossing exactly when they do in the reference
+    for crossing in reference:
+        if (reference[crossing].location != result[crossing].location):
+            return False
+        
+        if (len(reference[crossing].component_crossings) != len(result[crossing].component_crossings)):
+            return False
+    
+    return True
+
+def find_segments(find_function, crossing_skeleton):
+    
+    # both versions exit on segments without an end crossing (such as loops); that has to match too
+    try:
+        return find_function(crossing_skeleton.copy())
+    except SystemExit:
+        return None
+
+def check_segments(name, crossing_skeleton):
+    g = Graph()
+    
+    start_time = time.time()
+    reference = find_segments(g.find_main_crossings_and_segments_per_pixel, crossing_skeleton)
+    reference_time = time.time() - start_time
+    
+    start_time = time.time()
+    result = find_segments(g.find_main_crossings_and_segments, crossing_skeleton)
+    result_time = time.time() - start_time
+    
+    if ((reference is None) or (result is None)):
+        identical = (reference is result)
+        description = "no end crossing"
+    else:
+        ((reference_crossings, reference_segments), (result_crossings, result_segments)) = (reference, result)
+        
+        # pixel coordinates must also keep their type, which decides how node coordinates are printed
+        identical = (same_main_crossings(reference_crossings, result_crossings) and (reference_segments == result_segments) and
+                     ([[type(i) for (i, j) in segment] for segment in reference_segments] == [[type(i) for (i, j) in segment] for segment in result_segments]))
+        description = str(len(reference_segments)) + " segments, " + str(len(set(reference_crossings.values()))) + " main crossings"
+    
+    print "\n" + name + ": " + description + ", " + ("identical" if identical else "different") + ", per pixel " + str(round(reference_time, 3)) + "s, labelled components " + str(round(result_time, 3)) + "s"
+    
+    if (not identical):
+        print "Error! Segments differ."
+        sys.exit(1)
+
+def extract_graphdb(extract_function, arguments, graphdb_filename):
+    
+    # both versions exit on segments without an end crossing, which has to match too
+    try:
+        extract_function(*(arguments + (graphdb_filename,)))
+    except SystemExit:
+        return None
+    
+    conn = sqlite3.connect(graphdb_filename)
+    graphdb = list(conn.iterdump())
+    conn.close()
+    
+    return graphdb
+
+def check_sparse_extraction(name, skeleton, random_state):
+    bounding_box = (41.85, -87.70, 41.85 + (skeleton.shape[0] * 1e-5), -87.70 + (skeleton.shape[1] * 1.3e-5))
+    
+    # skeleton values are density levels, 1 to 28 (as in Graph.create_nodes_and_new_segments)
+    sparse_skeleton = SparseSkeleton.from_image(skeleton * random_state.randint(1, 29, skeleton.shape), bounding_box, 1.0)
+    
+    temp_dir = tempfile.mkdtemp()
+    
+    try:
+        start_time = time.time()
+        set_raster(sparse_skeleton.bounding_box, *sparse_skeleton.shape)
+        reference = extract_graphdb(Graph().extract, (sparse_skeleton.to_binary_image(), sparse_skeleton.to_image()), os.path.join(temp_dir, "reference.db"))
+        reference_time = time.time() - start_time
+        
+        start_time = time.time()
+        result = extract_graphdb(Graph().extract_sparse, (sparse_skeleton,), os.path.join(temp_dir, "result.db"))
+        result_time = time.time() - start_time
+    finally:
+        shutil.rmtree(temp_dir)
+    
+    identical = (reference == result)
+    description = ("no end crossing" if (reference is None) else (str(len(reference)) + " graphdb rows"))
+    
+    print "\n" + name + ": " + description + ", " + ("identical" if identical else "different") + ", full-size images " + str(round(reference_time, 3)) + "s, sparse " + str(round(result_time, 3)) + "s"
+    
+    if (not identical):
+        print "Error! Sparse graph extraction differs."
+        sys.exit(1)
+
+def random_polyline(random_state, num_points):
+    
+    # random walk with a few meters per step, so that some points are dropped and some kept
+    steps = random_state.normal(0.0, random_state.uniform(0.00002, 0.0002), (num_points, 2))
+    coords = np.cumsum(steps, axis=0) + np.array([41.87, -87.65])
+    
+    return [Node((lat, lon), 1) for (lat, lon) in coords]
+
+def check_simplification(name, polyline, epsilon):
+    start_time = time.time()
+    reference = douglas_peucker_recursive(polyline, epsilon)
+    reference_time = time.time() - start_time
+    
+    start_time = time.time()
+    result = douglas_peucker(polyline, epsilon)
+    result_time = time.time() - start_time
+    
+    identical = ([id(node) for node in reference] == [id(node) for node in result])
+    
+    print "\n" + name + ": " + str(len(polyline)) + " points, " + str(len(reference)) + " kept, " + ("identical" if identical else "different") + ", recursive " + str(round(reference_time, 3)) + "s, iterative " + str(round(result_time, 3)) + "s"
+    
+    if (not identical):
+        print "Error! Simplified polylines differ."
+        sys.exit(1)
+
+if __name__ == '__main__':
+    num_images = 10
+    seed = 0
+    skeleton_filename = None
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"n:s:k:h")
+    
+    for o,a in opts:
+        if o == "-n":
+            num_images = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-k":
+            skeleton_filename = str(a)
+        elif o == "-h":
+            print "Usage: python check_graph_extract.py [-n <num_random_images>] [-s <seed>] [-k <skeleton_filename>] [-h]"
+            exit()
+    
+    random_state = np.random.RandomState(seed)
+    
+    for i in range(0, num_images):
+        name = "random skeleton " + str(i)
+        skeleton = random_skeleton(random_state, random_state.randint(30, 300))
+        
+        check_segments(name, check_crossing_points(name, skeleton))
+        check_sparse_extraction(name, skeleton, random_state)
+    
+    for i in range(0, num_images):
+        check_simplification("random polyline " + str(i), random_polyline(random_state, random_state.randint(2, 5000)), 10)
+    
+    if (skeleton_filename is not None):
+        from scipy.ndimage import imread
+        
+        check_segments(skeleton_filename, check_crossing_points(skeleton_filename, (imread(skeleton_filename) > 0).astype(np.int8)))
+    
+    print "\nAll results identical."
@@ -0,0 +1,85 @@
+#
+# Conformance check: the lookup-table thinning engine (thinning.py) must give
+# pixel-identical skeletons to the original subiteration implementation
+# (GrayscaleSkeleton.thin_pixels_subiterations).
+#
+# Runs both on random blob images, with some pixels locked at 2 as in the
+# skeleton threshold ladder, and optionally on a KDE image thresholded at the
+# given levels. With -w, the lookup-table engine runs in that many processes,
+# splitting every frontier into bands. Exits with status 1 on the first mismatch.
+#
+
+import sys, getopt, time
+import numpy as np
+import scipy.ndimage as nd
+from skeleton import GrayscaleSkeleton, add_zero_mat
+import thinning
+
+def random_image(random_state, size):
+    noise = nd.gaussian_filter(random_state.rand(size, size), random_state.uniform(1, 6))
+    image = (noise > np.percentile(noise, random_state.uniform(30, 80))).astype(np.int)
+    
+    # pixels kept from a previous threshold level
+    image[random_state.rand(size, size) < 0.05] *= 2
+    
+    return add_zero_mat(image[1:-1, 1:-1])
+
+def check_image(name, image, num_workers=1):
+    s = GrayscaleSkeleton()
+    
+    start_time = time.time()
+    reference = s.thin_pixels_subiterations(image.copy())
+    reference_time = time.time() - start_time
+    
+    start_time = time.time()
+    result = thinning.thin(image.copy(), num_workers)
+    result_time = time.time() - start_time
+    
+    num_different = int((reference != result).sum())
+    
+    print name + ": " + str(image.shape[0]) + " x " + str(image.shape[1]) + ", " + str(num_different) + " different pixels, subiterations " + str(round(reference_time, 3)) + "s, lookup tables " + str(round(result_time, 3)) + "s"
+    
+    if (num_different > 0):
+        print "Error! Skeletons differ."
+        sys.exit(1)
+
+if __name__ == '__main__':
+    num_images = 20
+    seed = 0
+    kde_filename = None
+    kde_thresholds = [64, 16, 4]
+    num_workers = 1
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"n:s:k:w:h")
+    
+    for o,a in opts:
+        if o == "-n":
+            num_images = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-k":
+            kde_filename = str(a)
+        elif o == "-w":
+            num_workers = int(a)
+        elif o == "-h":
+            print "Usage: python check_thinning.py [-n <num_random_images>] [-s <seed>] [-k <kde_filename>] [-w <num_workers>] [-h]"
+            exit()
+    
+    random_state = np.random.RandomState(seed)
+    
+    # split even small frontiers across the workers
+    if (num_workers > 1):
+        thinning.parallel_min_pixels = 1
+    
+    for i in range(0, num_images):
+        check_image("random image " + str(i), random_image(random_state, random_state.randint(30, 300)), num_workers)
+    
+    if (kde_filename is not None):
+        from scipy.ndimage import imread
+        
+        kde = add_zero_mat(imread(kde_filename))
+        
+        for kde_threshold in kde_thresholds:
+            check_image(kde_filename + " > " + str(kde_threshold), (kde > kde_threshold).astype(np.int), num_workers)
+    
+    print "All skeletons identical."
@@ -0,0 +1,106 @@
+#
+# Conformance check: KDE histograms and trip drawings rasterized tile by tile
+# (kde.py -t, and the parallel in-memory histogram) must be the same as one
+# pass over the whole raster, bit for bit.
+#
+# Uses random trips: many short ones, a few that wander across the whole
+# raster, and trips without locations. Prints the time each takes and how
+# many segments the tiles rasterize. Exits with status 1 on the first mismatch.
+#
+
+import sys, getopt, time, StringIO
+import numpy as np
+import kde
+from location import TripStore
+from rasterize import RasterGrid, rasterize_trips, tile_segments
+
+def random_trips(random_state, size, num_trips, num_long_trips):
+    lengths = np.concatenate((random_state.randint(0, 60, num_trips), random_state.randint(500, 2000, num_long_trips)))
+    random_state.shuffle(lengths)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    
+    # random walks from random starts, with steps of up to a few percent of the raster
+    step_sizes = np.repeat(np.where(lengths > 60, 0.02, 0.005), lengths)
+    starts = np.repeat(random_state.uniform(0.1, 0.9, (2, len(lengths))), lengths, axis=1)
+    walk = np.cumsum(random_state.randn(2, offsets[-1]) * step_sizes, axis=1)
+    walk -= np.repeat(walk[:, np.minimum(offsets[:-1], offsets[-1] - 1)], lengths, axis=1)
+    
+    latitudes = np.clip(starts[0] + walk[0], 0.0, 1.0) * size
+    longitudes = np.clip(starts[1] + walk[1], 0.0, 1.0) * size
+    
+    return TripStore(latitudes, longitudes, np.zeros(offsets[-1]), offsets)
+
+def check_trips(name, grid, trip_store, tile_size, halo, num_workers):
+    lines = np.zeros((grid.height, grid.width), dtype=np.uint8)
+    
+    start_time = time.time()
+    reference = rasterize_trips(grid, trip_store, np.zeros((grid.height, grid.width), dtype=np.uint32), lines=lines)
+    reference_time = time.time() - start_time
+    
+    (tile_offsets, segment_starts) = tile_segments(grid, trip_store, tile_size, halo)
+    
+    histogram = np.zeros((grid.height, grid.width), dtype=np.uint32)
+    tiled_lines = np.zeros((grid.height, grid.width), dtype=np.uint8)
+    
+    kde.accumulator = "uint32"
+    kde.num_workers = num_workers
+    
+    # keep progress output out of the results
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    start_time = time.time()
+    
+    try:
+        for (tile, (tile_histogram, tile_lines)) in kde._rasterize_tiles(grid, trip_store, tile_size, halo, 0, None, "", True):
+            (row0, col0, tile_height, tile_width) = tile
+            histogram[row0:row0 + tile_height, col0:col0 + tile_width] = tile_histogram
+            tiled_lines[row0:row0 + tile_height, col0:col0 + tile_width] = tile_lines
+    finally:
+        sys.stdout = stdout
+    
+    tiled_time = time.time() - start_time
+    
+    num_different = int((reference != histogram).sum()) + int((lines != tiled_lines).sum())
+    
+    print name + ": " + str(trip_store.num_trips) + " trips, " + str(grid.height) + " x " + str(grid.width) + ", " + str(num_different) + " different pixels, one pass " + str(round(reference_time, 3)) + "s, " + str(tile_size) + " pixel tiles (halo " + str(halo) + ", " + str(num_workers) + " workers) " + str(round(tiled_time, 3)) + "s, " + str(len(segment_starts)) + " tile segments for " + str(trip_store.num_locations - trip_store.num_trips) + " segments"
+    
+    if (num_different > 0):
+        print "Error! Tiled rasters differ."
+        sys.exit(1)
+
+if __name__ == '__main__':
+    num_sets = 4
+    seed = 0
+    size = 2000
+    tile_size = 256
+    num_workers = 2
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"n:s:r:t:w:h")
+    
+    for o,a in opts:
+        if o == "-n":
+            num_sets = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-r":
+            size = int(a)
+        elif o == "-t":
+            tile_size = int(a)
+        elif o == "-w":
+            num_workers = int(a)
+        elif o == "-h":
+            print "Usage: python check_tiled.py [-n <num_trip_sets>] [-s <seed>] [-r <raster_size>] [-t <tile_size>] [-w <num_workers>] [-h]"
+            exit()
+    
+    random_state = np.random.RandomState(seed)
+    
+    # one pixel per unit of latitude and longitude
+    grid = RasterGrid(0.0, 0.0, size, size, 1.0, 1.0)
+    
+    for i in range(0, num_sets):
+        trip_store = random_trips(random_state, size, random_state.randint(100, 2000), random_state.randint(1, 10))
+        
+        check_trips("trip set " + str(i), grid, trip_store, tile_size, 0, 1)
+        check_trips("trip set " + str(i), grid, trip_store, tile_size, random_state.randint(1, 40), num_workers)
+    
+    print "All tiled rasters identical."
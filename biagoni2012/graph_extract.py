@@ -1,13 +1,17 @@
 import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from scipy.ndimage import imread
 from scipy.misc import imsave
 from itertools import izip
 from collections import deque
 from pylibs.spatialfunclib import projection_onto_line
-import sqlite3
+from pylibs.simplify import douglas_peucker
+from pylibs.graphdb_writer import write_graphdb
+from sparse_skeleton import SparseSkeleton, read_bounding_box
+from raster_extent import read_raster_extent
 import math
 import sys
-import os
 
 # globals
 min_lat, min_lon, max_lat, max_lon = None, None, None, None
@@ -16,7 +20,8 @@ width = None
 xscale = None
 yscale = None
 
-def douglas_peucker(segment, epsilon):
+# original recursive simplifier, kept as the reference for pylibs.simplify.douglas_peucker
+def douglas_peucker_recursive(segment, epsilon):
     dmax = 0
     index = 0
     
@@ -28,8 +33,8 @@ def douglas_peucker(segment, epsilon):
             dmax = d
     
     if (dmax >= epsilon):
-        rec_results1 = douglas_peucker(segment[0:index], epsilon)
-        rec_results2 = douglas_peucker(segment[index:], epsilon)
+        rec_results1 = douglas_peucker_recursive(segment[0:index], epsilon)
+        rec_results2 = douglas_peucker_recursive(segment[index:], epsilon)
         
         smoothed_segment = rec_results1
         smoothed_segment.extend(rec_results2)
@@ -38,9 +43,112 @@ def douglas_peucker(segment, epsilon):
     
     return smoothed_segment
 
+def set_raster(bounding_box, raster_height, raster_width):
+    global min_lat, min_lon, max_lat, max_lon, height, width, yscale, xscale
+    
+    min_lat, min_lon, max_lat, max_lon = bounding_box
+    
+    height = raster_height
+    width = raster_width
+    
+    yscale = height / (max_lat - min_lat)
+    xscale = width / (max_lon - min_lon)
+
 def pixels_to_coords((i, j)):
     return ((((height - i) / yscale) + min_lat), ((j / xscale) + min_lon))
 
+# 5 x 5 neighbourhood of a skeleton pixel, in the order of identify_crossing_points' p[0] .. p[23]:
+# the 8 inner neighbours clockwise from north, then the 16 outer ones clockwise from north
+crossing_neighbours = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1),
+                       (-2, 0), (-2, 1), (-2, 2), (-1, 2), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0), (2, -1), (2, -2), (1, -2), (0, -2), (-1, -2), (-2, -2), (-2, -1)]
+
+# fringe bit k is set when outer pixel p[8 + k] and one of the inner pixels next to it are foreground
+fringe_inner_neighbours = [(7, 0, 1), (0, 1), (1,), (1, 2), (1, 2, 3), (2, 3), (3,), (3, 4), (3, 4, 5), (4, 5), (5,), (5, 6), (5, 6, 7), (6, 7), (7,), (7, 0)]
+
+def _build_fringe_component_lut():
+    codes = np.arange(2 ** 16)
+    fringe = [((codes >> k) & 1).astype(np.bool_) for k in range(0, 16)]
+    
+    # number of 0 -> 1 transitions around the fringe
+    component_counts = np.zeros(2 ** 16, dtype=np.uint8)
+    for k in range(0, 16):
+        component_counts += ((~fringe[k]) & fringe[(k + 1) % 16])
+    
+    return component_counts
+
+# connected fringe components for every packed 16-bit fringe code
+fringe_component_lut = _build_fringe_component_lut()
+
+# neighbour order in which segments are traced (find_edge_nodes): north, east, south, west, north-east, south-east, south-west, north-west
+trace_neighbours = [(-1, 0), (0, 1), (1, 0), (0, -1), (-1, 1), (1, 1), (1, -1), (-1, -1)]
+
+def padded_flat_pixels(rows, cols, row_length, border=1):
+    
+    # flat indices in the raster with a border (row_length = width + 2 * border), so neighbours never wrap around a row
+    return ((rows + border) * row_length) + (cols + border)
+
+def neighbour_found(pixels, targets, (di, dj), row_length):
+    
+    # whether the neighbour at offset (di, dj) of every pixel is one of targets (sorted flat indices)
+    if (len(targets) == 0):
+        return np.zeros(len(pixels), dtype=np.bool_)
+    
+    neighbour_pixels = pixels + ((di * row_length) + dj)
+    
+    return (targets[np.minimum(np.searchsorted(targets, neighbour_pixels), len(targets) - 1)] == neighbour_pixels)
+
+def neighbour_index(pixels, targets, neighbours, row_length):
+    """
+    Returns, for every pixel and neighbour offset, the position of that
+    neighbour in targets (sorted flat indices), or -1 if it is not one of them.
+    """
+    index = np.empty((len(pixels), len(neighbours)), dtype=np.int64)
+    index.fill(-1)
+    
+    if (len(targets) == 0):
+        return index
+    
+    for (k, (di, dj)) in enumerate(neighbours):
+        neighbour_pixels = pixels + ((di * row_length) + dj)
+        positions = np.minimum(np.searchsorted(targets, neighbour_pixels), len(targets) - 1)
+        
+        found = (targets[positions] == neighbour_pixels)
+        index[found, k] = positions[found]
+    
+    return index
+
+def pixel_components(neighbours):
+    """
+    Returns (num_components, labels) of the 8-connected components of pixels,
+    given the neighbour_index of every pixel among them.
+    """
+    (pixels, k) = np.nonzero(neighbours >= 0)
+    adjacency = coo_matrix((np.ones(len(pixels), dtype=np.int8), (pixels, neighbours[pixels, k])), shape=(len(neighbours), len(neighbours)))
+    
+    return connected_components(adjacency, directed=False)
+
+class PixelValues:
+    """
+    Skeleton values by (row, col), looked up in the sparse skeleton instead of
+    a full-size image; pixels off the skeleton are 0.
+    """
+    def __init__(self, rows, cols, values, num_cols):
+        self.num_cols = num_cols
+        self.pixels = (rows.astype(np.int64) * num_cols) + cols
+        
+        order = np.argsort(self.pixels, kind='mergesort')
+        self.pixels = self.pixels[order]
+        self.values = values[order]
+    
+    def __getitem__(self, (i, j)):
+        pixel = (i * self.num_cols) + j
+        position = np.searchsorted(self.pixels, pixel)
+        
+        if ((position < len(self.pixels)) and (self.pixels[position] == pixel)):
+            return self.values[position]
+        
+        return 0
+
 class Node:
     def __init__(self, (latitude, longitude), weight):
         self.id = None
@@ -76,22 +184,31 @@ class Graph:
         
         self.create_graph(main_crossings, segments, density_estimate, output_filename)
     
-    def create_graph(self, main_crossings, segments, density_estimate, output_filename):
-        nodes, new_segments, intersections = self.create_nodes_and_new_segments(main_crossings, segments, density_estimate)
+    def extract_sparse(self, sparse_skeleton, output_filename):
+        
+        # the sparse skeleton carries its own bounding box
+        set_raster(sparse_skeleton.bounding_box, *sparse_skeleton.shape)
+        
+        # skeleton pixels in row order, with a two pixel border for the 5 x 5 neighbourhoods; no full-size image is built
+        row_length = sparse_skeleton.shape[1] + 4
+        pixels = padded_flat_pixels(sparse_skeleton.rows.astype(np.int64), sparse_skeleton.cols.astype(np.int64), row_length, 2)
+        order = np.argsort(pixels, kind='mergesort')
+        (pixels, rows, cols) = (pixels[order], sparse_skeleton.rows[order].astype(np.int64), sparse_skeleton.cols[order].astype(np.int64))
         
-        try:
-            os.remove(output_filename)
-        except OSError:
-            pass
+        print "fg_pixels: " + str(len(pixels))
+        classes = self.crossing_classes(pixels, pixels, row_length)
+        print "done."
         
-        conn = sqlite3.connect(output_filename)
-        cur = conn.cursor()
+        main_crossings, segments = self.trace_segments(rows[classes == 2], cols[classes == 2], rows[classes == 1], cols[classes == 1], sparse_skeleton.shape[1])
         
-        cur.execute("CREATE TABLE nodes (id INTEGER, latitude FLOAT, longitude FLOAT, weight FLOAT)")
-        cur.execute("CREATE TABLE edges (id INTEGER, in_node INTEGER, out_node INTEGER, weight FLOAT)")
-        cur.execute("CREATE TABLE segments (id INTEGER, edge_ids TEXT)")
-        cur.execute("CREATE TABLE intersections (node_id INTEGER)")
-        conn.commit()
+        self.create_graph(main_crossings, segments, PixelValues(sparse_skeleton.rows, sparse_skeleton.cols, sparse_skeleton.values, sparse_skeleton.shape[1]), output_filename)
+    
+    def create_graph(self, main_crossings, segments, density_estimate, output_filename):
+        nodes, new_segments, intersections = self.create_nodes_and_new_segments(main_crossings, segments, density_estimate)
+        
+        node_rows = []
+        edge_rows = []
+        segment_rows = []
         
         node_id = 0
         edge_id = 0
@@ -113,18 +230,18 @@ class Graph:
             for node in smoothed_segment:
                 if (node.id is None):
                     node.id = node_id
-                    cur.execute("INSERT INTO nodes VALUES (" + str(node.id) + "," + str(node.latitude) + "," + str(node.longitude) + "," + str(node.weight) + ")")
+                    node_rows.append((node.id, node.latitude, node.longitude, node.weight))
                     node_id += 1
             
             outbound_segment_edge_ids = []
             for i in range(0, len(smoothed_segment) - 1):
-                cur.execute("INSERT INTO edges VALUES (" + str(edge_id) + "," + str(smoothed_segment[i].id) + "," + str(smoothed_segment[i + 1].id) + "," + str(segment_weight) + ")")
+                edge_rows.append((edge_id, smoothed_segment[i].id, smoothed_segment[i + 1].id, segment_weight))
                 outbound_segment_edge_ids.append(edge_id)
                 edge_id += 1
             
             inbound_segment_edge_ids = []
             for i in range(0, len(smoothed_segment) - 1):
-                cur.execute("INSERT INTO edges VALUES (" + str(edge_id) + "," + str(smoothed_segment[i + 1].id) + "," + str(smoothed_segment[i].id) + "," + str(segment_weight) + ")")
+                edge_rows.append((edge_id, smoothed_segment[i + 1].id, smoothed_segment[i].id, segment_weight))
                 inbound_segment_edge_ids.append(edge_id)
                 edge_id += 1
             
@@ -137,17 +254,13 @@ class Graph:
                 print len(inbound_segment_edge_ids)
                 exit()
             
-            cur.execute("INSERT INTO segments VALUES (" + str(segment_id) + ",'" + str(outbound_segment_edge_ids) + "')")
+            segment_rows.append((segment_id, outbound_segment_edge_ids))
             segment_id += 1
             
-            cur.execute("INSERT INTO segments VALUES (" + str(segment_id) + ",'" + str(inbound_segment_edge_ids) + "')")
+            segment_rows.append((segment_id, inbound_segment_edge_ids))
             segment_id += 1
         
-        for intersection in intersections:
-            cur.execute("INSERT INTO intersections VALUES (" + str(intersection.id) + ")")
-        
-        conn.commit()
-        conn.close()
+        write_graphdb(output_filename, node_rows, edge_rows, segment_rows, [intersection.id for intersection in intersections])
     
     def create_nodes_and_new_segments(self, main_crossings, segments, density_estimate):
         density_map = [2**x for x in range(16, 3, -1)] + range(15, 0, -1)
@@ -187,6 +300,123 @@ class Graph:
         return nodes, new_segments, intersections
     
     def find_main_crossings_and_segments(self, skeleton):
+        (crossing_rows, crossing_cols) = np.nonzero(skeleton == 2)
+        (line_rows, line_cols) = np.nonzero(skeleton == 1)
+        
+        return self.trace_segments(crossing_rows, crossing_cols, line_rows, line_cols, skeleton.shape[1])
+    
+    def trace_segments(self, crossing_rows, crossing_cols, line_rows, line_cols, num_cols):
+        """
+        Finds main crossings and segments from the crossing and line pixel
+        coordinates (in row order) of a crossing skeleton with num_cols columns.
+        """
+        print "crossing_pixels: " + str(len(crossing_rows))
+        
+        if (len(crossing_rows) == 0):
+            return {}, []
+        
+        row_length = num_cols + 2
+        
+        # (sorted) flat pixel indices in the raster with a one pixel border
+        crossing_pixels = padded_flat_pixels(crossing_rows, crossing_cols, row_length)
+        line_pixels = padded_flat_pixels(line_rows, line_cols, row_length)
+        
+        #
+        # main crossings: 8-connected blobs of crossing pixels
+        #
+        (num_blobs, crossing_blobs) = pixel_components(neighbour_index(crossing_pixels, crossing_pixels, trace_neighbours, row_length))
+        
+        main_crossings = {}
+        
+        blob_order = np.argsort(crossing_blobs, kind='mergesort')
+        for blob_pixels in np.split(blob_order, np.flatnonzero(np.diff(crossing_blobs[blob_order])) + 1):
+            crossing_stack = zip(crossing_rows[blob_pixels], crossing_cols[blob_pixels])
+            new_main_crossing = MainCrossing(crossing_stack)
+            
+            for crossing in crossing_stack:
+                main_crossings[crossing] = new_main_crossing
+        
+        #
+        # segments: 8-connected components of the remaining line pixels
+        #
+        line_neighbours = neighbour_index(line_pixels, line_pixels, trace_neighbours, row_length)
+        (num_lines, line_components) = pixel_components(line_neighbours)
+        
+        # each component is traced from the first crossing pixel (row by row) and neighbour (north, north-east, ..., north-west) touching it
+        start_lines = neighbour_index(crossing_pixels, line_pixels, crossing_neighbours[0:8], row_length).ravel()
+        touching = np.flatnonzero(start_lines >= 0)
+        (_, first_touches) = np.unique(line_components[start_lines[touching]], return_index=True)
+        first_touches = touching[np.sort(first_touches)]
+        
+        segment_starts = start_lines[first_touches]
+        segment_crossings = first_touches // 8
+        
+        segment_of_component = np.zeros(num_lines, dtype=np.int64)
+        segment_of_component[line_components[segment_starts]] = np.arange(len(segment_starts))
+        
+        # breadth-first order of every component from its start pixel, all components at once:
+        # the next frontier is the unvisited neighbours of the current one, in order of first discovery
+        visited = np.zeros(len(line_pixels), dtype=np.bool_)
+        visited[segment_starts] = True
+        
+        frontier = segment_starts
+        traced_frontiers = [frontier]
+        
+        while (len(frontier) > 0):
+            candidates = line_neighbours[frontier].ravel()
+            candidates = candidates[candidates >= 0]
+            candidates = candidates[~visited[candidates]]
+            
+            (candidates, first_discoveries) = np.unique(candidates, return_index=True)
+            frontier = candidates[np.argsort(first_discoveries)]
+            
+            visited[frontier] = True
+            traced_frontiers.append(frontier)
+        
+        # group the traced pixels by segment, keeping the breadth-first order within each
+        traced = np.concatenate(traced_frontiers)
+        traced_segments = segment_of_component[line_components[traced]]
+        
+        traced_order = np.argsort(traced_segments, kind='mergesort')
+        traced = traced[traced_order]
+        traced_segments = traced_segments[traced_order]
+        segment_bounds = np.searchsorted(traced_segments, np.arange(len(segment_starts) + 1))
+        
+        # first crossing pixel next to every traced pixel, other than the one its segment starts from ("do not return")
+        end_crossings = neighbour_index(line_pixels[traced], crossing_pixels, trace_neighbours, row_length)
+        end_crossings[end_crossings == segment_crossings[traced_segments][:, np.newaxis]] = -1
+        
+        has_end_crossing = (end_crossings >= 0).any(axis=1)
+        end_crossings = end_crossings[np.arange(len(traced)), np.argmax(end_crossings >= 0, axis=1)]
+        
+        segments = []
+        
+        for k in range(0, len(segment_starts)):
+            segment_pixels = traced[segment_bounds[k]:segment_bounds[k + 1]]
+            segment_ends = np.flatnonzero(has_end_crossing[segment_bounds[k]:segment_bounds[k + 1]])
+            
+            # sanity check -- segment is bookended by two different intersections
+            if (len(segment_ends) == 0):
+                print "ERROR!! No intersection at segment end!"
+                exit()
+            
+            # find_edge_nodes searches backwards from the last pixel, but every crossing it appends shifts its
+            # (negative) index back by one, so it keeps appending the crossing of the last pixel next to one,
+            # once for each remaining step: as many times as that pixel's position in the segment
+            last_end = segment_ends[-1]
+            end_crossing = end_crossings[segment_bounds[k] + last_end]
+            
+            segment = [(crossing_rows[segment_crossings[k]], crossing_cols[segment_crossings[k]])]
+            segment.extend(izip(line_rows[segment_pixels], line_cols[segment_pixels]))
+            segment.extend([(crossing_rows[end_crossing], crossing_cols[end_crossing])] * (last_end + 1))
+            
+            segments.append(segment)
+        
+        print "segments: " + str(len(segments))
+        
+        return main_crossings, segments
+    
+    def find_main_crossings_and_segments_per_pixel(self, skeleton):
         crossing_pixels = np.where(skeleton == 2)
         print "crossing_pixels: " + str(len(crossing_pixels[0]))
         
@@ -421,6 +651,54 @@ class Graph:
         return edge_nodes, skeleton
     
     def identify_crossing_points(self, skeleton):
+        (fg_rows, fg_cols) = np.nonzero(skeleton == 1)
+        print "fg_pixels: " + str(len(fg_rows))
+        
+        # flat indices with a two pixel border, so every 5 x 5 neighbourhood is inside the raster
+        row_length = skeleton.shape[1] + 4
+        pixels = padded_flat_pixels(fg_rows, fg_cols, row_length, 2)
+        (foreground_rows, foreground_cols) = np.nonzero(skeleton)
+        foreground_pixels = padded_flat_pixels(foreground_rows, foreground_cols, row_length, 2)
+        
+        classes = self.crossing_classes(pixels, foreground_pixels, row_length)
+        
+        crossing_skeleton = np.copy(skeleton)
+        crossing_skeleton[fg_rows[classes == 0], fg_cols[classes == 0]] = 0
+        crossing_skeleton[fg_rows[classes == 2], fg_cols[classes == 2]] = 2
+        
+        print "done."
+        
+        #imsave("crossing_skeleton.png", crossing_skeleton)
+        return crossing_skeleton
+    
+    def crossing_classes(self, pixels, foreground_pixels, row_length):
+        """
+        Returns 0 (isolated, dropped), 1 (line) or 2 (line end or junction, a
+        crossing point) for every pixel, given as sorted flat indices in a raster
+        with a two pixel border, among the foreground pixels.
+        """
+        p = [neighbour_found(pixels, foreground_pixels, neighbour, row_length) for neighbour in crossing_neighbours]
+        
+        # pack the fringe of every pixel into a 16-bit code
+        fringe_codes = np.zeros(len(pixels), dtype=np.uint16)
+        
+        for k in range(0, 16):
+            inner = np.zeros(len(pixels), dtype=np.bool_)
+            for inner_neighbour in fringe_inner_neighbours[k]:
+                inner |= p[inner_neighbour]
+            
+            fringe_codes |= ((p[8 + k] & inner).astype(np.uint16) << k)
+        
+        connected_component_counts = fringe_component_lut[fringe_codes]
+        
+        # isolated pixels are dropped; line ends and junctions become crossing points
+        classes = np.ones(len(pixels), dtype=np.int8)
+        classes[connected_component_counts == 0] = 0
+        classes[(connected_component_counts == 1) | (connected_component_counts > 2)] = 2
+        
+        return classes
+    
+    def identify_crossing_points_per_pixel(self, skeleton):
         fg_pixels = np.where(skeleton == 1)
         print "fg_pixels: " + str(len(fg_pixels[0]))
         
@@ -457,32 +735,50 @@ import sys, time
 if __name__ == '__main__':
     #
     # usage: python graph_extract.py skeletons/skeleton_7m.png bounding_boxes/bounding_box_7m.txt skeleton_maps/skeleton_map_7m.db
+    #    or: python graph_extract.py skeletons/skeleton_7m.npz skeleton_maps/skeleton_map_7m.db
+    #    or: python graph_extract.py skeletons/skeleton_7m.png skeleton_maps/skeleton_map_7m.db
     #
     skeleton_filename = str(sys.argv[1])
-    bounding_box_filename = str(sys.argv[2])
-    output_filename = str(sys.argv[3])
+    
+    # sparse skeletons (skeleton.py with a .npz output) and skeleton images written by skeleton.py carry their own bounding box
+    if (len(sys.argv) < 4):
+        bounding_box_filename = None
+        output_filename = str(sys.argv[2])
+    else:
+        bounding_box_filename = str(sys.argv[2])
+        output_filename = str(sys.argv[3])
     
     print "skeleton filename: " + str(skeleton_filename)
     print "bounding box filename: " + str(bounding_box_filename)
     print "output filename: " + str(output_filename)
     
-    skeleton = imread(skeleton_filename)
-    
-    # set up globals
-    bounding_box_file = open(bounding_box_filename, 'r')
-    bounding_box_values = bounding_box_file.readline().strip("\n").split(" ")
-    bounding_box_file.close()
-    
-    min_lat, min_lon, max_lat, max_lon = float(bounding_box_values[0]), float(bounding_box_values[1]), float(bounding_box_values[2]), float(bounding_box_values[3])
-    
-    height = len(skeleton)
-    width = len(skeleton[0])
-    
-    yscale = height / (max_lat - min_lat)
-    xscale = width / (max_lon - min_lon)
-    
     g = Graph()
     
-    start_time = time.time()
-    g.extract(skeleton.astype(np.bool).astype(np.int), skeleton, output_filename)
+    if (skeleton_filename.endswith(".npz")):
+        sparse_skeleton = SparseSkeleton.load(skeleton_filename)
+        print "skeleton pixels: " + str(sparse_skeleton.num_pixels)
+        
+        start_time = time.time()
+        g.extract_sparse(sparse_skeleton, output_filename)
+    else:
+        skeleton = imread(skeleton_filename)
+        
+        if (bounding_box_filename is not None):
+            bounding_box = read_bounding_box(bounding_box_filename)
+        else:
+            raster_extent = read_raster_extent(skeleton_filename)
+            
+            if (raster_extent is None):
+                print "Error! " + str(skeleton_filename) + " has no bounding box; give a bounding box file."
+                exit()
+            
+            bounding_box = raster_extent[0]
+        
+        # set up globals
+        set_raster(bounding_box, len(skeleton), len(skeleton[0]))
+        
+        start_time = time.time()
+        # binary skeleton, one byte per pixel; signed for the -1 "do not return" marker
+        g.extract((skeleton > 0).astype(np.int8), skeleton, output_filename)
+    
     print "total elapsed time: " + str(time.time() - start_time) + " seconds"
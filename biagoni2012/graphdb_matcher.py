@@ -16,8 +16,8 @@ TRANSITION_UTURN = 0.00001
 MAX_SPEED_M_PER_S = 20.0
 
 class GraphDBMatcher(GPSMatcher):
-    def __init__(self, mapdb, constraint_length=300, MAX_DIST=100):
-        hmm = self.mapdb_to_hmm(mapdb)
+    def __init__(self, mapdb, constraint_length=300, MAX_DIST=100, bounding_box=None):
+        hmm = self.mapdb_to_hmm(mapdb, bounding_box)
         
         # precompute probability table
         emission_probabilities = map(lambda x: complementary_normal_distribution_cdf(x,0,EMISSION_SIGMA), 
@@ -86,9 +86,14 @@ class GraphDBMatcher(GPSMatcher):
         for node in orig_map.nodes.values():
             self.recursive_map_subdivide(themap, node)
     
-    def mapdb_to_hmm(self,mapdb):
+    def mapdb_to_hmm(self,mapdb,bounding_box=None):
         themap = StreetMap()
-        themap.load_graphdb(mapdb)
+        
+        # only the region of the trips, if given
+        if (bounding_box is not None):
+            themap.load_region(mapdb, bounding_box)
+        else:
+            themap.load_graphdb(mapdb)
         #themap.load_osmdb(mapdb)
         
         sys.stdout.write("Subdividing map... ")
@@ -1,12 +1,14 @@
 from graphdb_matcher import GraphDBMatcher
+from location import TripLoader
+from sparse_skeleton import read_bounding_box
 import spatialfunclib
 import math
 
 MAX_SPEED_M_PER_S = 20.0
 
 class MatchGraphDB:
-    def __init__(self, graphdb_filename, constraint_length, max_dist):
-        self.matcher = GraphDBMatcher(graphdb_filename, constraint_length, max_dist)
+    def __init__(self, graphdb_filename, constraint_length, max_dist, bounding_box=None):
+        self.matcher = GraphDBMatcher(graphdb_filename, constraint_length, max_dist, bounding_box)
         self.constraint_length = constraint_length
     
     def process_trip(self, trip_directory, trip_filename, output_directory):
@@ -15,6 +17,10 @@ class MatchGraphDB:
         raw_observations = map(lambda x: x.strip("\n").split(",")[1:4], trip_file.readlines())
         trip_file.close()
         
+        self.process_observations(raw_observations, output_directory + "/matched_" + trip_filename)
+    
+    def process_observations(self, raw_observations, output_filename):
+        
         V = None
         p = {}
         
@@ -83,7 +89,7 @@ class MatchGraphDB:
         #print "obs states: " + str(len(obs_states))
         assert(len(obs_states) == len(obs))
         
-        out_file = open(output_directory + "/matched_" + trip_filename, 'w')
+        out_file = open(output_filename, 'w')
         
         for i in range(0, len(obs)):
             (obs_lat, obs_lon, obs_time) = obs[i]
@@ -106,8 +112,9 @@ if __name__ == '__main__':
     max_dist = 350
     trip_directory = "trips/trips_7m/"
     output_directory = "trips/matched_trips_7m/"
+    bounding_box_filename = None
     
-    (opts, args) = getopt.getopt(sys.argv[1:],"c:m:d:t:o:h")
+    (opts, args) = getopt.getopt(sys.argv[1:],"c:m:d:t:o:b:h")
     
     for o,a in opts:
         if o == "-c":
@@ -120,8 +127,10 @@ if __name__ == '__main__':
             trip_directory = str(a)
         elif o == "-o":
             output_directory = str(a)
+        elif o == "-b":
+            bounding_box_filename = str(a)
         elif o == "-h":
-            print "Usage: python graphdb_matcher_run.py [-c <constraint_length>] [-m <max_dist>] [-d <graphdb_filename>] [-t <trip_directory>] [-o <output_directory>] [-h]"
+            print "Usage: python graphdb_matcher_run.py [-c <constraint_length>] [-m <max_dist>] [-d <graphdb_filename>] [-t <trip_directory or trip_archive>] [-o <output_directory>] [-b <bounding_box_filename>] [-h]"
             exit()
     
     print "constraint length: " + str(constraint_length)
@@ -129,16 +138,33 @@ if __name__ == '__main__':
     print "graphdb filename: " + str(graphdb_filename)
     print "trip directory: " + str(trip_directory)
     print "output directory: " + str(output_directory)
+    print "bounding box filename: " + str(bounding_box_filename)
     
-    match_graphdb = MatchGraphDB(graphdb_filename, constraint_length, max_dist)
+    # load only the map region of the bounding box (schema version 2 graph databases)
+    if (bounding_box_filename is not None):
+        match_graphdb = MatchGraphDB(graphdb_filename, constraint_length, max_dist, read_bounding_box(bounding_box_filename))
+    else:
+        match_graphdb = MatchGraphDB(graphdb_filename, constraint_length, max_dist)
     
-    all_trip_files = filter(lambda x: x.startswith("trip_") and x.endswith(".txt"), os.listdir(trip_directory))
+    # a single file is a binary trip archive
+    if (os.path.isfile(trip_directory)):
+        trip_store = TripLoader.load_trip_store(trip_directory)
+        
+        for i in range(0, trip_store.num_trips):
+            sys.stdout.write("\rProcessing trip " + str(i + 1) + "/" + str(trip_store.num_trips) + "... ")
+            sys.stdout.flush()
+            
+            (latitudes, longitudes, times) = trip_store.trip_view(i)
+            match_graphdb.process_observations(zip(latitudes.tolist(), longitudes.tolist(), times.tolist()), output_directory + "/matched_trip_" + str(trip_store.trip_ids[i]) + ".txt")
     
-    for i in range(0, len(all_trip_files)):
-        sys.stdout.write("\rProcessing trip " + str(i + 1) + "/" + str(len(all_trip_files)) + "... ")
-        sys.stdout.flush()
+    else:
+        all_trip_files = filter(lambda x: x.startswith("trip_") and x.endswith(".txt"), os.listdir(trip_directory))
         
-        match_graphdb.process_trip(trip_directory, all_trip_files[i], output_directory)
+        for i in range(0, len(all_trip_files)):
+            sys.stdout.write("\rProcessing trip " + str(i + 1) + "/" + str(len(all_trip_files)) + "... ")
+            sys.stdout.flush()
+            
+            match_graphdb.process_trip(trip_directory, all_trip_files[i], output_directory)
     
     sys.stdout.write("done.\n")
     sys.stdout.flush()
@@ -0,0 +1,81 @@
+#
+# Converts a graph database between schema versions (see pylibs/graphdb_writer.py):
+# by default from version 1 (segment edge ids as list text, no keys or indexes)
+# to version 2 (primary keys, segment_edges table, edge and R*Tree indexes).
+#
+# Nodes and edges are streamed from the input to the output, weighted or not,
+# with or without segments, as the input has them. Other tables (such as
+# transitions) are copied as they are.
+#
+
+import sys, os, getopt, sqlite3
+from pylibs import graphdb_reader
+from pylibs.graphdb_writer import GraphDBWriter
+
+# tables of either schema version, with the R*Tree shadow tables
+graph_tables = set(["nodes", "edges", "segments", "segment_edges", "intersections"])
+rtree_tables = ["segment_rtree", "edge_rtree"]
+
+def is_graph_table(table_name):
+    return ((table_name in graph_tables) or any(table_name.startswith(rtree_table) for rtree_table in rtree_tables))
+
+def migrate(input_filename, output_filename, schema_version):
+    if (os.path.abspath(input_filename) == os.path.abspath(output_filename)):
+        raise ValueError("output database must not be the input database")
+    
+    input_conn = sqlite3.connect(input_filename)
+    input_cur = input_conn.cursor()
+    
+    input_version = graphdb_reader.schema_version(input_cur)
+    input_tables = graphdb_reader.table_names(input_cur)
+    
+    weighted = ("weight" in graphdb_reader.table_columns(input_cur, "nodes"))
+    with_segments = ("segments" in input_tables)
+    
+    writer = GraphDBWriter(output_filename, weighted, with_segments, schema_version)
+    
+    if (weighted):
+        writer.add_nodes(input_conn.cursor().execute("SELECT id, latitude, longitude, weight FROM nodes"))
+        writer.add_edges(input_conn.cursor().execute("SELECT id, in_node, out_node, weight FROM edges"))
+    else:
+        writer.add_nodes(input_conn.cursor().execute("SELECT id, latitude, longitude FROM nodes"))
+        writer.add_edges(input_conn.cursor().execute("SELECT id, in_node, out_node FROM edges"))
+    
+    if (with_segments):
+        writer.add_segments(graphdb_reader.read_segments(input_cur, input_version))
+        writer.add_intersections(node_id for (node_id,) in input_conn.cursor().execute("SELECT node_id FROM intersections"))
+    
+    # copy other tables as they are
+    other_tables = input_cur.execute("SELECT name, sql FROM sqlite_master WHERE (type = 'table') AND (name NOT LIKE 'sqlite_%')").fetchall()
+    
+    for (table_name, table_sql) in other_tables:
+        if (not is_graph_table(table_name)):
+            num_columns = len(graphdb_reader.table_columns(input_cur, table_name))
+            
+            writer.cur.execute(table_sql)
+            writer.cur.executemany("INSERT INTO " + table_name + " VALUES (" + ", ".join(["?"] * num_columns) + ")", input_conn.cursor().execute("SELECT * FROM " + table_name))
+    
+    writer.close()
+    input_conn.close()
+    
+    return (input_version, writer.schema_version)
+
+if __name__ == '__main__':
+    schema_version = 2
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"v:h")
+    
+    for o,a in opts:
+        if o == "-v":
+            schema_version = int(a)
+        elif o == "-h":
+            print "Usage: python graphdb_migrate.py [-v <schema_version>] [-h] <input_db_filename> <output_db_filename>"
+            exit()
+    
+    if (len(args) != 2):
+        print "Usage: python graphdb_migrate.py [-v <schema_version>] [-h] <input_db_filename> <output_db_filename>"
+        exit()
+    
+    (input_version, output_version) = migrate(args[0], args[1], schema_version)
+    
+    print "Migrated " + str(args[0]) + " (schema version " + str(input_version) + ") to " + str(args[1]) + " (schema version " + str(output_version) + ")."
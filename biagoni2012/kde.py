@@ -1,7 +1,14 @@
 import cv
 from math import atan2, sqrt, ceil, pi, fmod
 import sys, getopt, os
-from location import TripLoader
+from multiprocessing import Pool
+from location import TripLoader, TripStore
+from kde_state import KDEState
+from quantize import quantize_kde
+from smoothing import smooth
+from rasterize import RasterGrid, rasterize_trips, rasterize_segments, tile_segments, tile_windows
+from raster_extent import write_png_extent, write_raster_info, read_raster_info
+import numpy as np
 from pylibs import spatialfunclib
 from itertools import tee, izip
 import sqlite3
@@ -13,6 +20,19 @@ import sqlite3
 cell_size = 1 # meters
 gaussian_blur = 17
 trips_path = "trips/trips_1m/"
+num_workers = 1 # trip loading and rasterization processes
+rasterizer = "numpy" # histogram backend: "numpy" or "opencv"
+blur_backend = "auto" # smoothing backend: "auto", "opencv", "separable", "fft" or "box"
+accumulator = "uint16" # histogram dtype: "uint16" (saturates after ~2000 trips on a pixel), "uint32" or "float32"
+tile_size = None # pixels per tile side; None builds a single in-memory raster
+state_filename = None # persistent raw histogram (.npz) updated with each run's trips
+output_artifacts = None # comma-separated: "kde", "histogram", "raw_data"; None writes "kde,raw_data", or "kde" with tiles
+output_format = None # "png", "npy" or "raw"; None writes "png", or "npy" with tiles
+output_bit_depth = None # 8, 16 or 32; None writes every artifact at its natural depth
+parallel_tile_size = 1024 # pixels per tile side when rasterizing in-memory histograms in parallel
+
+# tile rasterization job, set before the worker pool forks so workers share the trips without pickling them
+_tile_job = None
 
 def pairwise(iterable):
     "s -> (s0,s1), (s1,s2), (s2, s3), ..."
@@ -20,43 +40,380 @@ def pairwise(iterable):
     next(b, None)
     return izip(a, b)
 
+def smooth_histogram(histogram, blur_size):
+    
+    # 16-bit histograms are blurred in place; wider integer histograms are blurred as float32
+    if (histogram.dtype not in (np.uint16, np.float32)):
+        histogram = histogram.astype(np.float32)
+    
+    return smooth(histogram, blur_size, blur_backend)
+
+class KDEOutputPolicy:
+    """
+    Which KDE artifacts to write, in which format and bit depth.
+    
+    artifacts are any of "kde" (the blurred density), "histogram" (raw trip
+    intensities, before blurring) and "raw_data" (every trip drawn at 255).
+    Formats are "png", "npy" (for numpy.load) and "raw" (headerless, for
+    numpy.memmap, with its shape and dtype in <artifact>.raw.txt). Once
+    set_extent is called, the bounding box and cell size are stored with
+    every artifact (see raster_extent.py). A bit
+    depth of 8 saturates, 16 quantizes adaptively (see quantize.py) and 32
+    keeps float32 (kde) or uint32 values; PNG holds at most 16 bits. With no
+    bit depth, kde is written in 16 bits, raw_data in 8 and histogram in 16 or
+    32, following the accumulator.
+    """
+    def __init__(self, artifacts=("kde", "raw_data"), file_format="png", bit_depth=None):
+        for artifact in artifacts:
+            if (artifact not in ("kde", "histogram", "raw_data")):
+                raise ValueError("unknown KDE artifact: " + str(artifact))
+        
+        if (file_format not in ("png", "npy", "raw")):
+            raise ValueError("unknown KDE output format: " + str(file_format))
+        
+        if (bit_depth not in (None, 8, 16, 32)):
+            raise ValueError("unsupported KDE output bit depth: " + str(bit_depth))
+        
+        if ((file_format == "png") and (bit_depth == 32)):
+            raise ValueError("PNG output supports at most 16 bits")
+        
+        self.artifacts = tuple(artifacts)
+        self.file_format = file_format
+        self.bit_depth = bit_depth
+        self.extent = None
+    
+    def wants(self, artifact):
+        return (artifact in self.artifacts)
+    
+    def convert(self, artifact, image):
+        bit_depth = self.bit_depth
+        
+        # natural bit depth of every artifact
+        if (bit_depth is None):
+            if (artifact == "raw_data"):
+                bit_depth = 8
+            elif ((artifact == "histogram") and (image.dtype != np.uint16)):
+                bit_depth = (16 if (self.file_format == "png") else 32)
+            else:
+                bit_depth = 16
+        
+        return self._convert_to(artifact, image, bit_depth)
+    
+    def tile_bit_depth(self, artifact, dtype):
+        
+        # natural bit depth of tiled artifacts: wide ones stay wide (skeleton.py quantizes kde rasters)
+        if (self.bit_depth is None):
+            if (artifact == "raw_data"):
+                return 8
+            elif (dtype == np.uint16):
+                return 16
+            else:
+                return 32
+        
+        return self.bit_depth
+    
+    def check_tiled(self, artifact_dtypes):
+        """
+        Raises ValueError unless every artifact can be written tile by tile;
+        artifact_dtypes maps artifacts to the dtype of their tiles.
+        """
+        if (self.file_format == "png"):
+            raise ValueError("tiled KDE output cannot be PNG, use npy or raw")
+        
+        for artifact in self.artifacts:
+            if ((self.tile_bit_depth(artifact, artifact_dtypes[artifact]) == 16) and (artifact_dtypes[artifact] != np.uint16)):
+                raise ValueError("tiled " + artifact + " output of a " + str(np.dtype(artifact_dtypes[artifact])) + " accumulator cannot be quantized to 16 bits tile by tile, use 32 bits")
+    
+    def convert_tile(self, artifact, tile):
+        bit_depth = self.tile_bit_depth(artifact, tile.dtype)
+        
+        # adaptive quantization needs the whole raster, so 16-bit tiles are only ever 16-bit already
+        if (bit_depth == 16):
+            return tile
+        
+        return self._convert_to(artifact, tile, bit_depth)
+    
+    def _convert_to(self, artifact, image, bit_depth):
+        if (bit_depth == 8):
+            return np.clip(np.rint(image), 0, 255).astype(np.uint8)
+        elif (bit_depth == 16):
+            return quantize_kde(image)
+        elif ((artifact == "kde") or (image.dtype.kind == 'f')):
+            return image.astype(np.float32)
+        else:
+            return image.astype(np.uint32)
+    
+    def filename(self, artifact):
+        return artifact + "." + self.file_format
+    
+    def set_extent(self, bounding_box, cell_size):
+        self.extent = (tuple(bounding_box), cell_size)
+    
+    def save(self, artifact, image):
+        image = np.ascontiguousarray(self.convert(artifact, image))
+        filename = self.filename(artifact)
+        
+        if (self.file_format == "png"):
+            cv.SaveImage(filename, cv.fromarray(image))
+            
+            if (self.extent is not None):
+                write_png_extent(filename, *self.extent)
+            
+            return filename
+        
+        if (self.file_format == "npy"):
+            np.save(filename, image)
+        
+        else:
+            raw_image = np.memmap(filename, dtype=image.dtype, mode='w+', shape=image.shape)
+            raw_image[...] = image
+            raw_image.flush()
+            del raw_image
+        
+        self._write_info(filename, image.shape, image.dtype)
+        
+        return filename
+    
+    def create_raster(self, artifact, shape, dtype):
+        """
+        Creates the on-disk raster of an artifact written tile by tile (npy or raw).
+        """
+        filename = self.filename(artifact)
+        
+        if (self.file_format == "npy"):
+            raster = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+        else:
+            raster = np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+        
+        self._write_info(filename, shape, dtype)
+        
+        raster.flush()
+        del raster
+        
+        return filename
+    
+    def open_raster(self, artifact):
+        """
+        Opens the on-disk raster of an artifact for writing tiles into it.
+        """
+        filename = self.filename(artifact)
+        
+        if (self.file_format == "npy"):
+            return np.load(filename, mmap_mode='r+')
+        
+        # shape and dtype of the headerless file
+        (shape, dtype, extent) = read_raster_info(filename)
+        
+        return np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+    
+    def _write_info(self, filename, shape, dtype):
+        
+        # raw rasters need their shape and dtype; npy ones only have an info file for their extent
+        if ((self.file_format == "raw") or (self.extent is not None)):
+            write_raster_info(filename, shape, dtype, self.extent)
+
+def _write_tile(output_policy, artifact, tile, tile_image):
+    
+    # tiles do not overlap, so every worker writes its own region of the on-disk raster
+    (row0, col0, tile_height, tile_width) = tile
+    raster = output_policy.open_raster(artifact)
+    raster[row0:row0 + tile_height, col0:col0 + tile_width] = output_policy.convert_tile(artifact, tile_image)
+    raster.flush()
+    del raster
+
+def _rasterize_tile(tile_index):
+    (grid, trip_store, (tile_offsets, segment_starts), all_tiles, blur_size, output_policy, draw_lines) = _tile_job
+    (tile, padded) = all_tiles[tile_index]
+    
+    # rasterize only the segments touching the padded tile, drawing their lines in the same pass if requested
+    tile_histogram = np.zeros((padded[2], padded[3]), dtype=accumulator)
+    tile_lines = (np.zeros((padded[2], padded[3]), dtype=np.uint8) if draw_lines else None)
+    rasterize_segments(grid, trip_store, segment_starts[tile_offsets[tile_index]:tile_offsets[tile_index + 1]], tile_histogram, window=padded, lines=tile_lines)
+    
+    # tile without its halo
+    (row0, col0, tile_height, tile_width) = tile
+    halo_crop = (slice(row0 - padded[0], row0 - padded[0] + tile_height), slice(col0 - padded[1], col0 - padded[1] + tile_width))
+    
+    if (output_policy is not None):
+        if (output_policy.wants("raw_data")):
+            _write_tile(output_policy, "raw_data", tile, tile_lines[halo_crop])
+        
+        # written before 16-bit histograms are blurred in place
+        if (output_policy.wants("histogram")):
+            _write_tile(output_policy, "histogram", tile, tile_histogram[halo_crop])
+        
+        if (output_policy.wants("kde")):
+            if (blur_size > 0):
+                tile_histogram = smooth_histogram(tile_histogram, blur_size)
+            
+            _write_tile(output_policy, "kde", tile, tile_histogram[halo_crop])
+        
+        return None
+    
+    # smooth padded tile
+    if (blur_size > 0):
+        tile_histogram = smooth_histogram(tile_histogram, blur_size)
+    
+    if (tile_lines is not None):
+        tile_lines = tile_lines[halo_crop]
+    
+    return (tile_histogram[halo_crop], tile_lines)
+
+def _rasterize_tiles(grid, trip_store, tile_size, halo, blur_size, output_policy, description, draw_lines=False):
+    global _tile_job
+    
+    all_tiles = list(tile_windows(grid.height, grid.width, tile_size, halo))
+    _tile_job = (grid, trip_store, tile_segments(grid, trip_store, tile_size, halo), all_tiles, blur_size, output_policy, draw_lines)
+    
+    # tiles are independent and results stream back in tile order, so the output does not depend on scheduling
+    if (num_workers > 1):
+        pool = Pool(num_workers)
+        tile_results = pool.imap(_rasterize_tile, range(0, len(all_tiles)))
+    else:
+        pool = None
+        tile_results = (_rasterize_tile(i) for i in range(0, len(all_tiles)))
+    
+    for i, tile_result in enumerate(tile_results):
+        sys.stdout.write("\r" + description + " (tile " + str(i + 1) + "/" + str(len(all_tiles)) + ")... ")
+        sys.stdout.flush()
+        
+        yield (all_tiles[i][0], tile_result)
+    
+    if (pool is not None):
+        pool.close()
+        pool.join()
+    
+    _tile_job = None
+
+def default_output_policy(tiled=False):
+    
+    # tiled rasters default to a single kde.npy
+    if (output_artifacts is not None):
+        artifacts = output_artifacts.split(",")
+    else:
+        artifacts = (["kde"] if tiled else ["kde", "raw_data"])
+    
+    if (output_format is not None):
+        file_format = output_format
+    else:
+        file_format = ("npy" if tiled else "png")
+    
+    return KDEOutputPolicy(artifacts, file_format, output_bit_depth)
+
+def tiled_artifact_dtypes():
+    
+    # dtype of each artifact's tiles: 16-bit histograms are blurred as 16 bits, wider ones as float32
+    return {"histogram": np.dtype(accumulator), "kde": np.dtype(np.uint16 if (accumulator == "uint16") else np.float32), "raw_data": np.dtype(np.uint8)}
+
 class KDE:
     def __init__(self):
         pass
     
-    def create_kde_with_trips(self, all_trips):
+    def create_kde_with_trips(self, all_trips, output_policy=None):
+        
+        if (output_policy is None):
+            output_policy = default_output_policy(tile_size is not None)
+        
+        # metro-scale rasters are built tile by tile, so only outputs that can be written by tile are accepted
+        if (tile_size is not None):
+            try:
+                output_policy.check_tiled(tiled_artifact_dtypes())
+            except ValueError as e:
+                print "Error! " + str(e) + "."
+                sys.exit()
         
         print "trips path: " + str(trips_path)
         print "cell size: " + str(cell_size)
-        print "gaussian blur: " + str(gaussian_blur)
-        
-        # flag to save images
-        save_images = True
+        print "gaussian blur: " + str(gaussian_blur) + " (" + str(blur_backend) + ")"
+        print "accumulator: " + str(accumulator)
+        print "outputs: " + ",".join(output_policy.artifacts) + " (" + output_policy.file_format + ", " + (str(output_policy.bit_depth) + " bits" if (output_policy.bit_depth is not None) else "natural bit depth") + ")"
         
         sys.stdout.write("\nFinding bounding box... ")
         sys.stdout.flush()
         
-        min_lat = all_trips[0].locations[0].latitude
-        max_lat = all_trips[0].locations[0].latitude
-        min_lon = all_trips[0].locations[0].longitude
-        max_lon = all_trips[0].locations[0].longitude
+        (min_lat, min_lon, max_lat, max_lon) = self.find_bounding_box(all_trips)
+        
+        print "done."
+        
+        grid = self.find_raster_grid(min_lat, min_lon, max_lat, max_lon)
+        (height, width, yscale, xscale, min_lat, min_lon) = (grid.height, grid.width, grid.yscale, grid.xscale, grid.min_lat, grid.min_lon)
+        
+        # the bounding box and cell size travel with the outputs, for skeleton.py and graph_extract.py
+        output_policy.set_extent(grid.bounding_box(), cell_size)
+        
+        # metro-scale rasters are built tile by tile, straight to disk
+        if (tile_size is not None):
+            self.create_tiled_kde(all_trips, grid, output_policy)
+            return
+        
+        ##
+        ## Build an aggregate intensity map from all the edges
+        ##
+        
+        if (rasterizer == "opencv"):
+            histogram = np.asarray(self.create_histogram_opencv(all_trips, grid))
+            
+            # the OpenCV backend draws the lines in a second pass
+            if (output_policy.wants("raw_data")):
+                lines = self.draw_lines_opencv(all_trips, grid)
+        else:
+            
+            # lines are drawn in the same pass as the histogram, only if requested
+            lines = (np.zeros((height, width), dtype=np.uint8) if output_policy.wants("raw_data") else None)
+            histogram = self.create_histogram(all_trips, grid, lines)
+        
+        # save the lines
+        if (output_policy.wants("raw_data")):
+            output_policy.save("raw_data", lines)
+        
+        # save the raw histogram before it is blurred in place
+        if (output_policy.wants("histogram")):
+            output_policy.save("histogram", histogram)
+        
+        if (output_policy.wants("kde")):
+            #print "Intensity map acquired."
+            sys.stdout.write("Smoothing... ")
+            sys.stdout.flush()
+            
+            # # create the mask and compute the contour
+            kde_map = smooth_histogram(histogram, gaussian_blur)
+            
+            # wide accumulators are quantized back to 16 bits, compressing only the busiest pixels
+            output_policy.save("kde", kde_map)
+            
+            print "done."
+        
+        print "\nKDE generation complete."
+    
+    def draw_lines_opencv(self, all_trips, grid):
+        
+        (height, width, yscale, xscale, min_lat, min_lon) = (grid.height, grid.width, grid.yscale, grid.xscale, grid.min_lat, grid.min_lon)
+        
+        lines = cv.CreateMat(height,width,cv.CV_8U)
+        cv.SetZero(lines)
+        
+        trip_counter = 1
         
         for trip in all_trips:
-            for location in trip.locations:
-                if (location.latitude < min_lat):
-                    min_lat = location.latitude
-                
-                if (location.latitude > max_lat):
-                    max_lat = location.latitude
-                
-                if (location.longitude < min_lon):
-                    min_lon = location.longitude
-                
-                if (location.longitude > max_lon):
-                    max_lon = location.longitude
+            
+            if ((trip_counter % 10 == 0) or (trip_counter == len(all_trips))):
+                sys.stdout.write("\rCreating drawing (trip " + str(trip_counter) + "/" + str(len(all_trips)) + ")... ")
+                sys.stdout.flush()
+            trip_counter += 1
+            
+            for (orig, dest) in pairwise(trip.locations):
+                oy = height - int(yscale * (orig.latitude - min_lat))
+                ox = int(xscale * (orig.longitude - min_lon))
+                dy = height - int(yscale * (dest.latitude - min_lat))
+                dx = int(xscale * (dest.longitude - min_lon))
+                cv.Line(lines, (ox, oy), (dx, dy), (255), 1, cv.CV_AA)
         
         print "done."
         
+        return np.asarray(lines)
+    
+    def find_raster_grid(self, min_lat, min_lon, max_lat, max_lon):
+        
         # find bounding box for data
         min_lat -= 0.003
         max_lat += 0.003
@@ -73,14 +430,124 @@ class KDE:
         yscale = height / diff_lat # pixels per lat
         xscale = width / diff_lon # pixels per lon
         
+        return RasterGrid(min_lat, min_lon, height, width, yscale, xscale)
+    
+    def create_histogram(self, all_trips, grid, lines=None):
+        
+        # rasterize from columns
+        if (not isinstance(all_trips, TripStore)):
+            all_trips = TripStore.from_trips(all_trips)
+        
+        # aggregate intensity map for all traces, touching only the pixels each segment covers
+        histogram = np.zeros((grid.height, grid.width), dtype=accumulator)
+        
+        if (num_workers > 1):
+            
+            # rasterize unpadded tiles in parallel and place them into the histogram
+            for (tile, (tile_histogram, tile_lines)) in _rasterize_tiles(grid, all_trips, parallel_tile_size, 0, 0, None, "Creating histogram (" + str(all_trips.num_trips) + " trips)", (lines is not None)):
+                (row0, col0, tile_height, tile_width) = tile
+                histogram[row0:row0 + tile_height, col0:col0 + tile_width] = tile_histogram
+                
+                if (lines is not None):
+                    lines[row0:row0 + tile_height, col0:col0 + tile_width] = tile_lines
+        else:
+            sys.stdout.write("Creating histogram (" + str(all_trips.num_trips) + " trips)... ")
+            sys.stdout.flush()
+            
+            rasterize_trips(grid, all_trips, histogram, lines=lines)
+        
+        print "done."
+        
+        return histogram
+    
+    def create_tiled_kde(self, all_trips, grid, output_policy=None):
+        
+        if (output_policy is None):
+            output_policy = default_output_policy(True)
+        
+        artifact_dtypes = tiled_artifact_dtypes()
+        output_policy.check_tiled(artifact_dtypes)
+        
+        # rasterize from columns
+        if (not isinstance(all_trips, TripStore)):
+            all_trips = TripStore.from_trips(all_trips)
+        
+        # pad tiles by the Gaussian kernel radius so that blurred tiles have no seams
+        halo = gaussian_blur / 2
+        
+        print "tile size: " + str(tile_size)
+        
+        # output rasters on disk (npy for numpy.load(mmap_mode='r'), or raw for numpy.memmap); wide
+        # kde rasters are stored blurred as float32 and quantized by skeleton.py, once the global maximum is known
+        for artifact in output_policy.artifacts:
+            raster_dtype = output_policy.convert_tile(artifact, np.zeros((0, 0), dtype=artifact_dtypes[artifact])).dtype
+            
+            print artifact + " raster: " + output_policy.create_raster(artifact, (grid.height, grid.width), raster_dtype) + " (" + str(grid.height) + " x " + str(grid.width) + ", " + str(raster_dtype) + ")"
+        
+        # workers write their tiles straight into the raster files
+        for (tile, tile_result) in _rasterize_tiles(grid, all_trips, tile_size, halo, gaussian_blur, output_policy, "Creating tiled KDE", output_policy.wants("raw_data")):
+            pass
+        
+        print "done."
+        
+        print "\nTiled KDE generation complete."
+    
+    def update_kde_state(self, all_trips, state_filename, output_policy=None):
+        
+        if (output_policy is None):
+            output_policy = default_output_policy()
+        
+        print "trips path: " + str(trips_path)
+        print "cell size: " + str(cell_size)
+        print "gaussian blur: " + str(gaussian_blur) + " (" + str(blur_backend) + ")"
+        print "kde state: " + str(state_filename)
+        
+        # continue from the stored raw histogram, or start a new one around these trips
+        if (os.path.exists(state_filename)):
+            state = KDEState.load(state_filename)
+            
+            if (state.cell_size != cell_size):
+                print "Error! KDE state was built with cell size " + str(state.cell_size) + ", not " + str(cell_size) + "."
+                sys.exit()
+        else:
+            state = KDEState(self.find_raster_grid(*self.find_bounding_box(all_trips)), cell_size)
+        
+        sys.stdout.write("\nAdding " + str(len(all_trips)) + " trips to KDE state... ")
+        sys.stdout.flush()
+        
+        # only the new trips are rasterized; the raster grows by whole pixels if they fall outside it
+        state.add_trips(all_trips)
+        state.save(state_filename)
+        
+        print "done."
+        
+        # the bounding box and cell size travel with the outputs, for skeleton.py and graph_extract.py
+        output_policy.set_extent(state.bounding_box(), state.cell_size)
+        
+        # trip lines are not kept in the state, so only kde and histogram can be exported
+        if (output_policy.wants("histogram")):
+            output_policy.save("histogram", state.histogram)
+        
+        if (output_policy.wants("kde")):
+            sys.stdout.write("Smoothing... ")
+            sys.stdout.flush()
+            
+            # blur on export
+            output_policy.save("kde", state.export(gaussian_blur, blur_backend))
+            
+            print "done."
+        
+        print "\nKDE generation complete."
+    
+    def create_histogram_opencv(self, all_trips, grid):
+        
+        (height, width, yscale, xscale, min_lat, min_lon) = (grid.height, grid.width, grid.yscale, grid.xscale, grid.min_lat, grid.min_lon)
+        
         # aggregate intensity map for all traces
-        themap = cv.CreateMat(height,width,cv.CV_16UC1)
+        histogram_type = {"uint16": cv.CV_16UC1, "uint32": cv.CV_32SC1, "float32": cv.CV_32FC1}[accumulator]
+        themap = cv.CreateMat(height,width,histogram_type)
         cv.SetZero(themap)
         
-        ##
-        ## Build an aggregate intensity map from all the edges
-        ##
-        
         trip_counter = 1
         
         for trip in all_trips:
@@ -92,7 +559,7 @@ class KDE:
             
             temp = cv.CreateMat(height,width,cv.CV_8UC1)
             cv.SetZero(temp)
-            temp16 = cv.CreateMat(height,width,cv.CV_16UC1)
+            temp16 = cv.CreateMat(height,width,histogram_type)
             cv.SetZero(temp16)
             
             for (orig,dest) in pairwise(trip.locations):
@@ -106,55 +573,72 @@ class KDE:
             cv.ConvertScale(temp,temp16,1,0)
             cv.Add(themap,temp16,themap)
         
-        lines = cv.CreateMat(height,width,cv.CV_8U)
-        cv.SetZero(lines)
-        
         print "done."
         
-        trip_counter = 1
+        return themap
+    
+    def find_bounding_box(self, all_trips):
         
-        for trip in all_trips:
-            
-            if ((trip_counter % 10 == 0) or (trip_counter == len(all_trips))):
-                sys.stdout.write("\rCreating drawing (trip " + str(trip_counter) + "/" + str(len(all_trips)) + ")... ")
-                sys.stdout.flush()
-            trip_counter += 1
-            
-            for (orig, dest) in pairwise(trip.locations):
-                oy = height - int(yscale * (orig.latitude - min_lat))
-                ox = int(xscale * (orig.longitude - min_lon))
-                dy = height - int(yscale * (dest.latitude - min_lat))
-                dx = int(xscale * (dest.longitude - min_lon))
-                cv.Line(lines, (ox, oy), (dx, dy), (255), 1, cv.CV_AA)
-                
-        # save the lines
-        cv.SaveImage("raw_data.png", lines)
+        # columnar trip stores compute their bounding box directly
+        if (isinstance(all_trips, TripStore)):
+            return all_trips.bounding_box()
         
-        print "done."
-        #print "Intensity map acquired."
-        sys.stdout.write("Smoothing... ")
-        sys.stdout.flush()
+        min_lat = all_trips[0].locations[0].latitude
+        max_lat = all_trips[0].locations[0].latitude
+        min_lon = all_trips[0].locations[0].longitude
+        max_lon = all_trips[0].locations[0].longitude
         
-        # # create the mask and compute the contour
-        cv.Smooth(themap, themap, cv.CV_GAUSSIAN, gaussian_blur, gaussian_blur)
-        cv.SaveImage("kde.png", themap)
+        for trip in all_trips:
+            for location in trip.locations:
+                if (location.latitude < min_lat):
+                    min_lat = location.latitude
+                
+                if (location.latitude > max_lat):
+                    max_lat = location.latitude
+                
+                if (location.longitude < min_lon):
+                    min_lon = location.longitude
+                
+                if (location.longitude > max_lon):
+                    max_lon = location.longitude
         
-        print "done."
-        print "\nKDE generation complete."
+        return (min_lat, min_lon, max_lat, max_lon)
 
 if __name__ == '__main__':
     
-    opts,args = getopt.getopt(sys.argv[1:],"c:b:p:h")
+    opts,args = getopt.getopt(sys.argv[1:],"c:b:f:p:w:r:a:t:s:o:e:d:h")
     for o,a in opts:
         if o == "-c":
             cell_size=int(a)
         elif o == "-b":
             gaussian_blur = int(a)	
+        elif o == "-f":
+            blur_backend = str(a)
         elif o == "-p":
             trips_path = str(a)
+        elif o == "-w":
+            num_workers = int(a)
+        elif o == "-r":
+            rasterizer = str(a)
+        elif o == "-a":
+            accumulator = str(a)
+        elif o == "-t":
+            tile_size = int(a)
+        elif o == "-s":
+            state_filename = str(a)
+        elif o == "-o":
+            output_artifacts = str(a)
+        elif o == "-e":
+            output_format = str(a)
+        elif o == "-d":
+            output_bit_depth = int(a)
         elif o == "-h":
-            print "Usage: kde.py [-c <cell_size>] [-b <gaussian_blur_size>] [-p <trips_path>] [-h]\n"
+            print "Usage: kde.py [-c <cell_size>] [-b <gaussian_blur_size>] [-f auto|opencv|separable|fft|box] [-p <trips_path>] [-w <num_workers>] [-r numpy|opencv] [-a uint16|uint32|float32] [-t <tile_size>] [-s <state_filename.npz>] [-o kde,histogram,raw_data] [-e png|npy|raw] [-d 8|16|32] [-h]\n"
             sys.exit()
     
     k = KDE()
-    k.create_kde_with_trips(TripLoader.load_all_trips(trips_path))
+    
+    if (state_filename is not None):
+        k.update_kde_state(TripLoader.load_trip_store(trips_path, num_workers), state_filename)
+    else:
+        k.create_kde_with_trips(TripLoader.load_trip_store(trips_path, num_workers))
@@ -0,0 +1,113 @@
+#
+# Persistent, incrementally updated KDE state.
+#
+# The state keeps the raw (un-blurred) trip histogram together with the raster
+# grid it was drawn on and the cell size, so that new trips can be rasterized
+# into it without re-reading old ones. Blurring only happens on export.
+#
+# State files are uncompressed numpy .npz archives holding:
+#
+#   histogram    uint32[height, width], raw trip intensities
+#   grid         float64[4], (min_lat, min_lon, yscale, xscale)
+#   cell_size    float64[1], meters per pixel
+#
+
+import math
+import numpy as np
+from location import TripStore
+from rasterize import RasterGrid, rasterize_trips
+from smoothing import smooth
+
+# padding added around trips when the bounding box has to grow (degrees)
+lat_padding = 0.003
+lon_padding = 0.005
+
+class KDEState:
+    def __init__(self, grid, cell_size, histogram=None):
+        self.grid = grid
+        self.cell_size = cell_size
+        
+        if (histogram is None):
+            histogram = np.zeros((grid.height, grid.width), dtype=np.uint32)
+        
+        if (histogram.shape != (grid.height, grid.width)):
+            raise ValueError("histogram shape " + str(histogram.shape) + " does not match grid (" + str(grid.height) + ", " + str(grid.width) + ")")
+        
+        self.histogram = histogram
+    
+    @staticmethod
+    def load(state_filename):
+        state = np.load(state_filename)
+        
+        (min_lat, min_lon, yscale, xscale) = state["grid"]
+        histogram = state["histogram"]
+        
+        grid = RasterGrid(min_lat, min_lon, histogram.shape[0], histogram.shape[1], yscale, xscale)
+        
+        return KDEState(grid, float(state["cell_size"][0]), histogram)
+    
+    def save(self, state_filename):
+        np.savez(state_filename, histogram=self.histogram, grid=np.array([self.grid.min_lat, self.grid.min_lon, self.grid.yscale, self.grid.xscale]), cell_size=np.array([self.cell_size], dtype=np.float64))
+    
+    def bounding_box(self):
+        return self.grid.bounding_box()
+    
+    def grow(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Grows the raster to cover the given bounding box, plus padding.
+        
+        The raster is extended by whole pixels on the same lattice, so the
+        existing histogram is copied unchanged into the new one and old trips
+        never need to be rasterized again.
+        """
+        grid = self.grid
+        (old_min_lat, old_min_lon, old_max_lat, old_max_lon) = self.bounding_box()
+        
+        # pixels to add on every side
+        bottom = top = left = right = 0
+        
+        if (min_lat < old_min_lat):
+            bottom = int(math.ceil((old_min_lat - min_lat + lat_padding) * grid.yscale))
+        
+        if (max_lat > old_max_lat):
+            top = int(math.ceil((max_lat - old_max_lat + lat_padding) * grid.yscale))
+        
+        if (min_lon < old_min_lon):
+            left = int(math.ceil((old_min_lon - min_lon + lon_padding) * grid.xscale))
+        
+        if (max_lon > old_max_lon):
+            right = int(math.ceil((max_lon - old_max_lon + lon_padding) * grid.xscale))
+        
+        if ((bottom + top + left + right) == 0):
+            return False
+        
+        new_grid = RasterGrid(grid.min_lat - (bottom / grid.yscale), grid.min_lon - (left / grid.xscale), grid.height + bottom + top, grid.width + left + right, grid.yscale, grid.xscale)
+        
+        # rows count down from the top, so old pixels move down by the rows added on top
+        new_histogram = np.zeros((new_grid.height, new_grid.width), dtype=self.histogram.dtype)
+        new_histogram[top:top + grid.height, left:left + grid.width] = self.histogram
+        
+        self.grid = new_grid
+        self.histogram = new_histogram
+        
+        return True
+    
+    def add_trips(self, all_trips, line_value=32):
+        
+        # rasterize from columns
+        if (not isinstance(all_trips, TripStore)):
+            all_trips = TripStore.from_trips(all_trips)
+        
+        if (all_trips.num_locations == 0):
+            return
+        
+        # make room for trips outside the current raster
+        self.grow(*all_trips.bounding_box())
+        
+        rasterize_trips(self.grid, all_trips, self.histogram, line_value)
+    
+    def export(self, blur_size, blur_backend="auto"):
+        """
+        Returns the blurred histogram as a float32 array.
+        """
+        return smooth(self.histogram.astype(np.float32), blur_size, blur_backend)
@@ -6,6 +6,11 @@
 #
 
 import os
+import math
+import time
+from array import array
+from multiprocessing import Pool
+import numpy as np
 from pylibs import spatialfunclib
 
 class Location:
@@ -41,10 +46,278 @@ class Trip:
     def duration(self):
         return (self.end_time - self.start_time)
 
+class TripStore:
+    """
+    Columnar storage for a collection of trips.
+    
+    All locations are kept in contiguous float64 arrays (latitudes, longitudes,
+    times) and an int64 array of location ids, with an int32 offsets array of
+    length num_trips + 1 marking where each trip starts and ends, so trip k
+    spans [offsets[k], offsets[k + 1]). Trip k was read from trip_<trip_ids[k]>.
+    
+    Iterating over the store yields Trip/Location objects one trip at a time,
+    which lets code written against TripLoader.load_all_trips keep working.
+    """
+    
+    def __init__(self, latitudes, longitudes, times, offsets, ids=None, trip_ids=None):
+        self.latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+        self.longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int32)
+        
+        # default location ids are positions within each trip
+        if (ids is None):
+            ids = np.arange(len(self.latitudes), dtype=np.int64) - np.repeat(self.offsets[:-1], np.diff(self.offsets))
+        
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        
+        # default trip ids are trip positions
+        if (trip_ids is None):
+            trip_ids = np.arange(len(self.offsets) - 1, dtype=np.int64)
+        
+        self.trip_ids = np.ascontiguousarray(trip_ids, dtype=np.int64)
+        
+        # sanity check
+        if (len(self.offsets) < 1 or self.offsets[0] != 0 or self.offsets[-1] != len(self.latitudes)):
+            raise ValueError("trip offsets do not cover the location arrays")
+        
+        if not (len(self.latitudes) == len(self.longitudes) == len(self.times) == len(self.ids)):
+            raise ValueError("location arrays differ in length")
+        
+        if (len(self.trip_ids) != len(self.offsets) - 1):
+            raise ValueError("trip ids do not match trip offsets")
+    
+    @property
+    def num_trips(self):
+        return (len(self.offsets) - 1)
+    
+    @property
+    def num_locations(self):
+        return len(self.latitudes)
+    
+    def __len__(self):
+        return self.num_trips
+    
+    def trip_view(self, trip_index):
+        """Returns (latitudes, longitudes, times) views of a single trip, without copying."""
+        start, end = self.offsets[trip_index], self.offsets[trip_index + 1]
+        return (self.latitudes[start:end], self.longitudes[start:end], self.times[start:end])
+    
+    def subset(self, trip_start, trip_end):
+        """Returns a TripStore of trips [trip_start, trip_end), sharing this store's arrays."""
+        start, end = self.offsets[trip_start], self.offsets[trip_end]
+        return TripStore(self.latitudes[start:end], self.longitudes[start:end], self.times[start:end], self.offsets[trip_start:trip_end + 1] - start, self.ids[start:end], self.trip_ids[trip_start:trip_end])
+    
+    def take(self, trip_indices):
+        """Returns a TripStore holding copies of the given trips, in the given order."""
+        trip_indices = np.asarray(trip_indices, dtype=np.int64)
+        lengths = np.diff(self.offsets)[trip_indices]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        location_indices = np.repeat(self.offsets[trip_indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return TripStore(self.latitudes[location_indices], self.longitudes[location_indices], self.times[location_indices], offsets, self.ids[location_indices], self.trip_ids[trip_indices])
+    
+    def trip_views(self):
+        for trip_index in xrange(self.num_trips):
+            yield self.trip_view(trip_index)
+    
+    def bounding_box(self):
+        return (self.latitudes.min(), self.longitudes.min(), self.latitudes.max(), self.longitudes.max())
+    
+    def __getitem__(self, trip_index):
+        
+        # support negative indices, like a list of trips
+        if (trip_index < 0):
+            trip_index += self.num_trips
+        
+        if (trip_index < 0 or trip_index >= self.num_trips):
+            raise IndexError("trip index out of range")
+        
+        start, end = self.offsets[trip_index], self.offsets[trip_index + 1]
+        
+        # create new trip object
+        trip = Trip()
+        
+        # create location objects for this trip only
+        for i in xrange(start, end):
+            trip.add_location(Location(str(self.ids[i]), float(self.latitudes[i]), float(self.longitudes[i]), float(self.times[i])))
+        
+        return trip
+    
+    def __iter__(self):
+        for trip_index in xrange(self.num_trips):
+            yield self[trip_index]
+    
+    @staticmethod
+    def from_trips(trips):
+        
+        # storage for location columns
+        latitudes = array('d')
+        longitudes = array('d')
+        times = array('d')
+        ids = []
+        offsets = [0]
+        
+        # iterate through all trips
+        for trip in trips:
+            for location in trip.locations:
+                latitudes.append(location.latitude)
+                longitudes.append(location.longitude)
+                times.append(location.time)
+                ids.append(_integer_id(location.id, len(ids) - offsets[-1]))
+            
+            offsets.append(len(latitudes))
+        
+        return TripStore(np.frombuffer(latitudes, dtype=np.float64), np.frombuffer(longitudes, dtype=np.float64), np.frombuffer(times, dtype=np.float64), offsets, ids)
+
+def _integer_id(value, default):
+    
+    # ids are stored as integers; fall back to the given position
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+def _load_trip_shard((trips_path, trip_filenames)):
+    
+    # storage for location columns
+    latitudes = array('d')
+    longitudes = array('d')
+    times = array('d')
+    ids = array('l')
+    offsets = array('l', [0])
+    trip_ids = array('l')
+    numbered_trips = array('b')
+    
+    # storage for per-file (locations, seconds) timings
+    file_timings = []
+    
+    # iterate through shard trip filenames
+    for trip_filename in trip_filenames:
+        start_time = time.time()
+        
+        # load trip columns from file
+        num_locations = TripLoader.load_trip_columns_from_file(trips_path + "/" + trip_filename, latitudes, longitudes, times, ids)
+        
+        file_timings.append((num_locations, time.time() - start_time))
+        
+        # if there are 2 or more locations in the new trip
+        if (num_locations >= 2):
+            
+            # close off trip
+            offsets.append(len(latitudes))
+            
+            # trips without a numeric filename get their ids once all shards are loaded
+            trip_ids.append(_integer_id(trip_filename[5:].split(".")[0], -1))
+            numbered_trips.append(trip_ids[-1] != -1 or trip_filename[5:].split(".")[0] == "-1")
+        
+        else:
+            
+            # discard trip
+            del latitudes[offsets[-1]:]
+            del longitudes[offsets[-1]:]
+            del times[offsets[-1]:]
+            del ids[offsets[-1]:]
+    
+    # return columns as arrays
+    return (np.array(offsets, dtype=np.int64), np.array(trip_ids, dtype=np.int64), np.array(ids, dtype=np.int64), np.array(latitudes, dtype=np.float64), np.array(longitudes, dtype=np.float64), np.array(times, dtype=np.float64), np.array(numbered_trips, dtype=np.bool_), file_timings)
+
+def _concatenate(shard_results, column, dtype):
+    return np.concatenate([np.zeros(0, dtype=dtype)] + [shard_result[column] for shard_result in shard_results])
+
+def _report_parse_throughput(file_timings, elapsed_time):
+    num_files = len(file_timings)
+    
+    if (num_files == 0):
+        return
+    
+    num_locations = sum(map(lambda timing: timing[0], file_timings))
+    parse_times = map(lambda timing: timing[1], file_timings)
+    
+    print "Parsed " + str(num_files) + " trip files (" + str(num_locations) + " locations) in " + str(round(elapsed_time, 2)) + " seconds: " + str(int(num_files / max(elapsed_time, 1e-9))) + " files/s, " + str(int(num_locations / max(elapsed_time, 1e-9))) + " locations/s."
+    print "Per-file parse time: mean " + str(round(1000.0 * sum(parse_times) / num_files, 3)) + " ms, max " + str(round(1000.0 * max(parse_times), 3)) + " ms; per-file throughput " + str(int(num_locations / max(sum(parse_times), 1e-9))) + " locations/s."
+
 class TripLoader:
     
     @staticmethod
-    def load_all_trips(trips_path):
+    def load_trip_store(trips_path, num_workers=1):
+        
+        # a single file is a binary trip archive, opened without parsing
+        if (os.path.isfile(trips_path)):
+            from trip_archive import open_trip_archive
+            return open_trip_archive(trips_path)
+        
+        # get trip filenames
+        trip_filenames = sorted(filter(lambda x: x.startswith("trip_"), os.listdir(trips_path)))
+        
+        # split trip filenames into contiguous shards, several per worker to balance load
+        num_shards = max(1, min(len(trip_filenames), num_workers * 4))
+        shard_size = max(1, int(math.ceil(float(len(trip_filenames)) / float(num_shards))))
+        shards = [(trips_path, trip_filenames[i:i + shard_size]) for i in range(0, len(trip_filenames), shard_size)]
+        
+        start_time = time.time()
+        
+        # parse shards, in a process pool if requested; results stream back in order as arrays
+        if (num_workers > 1):
+            pool = Pool(num_workers)
+            shard_results = list(pool.imap(_load_trip_shard, shards))
+            pool.close()
+            pool.join()
+        else:
+            shard_results = map(_load_trip_shard, shards)
+        
+        # report parse throughput
+        _report_parse_throughput([timing for shard_result in shard_results for timing in shard_result[-1]], time.time() - start_time)
+        
+        # storage for trip offsets
+        offsets = [0]
+        
+        # concatenate shard offsets
+        for shard_result in shard_results:
+            offsets.extend((shard_result[0][1:] + offsets[-1]).tolist())
+        
+        # number trips without a numeric filename in order, after the largest numeric trip id, so ids are unique across shards
+        trip_ids = _concatenate(shard_results, 1, np.int64)
+        numbered_trips = _concatenate(shard_results, 6, np.bool_)
+        first_fallback_id = (trip_ids[numbered_trips].max() + 1 if numbered_trips.any() else 0)
+        trip_ids[~numbered_trips] = np.arange(first_fallback_id, first_fallback_id + np.count_nonzero(~numbered_trips), dtype=np.int64)
+        
+        # return trip store
+        return TripStore(_concatenate(shard_results, 3, np.float64), _concatenate(shard_results, 4, np.float64), _concatenate(shard_results, 5, np.float64), offsets, _concatenate(shard_results, 2, np.int64), trip_ids)
+    
+    @staticmethod
+    def load_trip_columns_from_file(trip_filename, latitudes, longitudes, times, ids):
+        
+        # storage for number of locations read
+        num_locations = 0
+        
+        # open trip file
+        trip_file = open(trip_filename, 'r')
+        
+        # read through trip file, a line at a time
+        for trip_location in trip_file:
+            
+            # parse out location elements
+            location_elements = trip_location.strip('\n').split(',')
+            
+            # append location to columns
+            ids.append(_integer_id(location_elements[0], num_locations))
+            latitudes.append(float(location_elements[1]))
+            longitudes.append(float(location_elements[2]))
+            times.append(float(location_elements[3]))
+            num_locations += 1
+        
+        # close trip file
+        trip_file.close()
+        
+        # return number of locations read
+        return num_locations
+    
+    @staticmethod
+    def load_all_trips(trips_path, num_workers=1):
+        
+        # parse in parallel into columns, then build trip objects
+        if (num_workers > 1):
+            return list(TripLoader.load_trip_store(trips_path, num_workers))
         
         # storage for all trips
         all_trips = []
@@ -0,0 +1,331 @@
+#
+# Streaming import of OpenStreetMap files: XML (.osm, .osm.gz, .osm.bz2) or,
+# with pyosmium installed, PBF (.osm.pbf).
+#
+# The file is read once, element by element, and every element is dropped as
+# soon as it is read. Nodes go to an OSM database in batches (see
+# pylibs/osmdb_reader.py), and so do the highway ways that StreetMap loads
+# (valid_highway_values), with JSON tags and a ways_nodes table. In the end
+# the database keeps only the nodes of those ways. Memory stays bounded by the
+# batch size whatever the size of the file.
+#
+# The OSM database is then written as a graph database (schema version 2, see
+# pylibs/graphdb_writer.py), one way at a time. Ways become edges, both ways
+# unless tagged oneway (as load_osmdb reads them), and segments are the runs of
+# a way's edges between junctions (nodes shared by ways). Nodes and edges
+# weigh 1.0. Edges whose nodes are not in the file (ways cut at the border of
+# an extract) are left out.
+#
+
+import sys, os, getopt, sqlite3, json, gzip, bz2, tempfile
+from itertools import groupby
+from xml.etree.cElementTree import iterparse
+from pylibs.graphdb_writer import GraphDBWriter
+from sparse_skeleton import read_bounding_box
+from streetmap import StreetMap, valid_highway_values
+
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+# rows written to the OSM database at a time
+batch_size = 100000
+
+class OSMDBBuilder:
+    def __init__(self, osmdb_filename):
+        try:
+            os.remove(osmdb_filename)
+        except OSError:
+            pass
+        
+        # one transaction for the whole database (see pylibs/graphdb_writer.py)
+        self.conn = sqlite3.connect(osmdb_filename, isolation_level=None)
+        self.cur = self.conn.cursor()
+        
+        self.cur.execute("PRAGMA journal_mode = MEMORY")
+        self.cur.execute("PRAGMA synchronous = OFF")
+        self.cur.execute("BEGIN")
+        
+        # all nodes until the ways are known
+        self.cur.execute("CREATE TABLE all_nodes (id INTEGER PRIMARY KEY, lat FLOAT, lon FLOAT)")
+        self.cur.execute("CREATE TABLE ways (id INTEGER PRIMARY KEY, tags TEXT, nds TEXT)")
+        self.cur.execute("CREATE TABLE ways_nodes (way_id INTEGER, seq INTEGER, node_id INTEGER, PRIMARY KEY (way_id, seq)) WITHOUT ROWID")
+        
+        self.node_rows = []
+        self.way_rows = []
+        self.way_node_rows = []
+        
+        self.num_nodes = 0
+        self.num_ways = 0
+    
+    def add_node(self, node_id, lat, lon):
+        self.node_rows.append((node_id, lat, lon))
+        self.num_nodes += 1
+        
+        if (len(self.node_rows) >= batch_size):
+            self.flush()
+    
+    def add_way(self, way_id, tags, node_ids):
+        # only the ways StreetMap loads
+        if (tags.get("highway") not in valid_highway_values):
+            return
+        
+        self.way_rows.append((way_id, json.dumps(tags), json.dumps(node_ids)))
+        self.way_node_rows.extend((way_id, seq, node_id) for (seq, node_id) in enumerate(node_ids))
+        self.num_ways += 1
+        
+        if (len(self.way_node_rows) >= batch_size):
+            self.flush()
+    
+    def flush(self):
+        # OSM files list the same node more than once only when merged, with the same location
+        self.cur.executemany("INSERT OR REPLACE INTO all_nodes VALUES (?, ?, ?)", self.node_rows)
+        self.cur.executemany("INSERT OR REPLACE INTO ways VALUES (?, ?, ?)", self.way_rows)
+        self.cur.executemany("INSERT OR REPLACE INTO ways_nodes VALUES (?, ?, ?)", self.way_node_rows)
+        
+        self.node_rows = []
+        self.way_rows = []
+        self.way_node_rows = []
+    
+    def close(self):
+        self.flush()
+        
+        # keep the nodes of the highway ways only
+        self.cur.execute("CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat FLOAT, lon FLOAT)")
+        self.cur.execute("INSERT INTO nodes SELECT id, lat, lon FROM all_nodes WHERE id IN (SELECT node_id FROM ways_nodes)")
+        self.cur.execute("DROP TABLE all_nodes")
+        
+        self.cur.execute("COMMIT")
+        self.cur.execute("VACUUM")
+        self.conn.close()
+
+def open_osm_file(osm_filename):
+    if (osm_filename.endswith(".gz")):
+        return gzip.open(osm_filename, 'rb')
+    elif (osm_filename.endswith(".bz2")):
+        return bz2.BZ2File(osm_filename, 'rb')
+    
+    return open(osm_filename, 'rb')
+
+def read_osm_xml(osm_filename, builder):
+    osm_file = open_osm_file(osm_filename)
+    
+    root = None
+    
+    for (event, elem) in iterparse(osm_file, events=("start", "end")):
+        if (event == "start"):
+            if (root is None):
+                root = elem
+            continue
+        
+        if (elem.tag == "node"):
+            builder.add_node(int(elem.get("id")), float(elem.get("lat")), float(elem.get("lon")))
+        elif (elem.tag == "way"):
+            tags = dict((tag.get("k"), tag.get("v")) for tag in elem.iterfind("tag"))
+            builder.add_way(int(elem.get("id")), tags, [int(nd.get("ref")) for nd in elem.iterfind("nd")])
+        elif (elem.tag != "relation"):
+            continue
+        
+        # drop what has been read (children of the root included)
+        root.clear()
+    
+    osm_file.close()
+
+def read_osm_pbf(osm_filename, builder):
+    if (osmium is None):
+        raise ImportError("reading PBF files needs pyosmium (pip install osmium); XML files need nothing else")
+    
+    class Handler(osmium.SimpleHandler):
+        def node(self, node):
+            if (node.location.valid()):
+                builder.add_node(node.id, node.location.lat, node.location.lon)
+        
+        def way(self, way):
+            builder.add_way(way.id, dict((tag.k, tag.v) for tag in way.tags), [nd.ref for nd in way.nodes])
+    
+    Handler().apply_file(osm_filename)
+
+def import_osm(osm_filename, osmdb_filename):
+    """
+    Streams an OSM XML or PBF file into an OSM database holding its highway ways and their nodes.
+    Returns the number of nodes read and of highway ways kept.
+    """
+    builder = OSMDBBuilder(osmdb_filename)
+    
+    if (osm_filename.endswith(".pbf")):
+        read_osm_pbf(osm_filename, builder)
+    else:
+        read_osm_xml(osm_filename, builder)
+    
+    builder.close()
+    
+    return (builder.num_nodes, builder.num_ways)
+
+def write_graphdb(osmdb_filename, graphdb_filename):
+    """
+    Writes the highway ways of an OSM database (as import_osm writes it) as a graph database.
+    """
+    osmdb_conn = sqlite3.connect(osmdb_filename)
+    osmdb_cur = osmdb_conn.cursor()
+    
+    writer = GraphDBWriter(graphdb_filename)
+    
+    writer.add_nodes((node_id, lat, lon, 1.0) for (node_id, lat, lon) in osmdb_conn.cursor().execute("SELECT id, lat, lon FROM nodes"))
+    
+    # number of way nodes at every node: junctions have more than one
+    osmdb_cur.execute("CREATE TEMPORARY TABLE node_refs (id INTEGER PRIMARY KEY, refs INTEGER)")
+    osmdb_cur.execute("INSERT INTO node_refs SELECT ways_nodes.node_id, COUNT(*) FROM ways_nodes JOIN nodes ON (nodes.id = ways_nodes.node_id) GROUP BY ways_nodes.node_id")
+    
+    # way nodes in order, missing nodes with no refs
+    way_nodes = osmdb_cur.execute("SELECT ways.id, ways.tags, ways_nodes.node_id, node_refs.refs FROM ways JOIN ways_nodes ON (ways_nodes.way_id = ways.id) LEFT JOIN node_refs ON (node_refs.id = ways_nodes.node_id) ORDER BY ways.id, ways_nodes.seq")
+    
+    edge_id = 0
+    segment_id = 0
+    
+    for ((way_id, tags), rows) in groupby(way_nodes, lambda row: row[0:2]):
+        two_way = ("oneway" not in json.loads(tags))
+        
+        edge_rows = []
+        segment_rows = []
+        
+        # runs of way nodes that are in the database
+        for (in_database, run) in groupby(rows, lambda row: (row[3] is not None)):
+            if (not in_database):
+                continue
+            
+            run = [(node_id, refs) for (_, _, node_id, refs) in run]
+            
+            forward_edge_ids = []
+            backward_edge_ids = []
+            
+            for i in range(1, len(run)):
+                (in_node_id, out_node_id) = (run[i - 1][0], run[i][0])
+                
+                edge_rows.append((edge_id, in_node_id, out_node_id, 1.0))
+                forward_edge_ids.append(edge_id)
+                edge_id += 1
+                
+                if (two_way):
+                    edge_rows.append((edge_id, out_node_id, in_node_id, 1.0))
+                    backward_edge_ids.insert(0, edge_id)
+                    edge_id += 1
+                
+                # segments end at junctions and at the end of a run
+                if ((run[i][1] > 1) or (i == len(run) - 1)):
+                    segment_rows.append((segment_id, forward_edge_ids))
+                    segment_id += 1
+                    
+                    if (two_way):
+                        segment_rows.append((segment_id, backward_edge_ids))
+                        segment_id += 1
+                    
+                    forward_edge_ids = []
+                    backward_edge_ids = []
+        
+        writer.add_edges(edge_rows)
+        writer.add_segments(segment_rows)
+    
+    # intersections: nodes with more than two neighbors, as StreetMap finds them
+    writer.add_intersections(node_id for (node_id,) in writer.cur.execute("SELECT node_id FROM (SELECT in_node AS node_id, out_node AS neighbor FROM edges UNION SELECT out_node, in_node FROM edges) GROUP BY node_id HAVING COUNT(*) > 2").fetchall())
+    
+    writer.close()
+    osmdb_conn.close()
+
+def import_osm_map(osm_filename, bounding_box=None):
+    """
+    Returns a StreetMap of an OSM XML or PBF file, of the given bounding box only if there is one
+    (see StreetMap.load_region). The OSM and graph databases in between are temporary files.
+    """
+    (osmdb_fd, osmdb_filename) = tempfile.mkstemp(suffix=".db")
+    (graphdb_fd, graphdb_filename) = tempfile.mkstemp(suffix=".db")
+    os.close(osmdb_fd)
+    os.close(graphdb_fd)
+    
+    try:
+        import_osm(osm_filename, osmdb_filename)
+        write_graphdb(osmdb_filename, graphdb_filename)
+        
+        street_map = StreetMap()
+        
+        if (bounding_box is not None):
+            street_map.load_region(graphdb_filename, bounding_box)
+        else:
+            street_map.load_graphdb(graphdb_filename)
+    finally:
+        os.remove(osmdb_filename)
+        os.remove(graphdb_filename)
+    
+    return street_map
+
+if __name__ == '__main__':
+    osmdb_filename = None
+    graphdb_filename = None
+    map_filename = None
+    bounding_box_filename = None
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"d:o:m:b:h")
+    
+    for o,a in opts:
+        if o == "-d":
+            osmdb_filename = str(a)
+        elif o == "-o":
+            graphdb_filename = str(a)
+        elif o == "-m":
+            map_filename = str(a)
+        elif o == "-b":
+            bounding_box_filename = str(a)
+        elif o == "-h":
+            print "Usage: python osm_import.py [-d <osmdb_filename>] [-o <graphdb_filename>] [-m <map_filename>] [-b <bounding_box_filename>] [-h] <osm_filename>"
+            exit()
+    
+    if ((len(args) != 1) or ((osmdb_filename is None) and (graphdb_filename is None) and (map_filename is None))):
+        print "Usage: python osm_import.py [-d <osmdb_filename>] [-o <graphdb_filename>] [-m <map_filename>] [-b <bounding_box_filename>] [-h] <osm_filename>"
+        exit()
+    
+    # OSM database: kept if asked for, temporary otherwise
+    if (osmdb_filename is None):
+        (osmdb_fd, osmdb_filename) = tempfile.mkstemp(suffix=".db")
+        os.close(osmdb_fd)
+        keep_osmdb = False
+    else:
+        keep_osmdb = True
+    
+    sys.stdout.write("Importing " + str(args[0]) + "... ")
+    sys.stdout.flush()
+    
+    (num_nodes, num_ways) = import_osm(args[0], osmdb_filename)
+    
+    print "done (" + str(num_nodes) + " nodes read, " + str(num_ways) + " highway ways kept)."
+    
+    if ((graphdb_filename is not None) or (map_filename is not None)):
+        
+        # graph database: kept if asked for, temporary otherwise
+        if (graphdb_filename is None):
+            (graphdb_fd, graphdb_path) = tempfile.mkstemp(suffix=".db")
+            os.close(graphdb_fd)
+        else:
+            graphdb_path = graphdb_filename
+        
+        sys.stdout.write("Writing graph database... ")
+        sys.stdout.flush()
+        
+        write_graphdb(osmdb_filename, graphdb_path)
+        
+        print "done."
+        
+        if (map_filename is not None):
+            street_map = StreetMap()
+            
+            if (bounding_box_filename is not None):
+                street_map.load_region(graphdb_path, read_bounding_box(bounding_box_filename))
+            else:
+                street_map.load_graphdb(graphdb_path)
+            
+            street_map.write_map_to_file(map_filename)
+        
+        if (graphdb_filename is None):
+            os.remove(graphdb_path)
+    
+    if (not keep_osmdb):
+        os.remove(osmdb_filename)
@@ -0,0 +1,77 @@
+#
+# Converts an OSM database (osmdb, as read by StreetMap.load_osmdb) whose way
+# tags and node lists are Python literal text, such as "{'highway': 'primary'}"
+# and "['1', '2']", into the fast format: tags and node lists as JSON, integer
+# primary keys, and a ways_nodes (way_id, seq, node_id) table holding the node
+# list of every way, one row per node in order.
+#
+# The input is decoded by pylibs/osmdb_reader.py, without eval.
+#
+
+import sys, os, getopt, sqlite3, json
+from pylibs import osmdb_reader
+
+def migrate(input_filename, output_filename):
+    if (os.path.abspath(input_filename) == os.path.abspath(output_filename)):
+        raise ValueError("output database must not be the input database")
+    
+    input_conn = sqlite3.connect(input_filename)
+    input_cur = input_conn.cursor()
+    
+    node_columns = [column[1] for column in input_cur.execute("PRAGMA table_info(nodes)")]
+    
+    try:
+        os.remove(output_filename)
+    except OSError:
+        pass
+    
+    # one transaction for the whole database (see pylibs/graphdb_writer.py)
+    output_conn = sqlite3.connect(output_filename, isolation_level=None)
+    output_cur = output_conn.cursor()
+    
+    output_cur.execute("PRAGMA journal_mode = MEMORY")
+    output_cur.execute("PRAGMA synchronous = OFF")
+    output_cur.execute("BEGIN")
+    
+    if ("tags" in node_columns):
+        output_cur.execute("CREATE TABLE nodes (id INTEGER PRIMARY KEY, tags TEXT, lat FLOAT, lon FLOAT)")
+        output_cur.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?)", ((int(id), json.dumps(osmdb_reader.decode_tags(tags or "{}")), lat, lon) for (id, tags, lat, lon) in input_conn.cursor().execute("SELECT id, tags, lat, lon FROM nodes")))
+    else:
+        output_cur.execute("CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat FLOAT, lon FLOAT)")
+        output_cur.executemany("INSERT INTO nodes VALUES (?, ?, ?)", ((int(id), lat, lon) for (id, lat, lon) in input_conn.cursor().execute("SELECT id, lat, lon FROM nodes")))
+    
+    output_cur.execute("CREATE TABLE ways (id INTEGER PRIMARY KEY, tags TEXT, nds TEXT)")
+    output_cur.execute("CREATE TABLE ways_nodes (way_id INTEGER, seq INTEGER, node_id INTEGER, PRIMARY KEY (way_id, seq)) WITHOUT ROWID")
+    
+    num_ways = 0
+    
+    for (id, tags, nds) in input_conn.cursor().execute("SELECT id, tags, nds FROM ways"):
+        way_id = int(id)
+        node_ids = osmdb_reader.decode_node_ids(nds)
+        
+        output_cur.execute("INSERT INTO ways VALUES (?, ?, ?)", (way_id, json.dumps(osmdb_reader.decode_tags(tags)), json.dumps(node_ids)))
+        output_cur.executemany("INSERT INTO ways_nodes VALUES (?, ?, ?)", ((way_id, seq, node_id) for (seq, node_id) in enumerate(node_ids)))
+        
+        num_ways += 1
+    
+    output_cur.execute("COMMIT")
+    output_conn.close()
+    input_conn.close()
+    
+    return num_ways
+
+if __name__ == '__main__':
+    (opts, args) = getopt.getopt(sys.argv[1:],"h")
+    
+    for o,a in opts:
+        if o == "-h":
+            print "Usage: python osmdb_migrate.py [-h] <input_osmdb_filename> <output_osmdb_filename>"
+            exit()
+    
+    if (len(args) != 2):
+        print "Usage: python osmdb_migrate.py [-h] <input_osmdb_filename> <output_osmdb_filename>"
+        exit()
+    
+    num_ways = migrate(args[0], args[1])
+    
+    print "Migrated " + str(num_ways) + " ways of " + str(args[0]) + " to " + str(args[1]) + "."
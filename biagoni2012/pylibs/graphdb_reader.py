@@ -0,0 +1,57 @@
+#
+# Reading graph databases of either schema version (see graphdb_writer.py).
+#
+# Version 1 segments keep their edge ids as list text, which is parsed here as
+# a list of integers; nothing read from a database is ever evaluated.
+#
+
+from itertools import groupby
+
+def schema_version(cur):
+    """
+    Returns the schema version of the graph database behind cursor cur (1 or 2).
+    """
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    
+    # version 1 databases predate the version number
+    if (version == 0):
+        return 1
+    
+    if (version not in (1, 2)):
+        raise ValueError("unknown graph database schema version: " + str(version))
+    
+    return version
+
+def table_names(cur):
+    """
+    Returns the names of the tables in the database behind cursor cur.
+    """
+    return set(name for (name,) in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+def table_columns(cur, table_name):
+    """
+    Returns the column names of table table_name.
+    """
+    return [column[1] for column in cur.execute("PRAGMA table_info(" + table_name + ")")]
+
+def parse_edge_ids(edge_ids_text):
+    """
+    Parses version 1 segment edge ids, such as "[4, 5, 6]", into a list of integers.
+    """
+    edge_ids_text = edge_ids_text.strip().lstrip("[").rstrip("]")
+    
+    return [int(edge_id.strip().rstrip("L")) for edge_id in edge_ids_text.split(",") if (edge_id.strip() != "")]
+
+def read_segments(cur, version=None):
+    """
+    Returns (id, edge_ids) for all segments, edge_ids being the segment's edges in order.
+    """
+    if (version is None):
+        version = schema_version(cur)
+    
+    if (version == 1):
+        return [(segment_id, parse_edge_ids(edge_ids)) for (segment_id, edge_ids) in cur.execute("SELECT id, edge_ids FROM segments").fetchall()]
+    
+    segment_edges = cur.execute("SELECT segment_id, edge_id FROM segment_edges ORDER BY segment_id, seq").fetchall()
+    
+    return [(segment_id, [edge_id for (_, edge_id) in rows]) for (segment_id, rows) in groupby(segment_edges, lambda row: row[0])]
@@ -0,0 +1,188 @@
+#
+# Bulk writer for graph databases (nodes, edges, segments and intersections tables).
+#
+# Rows are inserted with executemany and bound parameters instead of one
+# string-concatenated INSERT per row; values are bound as Python ints and
+# floats, so rows may hold any numeric type, NumPy scalars included.
+# Everything, table creation included, happens in a single transaction on a
+# connection tuned for a bulk load, and the indexes are only built once all
+# rows are in.
+#
+# Two schema versions can be written, told apart by PRAGMA user_version:
+#
+#   1  the original tables, without keys: nodes, edges, segments (id, edge_ids)
+#      with edge_ids as list text such as "[4, 5, 6]", and intersections
+#
+#   2  (default) the same nodes, edges and intersections with INTEGER PRIMARY
+#      KEYs; segments (id) plus segment_edges (segment_id, seq, edge_id), one
+#      row per edge of a segment in order; indexes on edges (in_node),
+#      edges (out_node) and segment_edges (edge_id); and R*Tree tables
+#      segment_rtree and edge_rtree (id, min_lon, max_lon, min_lat, max_lat)
+#      holding the bounding boxes of the segments and of the edges that belong
+#      to no segment, which together cover every edge and edge node
+#
+
+import os
+import sqlite3
+
+# schema version written unless another one is asked for
+default_schema_version = 2
+
+# pragmas for the bulk load: the database is always written from scratch, so
+# after a crash it is simply written again and needs no on-disk journal
+page_size = 65536 # bytes
+cache_size = -262144 # KiB (negative: size rather than pages)
+journal_mode = "MEMORY"
+synchronous = "OFF"
+
+class GraphDBWriter:
+    def __init__(self, graphdb_filename, weighted=True, with_segments=True, schema_version=None):
+        """
+        Creates (or replaces) graphdb_filename with empty graph tables. Weighted graphs have
+        a weight column for nodes and edges; with_segments adds the segments and intersections
+        tables.
+        """
+        self.weighted = weighted
+        self.with_segments = with_segments
+        self.schema_version = (schema_version if (schema_version is not None) else default_schema_version)
+        
+        if (self.schema_version not in (1, 2)):
+            raise ValueError("unknown graph database schema version: " + str(self.schema_version))
+        
+        try:
+            os.remove(graphdb_filename)
+        except OSError:
+            pass
+        
+        # transactions are handled here, not by the sqlite3 module (which would commit before every CREATE)
+        self.conn = sqlite3.connect(graphdb_filename, isolation_level=None)
+        self.cur = self.conn.cursor()
+        
+        # page size only applies before the first table is created
+        self.cur.execute("PRAGMA page_size = " + str(page_size))
+        self.cur.execute("PRAGMA cache_size = " + str(cache_size))
+        self.cur.execute("PRAGMA journal_mode = " + journal_mode)
+        self.cur.execute("PRAGMA synchronous = " + synchronous)
+        
+        self.cur.execute("BEGIN")
+        
+        if (self.schema_version == 1):
+            key = ""
+        else:
+            key = " PRIMARY KEY"
+        
+        if (weighted):
+            self.cur.execute("CREATE TABLE nodes (id INTEGER" + key + ", latitude FLOAT, longitude FLOAT, weight FLOAT)")
+            self.cur.execute("CREATE TABLE edges (id INTEGER" + key + ", in_node INTEGER, out_node INTEGER, weight FLOAT)")
+        else:
+            self.cur.execute("CREATE TABLE nodes (id INTEGER" + key + ", latitude FLOAT, longitude FLOAT)")
+            self.cur.execute("CREATE TABLE edges (id INTEGER" + key + ", in_node INTEGER, out_node INTEGER)")
+        
+        if (with_segments):
+            if (self.schema_version == 1):
+                self.cur.execute("CREATE TABLE segments (id INTEGER, edge_ids TEXT)")
+            else:
+                self.cur.execute("CREATE TABLE segments (id INTEGER PRIMARY KEY)")
+                self.cur.execute("CREATE TABLE segment_edges (segment_id INTEGER, seq INTEGER, edge_id INTEGER, PRIMARY KEY (segment_id, seq)) WITHOUT ROWID")
+            
+            self.cur.execute("CREATE TABLE intersections (node_id INTEGER" + key + ")")
+        
+        if (self.schema_version == 2):
+            if (with_segments):
+                self.cur.execute("CREATE VIRTUAL TABLE segment_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)")
+            
+            self.cur.execute("CREATE VIRTUAL TABLE edge_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)")
+    
+    def add_nodes(self, node_rows):
+        """
+        Writes (id, latitude, longitude[, weight]) rows, from any iterable.
+        """
+        if (self.weighted):
+            self.cur.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?)", ((int(id), float(latitude), float(longitude), float(weight)) for (id, latitude, longitude, weight) in node_rows))
+        else:
+            self.cur.executemany("INSERT INTO nodes VALUES (?, ?, ?)", ((int(id), float(latitude), float(longitude)) for (id, latitude, longitude) in node_rows))
+    
+    def add_edges(self, edge_rows):
+        """
+        Writes (id, in_node, out_node[, weight]) rows, from any iterable.
+        """
+        if (self.weighted):
+            self.cur.executemany("INSERT INTO edges VALUES (?, ?, ?, ?)", ((int(id), int(in_node), int(out_node), float(weight)) for (id, in_node, out_node, weight) in edge_rows))
+        else:
+            self.cur.executemany("INSERT INTO edges VALUES (?, ?, ?)", ((int(id), int(in_node), int(out_node)) for (id, in_node, out_node) in edge_rows))
+    
+    def add_segments(self, segment_rows):
+        """
+        Writes (id, edge_ids) rows, from any iterable; edge_ids are the segment's edges in order.
+        """
+        if (self.schema_version == 1):
+            self.cur.executemany("INSERT INTO segments VALUES (?, ?)", ((int(segment_id), str([int(edge_id) for edge_id in edge_ids])) for (segment_id, edge_ids) in segment_rows))
+        else:
+            segment_ids = []
+            
+            # one segment_edges row per edge, collecting the segment ids on the way
+            def segment_edge_rows():
+                for (segment_id, edge_ids) in segment_rows:
+                    segment_ids.append((int(segment_id),))
+                    
+                    for (seq, edge_id) in enumerate(edge_ids):
+                        yield (int(segment_id), seq, int(edge_id))
+            
+            self.cur.executemany("INSERT INTO segment_edges VALUES (?, ?, ?)", segment_edge_rows())
+            self.cur.executemany("INSERT INTO segments VALUES (?)", segment_ids)
+    
+    def add_intersections(self, node_ids):
+        """
+        Writes intersection node ids, from any iterable.
+        """
+        self.cur.executemany("INSERT INTO intersections VALUES (?)", ((int(node_id),) for node_id in node_ids))
+    
+    def close(self):
+        """
+        Builds the indexes and commits the whole database.
+        """
+        if (self.schema_version == 1):
+            self.cur.execute("CREATE INDEX nodes_id ON nodes (id)")
+            self.cur.execute("CREATE INDEX edges_id ON edges (id)")
+            
+            if (self.with_segments):
+                self.cur.execute("CREATE INDEX segments_id ON segments (id)")
+        else:
+            self.cur.execute("CREATE INDEX edges_in_node ON edges (in_node)")
+            self.cur.execute("CREATE INDEX edges_out_node ON edges (out_node)")
+            
+            # edge bounding boxes
+            self.cur.execute("CREATE TEMPORARY TABLE edge_boxes (id INTEGER PRIMARY KEY, min_lon FLOAT, max_lon FLOAT, min_lat FLOAT, max_lat FLOAT)")
+            self.cur.execute("INSERT INTO edge_boxes SELECT edges.id, min(a.longitude, b.longitude), max(a.longitude, b.longitude), min(a.latitude, b.latitude), max(a.latitude, b.latitude) FROM edges JOIN nodes AS a ON (a.id = edges.in_node) JOIN nodes AS b ON (b.id = edges.out_node)")
+            
+            # spatial indexes: R*Tree inserts are slow, so there is one box per segment, and one
+            # per edge only for edges that belong to no segment (all edges of graphs without segments)
+            if (self.with_segments):
+                self.cur.execute("CREATE INDEX segment_edges_edge_id ON segment_edges (edge_id)")
+                self.cur.execute("INSERT INTO segment_rtree SELECT segment_edges.segment_id, min(edge_boxes.min_lon), max(edge_boxes.max_lon), min(edge_boxes.min_lat), max(edge_boxes.max_lat) FROM segment_edges JOIN edge_boxes ON (edge_boxes.id = segment_edges.edge_id) GROUP BY segment_edges.segment_id")
+                self.cur.execute("INSERT INTO edge_rtree SELECT * FROM edge_boxes WHERE id NOT IN (SELECT edge_id FROM segment_edges)")
+            else:
+                self.cur.execute("INSERT INTO edge_rtree SELECT * FROM edge_boxes")
+            
+            self.cur.execute("DROP TABLE edge_boxes")
+        
+        self.cur.execute("PRAGMA user_version = " + str(self.schema_version))
+        
+        self.cur.execute("COMMIT")
+        self.conn.close()
+
+def write_graphdb(graphdb_filename, node_rows, edge_rows, segment_rows=None, intersection_ids=None, weighted=True, schema_version=None):
+    """
+    Writes a whole graph database in one go (see GraphDBWriter); segments and intersections
+    tables are written when segment_rows is given.
+    """
+    writer = GraphDBWriter(graphdb_filename, weighted, (segment_rows is not None), schema_version)
+    
+    writer.add_nodes(node_rows)
+    writer.add_edges(edge_rows)
+    
+    if (segment_rows is not None):
+        writer.add_segments(segment_rows)
+        writer.add_intersections(intersection_ids if (intersection_ids is not None) else [])
+    
+    writer.close()
@@ -0,0 +1,97 @@
+#
+# Reading OSM databases (osmdb: nodes (id, lat, lon) and ways (id, tags, nds) tables).
+#
+# Way tags and node lists are decoded without eval. They can be JSON (as
+# osmdb_migrate.py writes them) or the Python literal text of older databases,
+# such as "{'highway': 'residential', 'oneway': 'yes'}" and "['1', '2', '3']";
+# both are tokenized here, and only escaped strings are unquoted by
+# json.loads or ast.literal_eval, which never run code. Tags with other values
+# (such as {'oneway': True} or {'lanes': 2}) are decoded whole by them instead.
+# Databases with a ways_nodes (way_id, seq, node_id) table have their node
+# lists read from it.
+#
+
+import re
+import ast
+import json
+from itertools import groupby
+
+# a single- or double-quoted string, as in Python literals or JSON
+quoted_string = r"u?'(?:[^'\\]|\\.)*'|u?\"(?:[^\"\\]|\\.)*\""
+
+# a "key": "value" pair of strings in a dict
+tag_pair_re = re.compile("(" + quoted_string + r")\s*:\s*(" + quoted_string + ")")
+
+def unquote(token):
+    """
+    Returns the string of a quoted string token.
+    """
+    if ("\\" not in token):
+        return token.lstrip("u")[1:-1]
+    
+    # escapes: JSON, or Python (which also has double-quoted strings, and \x escapes that JSON has not)
+    if (token.startswith('"')):
+        try:
+            return json.loads(token)
+        except ValueError:
+            pass
+    
+    return ast.literal_eval(token)
+
+def decode_tags(tags_text):
+    """
+    Decodes way tags, as JSON or Python dict text, into a dict.
+    """
+    # string pairs, unless the text has anything else but braces and commas between them
+    if (tag_pair_re.sub("", tags_text).strip("{}, \t\r\n") == ""):
+        return dict((unquote(key), unquote(value)) for (key, value) in tag_pair_re.findall(tags_text))
+    
+    try:
+        tags = json.loads(tags_text)
+    except ValueError:
+        tags = ast.literal_eval(tags_text)
+    
+    if (not isinstance(tags, dict)):
+        raise ValueError("Tags are not a dict: " + tags_text)
+    
+    return tags
+
+def decode_node_ids(nds_text):
+    """
+    Decodes a way's node ids, as JSON or Python list text such as "['1', '2']", into a list of integers.
+    """
+    nds_text = nds_text.strip().lstrip("[").rstrip("]")
+    
+    return [int(nd.strip().lstrip("u").strip("'\"").rstrip("L")) for nd in nds_text.split(",") if (nd.strip() != "")]
+
+def table_names(cur):
+    """
+    Returns the names of the tables in the database behind cursor cur.
+    """
+    return set(name for (name,) in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+def read_highway_ways(cur):
+    """
+    Returns (id, tags, node_ids) for all ways tagged highway, tags as a dict and
+    node_ids as a list of integers in way order.
+    """
+    # ways whose tags do not even mention highway are never decoded
+    if ("ways_nodes" in table_names(cur)):
+        rows = cur.execute("SELECT ways.id, ways.tags, ways_nodes.node_id FROM ways JOIN ways_nodes ON (ways_nodes.way_id = ways.id) WHERE ways.tags LIKE '%highway%' ORDER BY ways.rowid, ways_nodes.seq").fetchall()
+        ways = ((way_id, tags, [node_id for (_, _, node_id) in way_rows]) for ((way_id, tags), way_rows) in groupby(rows, lambda row: row[0:2]))
+    else:
+        rows = cur.execute("SELECT id, tags, nds FROM ways WHERE tags LIKE '%highway%'").fetchall()
+        ways = ((way_id, tags, nds) for (way_id, tags, nds) in rows)
+    
+    highway_ways = []
+    
+    for (way_id, tags, nds) in ways:
+        way_tags_dict = decode_tags(tags)
+        
+        if ("highway" in way_tags_dict):
+            if (not isinstance(nds, list)):
+                nds = decode_node_ids(nds)
+            
+            highway_ways.append((way_id, way_tags_dict, [int(node_id) for node_id in nds]))
+    
+    return highway_ways
@@ -0,0 +1,233 @@
+#
+# Polyline and graph simplification (Douglas-Peucker) over NumPy coordinate arrays.
+#
+# The simplifier is iterative: spans waiting to be simplified are kept on a
+# stack instead of the call stack, nothing is sliced or copied per level, and
+# the perpendicular distances of all interior points of a span are computed in
+# one vectorized call. The distances are the same as
+# spatialfunclib.projection_onto_line's, point for point.
+#
+
+import numpy as np
+
+#
+# Global constants (as in spatialfunclib).
+#
+METERS_PER_DEGREE_LATITUDE = 111070.34306591158
+METERS_PER_DEGREE_LONGITUDE = 83044.98918812413
+EARTH_RADIUS = 6371000.0 # meters
+
+#
+# Returns the distances in meters between points specified in degrees, using the default (Haversine formula) method, as spatialfunclib.distance.
+#
+def distances(a_lat, a_lon, b_lat, b_lon):
+    return haversine_distances(a_lat, a_lon, b_lat, b_lon)
+
+#
+# Returns the distances in meters between points specified in degrees, using the Haversine formula.
+#
+def haversine_distances(a_lat, a_lon, b_lat, b_lon):
+    dLat = np.radians(b_lat - a_lat)
+    dLon = np.radians(b_lon - a_lon)
+    
+    a = np.sin(dLat/2.0) * np.sin(dLat/2.0) + np.cos(np.radians(a_lat)) * np.cos(np.radians(b_lat)) * np.sin(dLon/2.0) * np.sin(dLon/2.0)
+    
+    c = 2.0 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    d = EARTH_RADIUS * c
+    
+    return d
+
+#
+# Returns the distances in meters between points specified in degrees, using an approximation method.
+#
+def fast_distances(a_lat, a_lon, b_lat, b_lon):
+    y_dist = METERS_PER_DEGREE_LATITUDE * (a_lat - b_lat)
+    x_dist = METERS_PER_DEGREE_LONGITUDE * (a_lon - b_lon)
+    
+    return np.sqrt((y_dist * y_dist) + (x_dist * x_dist))
+
+#
+# Returns the path bearings between points specified in degrees.
+#
+def path_bearings(a_lat, a_lon, b_lat, b_lon):
+    a_lat = np.radians(a_lat)
+    a_lon = np.radians(a_lon)
+    b_lat = np.radians(b_lat)
+    b_lon = np.radians(b_lon)
+    
+    y = np.sin(b_lon-a_lon) * np.cos(b_lat)
+    x = np.cos(a_lat) * np.sin(b_lat) - np.sin(a_lat) * np.cos(b_lat) * np.cos(b_lon-a_lon)
+    
+    bearing = np.arctan2(y, x)
+    
+    return np.fmod(np.degrees(bearing) + 360.0, 360.0)
+
+#
+# Returns the distances in meters of points C (arrays) from their orthogonal projections onto line AB, as projection_onto_line's third value.
+#
+def projection_distances(a_lat, a_lon, b_lat, b_lon, c_lat, c_lon):
+    ab_angle = path_bearings(a_lat, a_lon, b_lat, b_lon)
+    ac_angle = path_bearings(a_lat, a_lon, c_lat, c_lon)
+    
+    ab_length = distances(a_lat, a_lon, b_lat, b_lon)
+    ac_length = distances(a_lat, a_lon, c_lat, c_lon)
+    
+    meters_along = (ac_length * np.cos(np.radians(ac_angle - ab_angle)))
+    
+    if (ab_length == 0.0):
+        fraction_along = np.zeros(len(meters_along))
+    else:
+        fraction_along = (meters_along / ab_length)
+    
+    projected_lat = a_lat + (fraction_along * (b_lat - a_lat))
+    projected_lon = a_lon + (fraction_along * (b_lon - a_lon))
+    
+    return distances(c_lat, c_lon, projected_lat, projected_lon)
+
+#
+# Returns the indices of the points of a polyline kept by Douglas-Peucker with tolerance epsilon (meters).
+#
+# The kept points are those of the original recursive version: a span whose farthest interior
+# point k is at least epsilon from its chord continues as the two spans [start, k - 1] and
+# [k, end], and a span simplifies to its two end points (twice the same point for a span of one).
+#
+def douglas_peucker_indices(lats, lons, epsilon):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    
+    if (len(lats) == 0):
+        return []
+    
+    kept_indices = []
+    
+    # spans still to simplify, first span on top
+    spans = [(0, len(lats) - 1)]
+    
+    while (len(spans) > 0):
+        (start, end) = spans.pop()
+        
+        if ((end - start) < 2):
+            kept_indices.append(start)
+            kept_indices.append(end)
+            continue
+        
+        d = projection_distances(lats[start], lons[start], lats[end], lons[end], lats[start + 1:end], lons[start + 1:end])
+        
+        # undefined distances never count as the farthest point
+        d[np.isnan(d)] = 0.0
+        
+        # argmax picks the first of equally far points
+        farthest = int(np.argmax(d))
+        
+        if (d[farthest] >= epsilon):
+            index = start + 1 + farthest
+            
+            spans.append((index, end))
+            spans.append((start, index - 1))
+        else:
+            kept_indices.append(start)
+            kept_indices.append(end)
+    
+    return kept_indices
+
+#
+# Returns the points of a polyline (objects with latitude and longitude attributes) kept by Douglas-Peucker with tolerance epsilon (meters).
+#
+def douglas_peucker(points, epsilon):
+    lats = np.array([point.latitude for point in points], dtype=np.float64)
+    lons = np.array([point.longitude for point in points], dtype=np.float64)
+    
+    return [points[i] for i in douglas_peucker_indices(lats, lons, epsilon)]
+
+#
+# Simplifies the chains of a directed graph with Douglas-Peucker with tolerance epsilon (meters).
+#
+# A chain runs between two nodes that are not pass-through nodes; a pass-through node has exactly
+# two neighbours and its edges carry traffic through it in one direction or both. Chain nodes
+# dropped by Douglas-Peucker are removed, and the kept ones are joined in the chain's direction(s).
+#
+# node_coords maps node ids to (latitude, longitude), edges is a list of (in_node, out_node) id
+# pairs. Returns the kept node ids (in node_coords order, isolated nodes included) and the new edges.
+#
+def simplify_graph(node_coords, edges, epsilon):
+    edge_set = set(edges)
+    
+    in_neighbours = {}
+    out_neighbours = {}
+    
+    for (in_node, out_node) in edges:
+        out_neighbours.setdefault(in_node, set()).add(out_node)
+        in_neighbours.setdefault(out_node, set()).add(in_node)
+    
+    def neighbours(node):
+        return in_neighbours.get(node, set()) | out_neighbours.get(node, set())
+    
+    def is_pass_through(node):
+        node_neighbours = neighbours(node)
+        
+        if ((len(node_neighbours) != 2) or (node in node_neighbours)):
+            return False
+        
+        (a, b) = node_neighbours
+        node_in_out = (in_neighbours.get(node, set()), out_neighbours.get(node, set()))
+        
+        return (node_in_out in [(set([a]), set([b])), (set([b]), set([a])), (node_neighbours, node_neighbours)])
+    
+    # walk every chain once, from one of its end nodes
+    visited_steps = set()
+    removed_nodes = set()
+    chain_nodes = set()
+    new_edges = []
+    
+    for node in node_coords:
+        if ((node not in in_neighbours) and (node not in out_neighbours)) or is_pass_through(node):
+            continue
+        
+        for first_step in sorted(neighbours(node)):
+            if ((node, first_step) in visited_steps):
+                continue
+            
+            chain = [node, first_step]
+            
+            while (is_pass_through(chain[-1])):
+                (next_node,) = neighbours(chain[-1]) - set([chain[-2]])
+                chain.append(next_node)
+            
+            visited_steps.add((chain[-1], chain[-2]))
+            chain_nodes.update(chain[1:-1])
+            
+            # all edges of a chain point the same way(s)
+            forward = ((chain[0], chain[1]) in edge_set)
+            backward = ((chain[1], chain[0]) in edge_set)
+            
+            lats = [node_coords[chain_node][0] for chain_node in chain]
+            lons = [node_coords[chain_node][1] for chain_node in chain]
+            
+            kept_indices = douglas_peucker_indices(lats, lons, epsilon)
+            kept_chain = [chain[i] for (j, i) in enumerate(kept_indices) if ((j == 0) or (kept_indices[j - 1] != i))]
+            
+            removed_nodes.update(set(chain[1:-1]) - set(kept_chain))
+            
+            for i in range(0, len(kept_chain) - 1):
+                if (forward):
+                    new_edges.append((kept_chain[i], kept_chain[i + 1]))
+                if (backward):
+                    new_edges.append((kept_chain[i + 1], kept_chain[i]))
+    
+    # cycles made only of pass-through nodes are kept as they are
+    for (in_node, out_node) in edges:
+        if ((in_node not in chain_nodes) and is_pass_through(in_node)):
+            new_edges.append((in_node, out_node))
+    
+    # parallel chains can simplify to the same edge
+    unique_edges = []
+    seen_edges = set()
+    
+    for edge in new_edges:
+        if (edge not in seen_edges):
+            seen_edges.add(edge)
+            unique_edges.append(edge)
+    
+    kept_nodes = [node for node in node_coords if (node not in removed_nodes)]
+    
+    return (kept_nodes, unique_edges)
@@ -0,0 +1,38 @@
+#
+# Adaptive quantization of high dynamic range KDE rasters to 16 bits.
+#
+# skeleton.py thresholds the KDE at a fixed ladder of levels (powers of two
+# from 2**16 down to 16, then 15 to 1), so rasters accumulated in uint32 or
+# float32 must be brought back into the 16-bit range without clipping the
+# busiest roads. Values up to knee are kept as they are, so the low end of the
+# ladder keeps its meaning; values above it are compressed logarithmically so
+# that the raster maximum lands on max_value. Rasters that already fit are
+# only rounded.
+#
+
+import numpy as np
+
+max_value = 65535
+knee = 4096
+
+def quantize_kde(kde_map, out=None):
+    kde_map = np.asarray(kde_map)
+    
+    if (out is None):
+        out = np.empty(kde_map.shape, dtype=np.uint16)
+    
+    map_max = float(kde_map.max()) if (kde_map.size > 0) else 0.0
+    
+    # nothing to compress
+    if (map_max <= max_value):
+        out[...] = np.rint(np.maximum(kde_map, 0))
+        return out
+    
+    values = np.maximum(kde_map, 0).astype(np.float64)
+    
+    # logarithmic compression above the knee, reaching max_value at the raster maximum
+    high = (values > knee)
+    values[high] = knee + ((max_value - knee) * (np.log(values[high] / knee) / np.log(map_max / knee)))
+    
+    out[...] = np.minimum(np.rint(values), max_value)
+    return out
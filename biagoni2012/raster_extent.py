@@ -0,0 +1,125 @@
+#
+# Bounding box and cell size of KDE and skeleton rasters, stored with the
+# raster itself rather than in a separate bounding box file.
+#
+# PNG images carry them in a tEXt chunk (keyword "raster_extent"), added
+# before the image's IEND chunk. numpy rasters (.npy, and headerless .raw
+# for numpy.memmap) have an info file next to them, <raster>.txt, with one
+# line:
+#
+#   height width dtype [min_lat min_lon max_lat max_lon cell_size]
+#
+# where dtype is a numpy dtype string such as "<u2". Raw rasters always have
+# it, as it holds their shape and dtype.
+#
+
+import os
+import struct
+import zlib
+import numpy as np
+
+# tEXt chunk keyword of the extent in PNG images
+png_keyword = "raster_extent"
+
+def extent_text(bounding_box, cell_size):
+    
+    # "min_lat min_lon max_lat max_lon cell_size"
+    return " ".join(str(value) for value in tuple(bounding_box) + (cell_size,))
+
+def parse_extent(values):
+    return (tuple(float(value) for value in values[0:4]), float(values[4]))
+
+def write_png_extent(png_filename, bounding_box, cell_size):
+    """
+    Adds the bounding box and cell size to a PNG image, in a tEXt chunk.
+    """
+    text = png_keyword + "\0" + extent_text(bounding_box, cell_size)
+    chunk = struct.pack(">I", len(text)) + "tEXt" + text + struct.pack(">I", zlib.crc32("tEXt" + text) & 0xffffffff)
+    
+    png_file = open(png_filename, 'r+b')
+    
+    # the image ends with an empty IEND chunk, 12 bytes long; only the end of the file is rewritten
+    png_file.seek(-12, os.SEEK_END)
+    iend = png_file.read(12)
+    
+    if (iend[4:8] != "IEND"):
+        png_file.close()
+        raise ValueError(png_filename + " does not end with an IEND chunk")
+    
+    png_file.seek(-12, os.SEEK_END)
+    png_file.write(chunk + iend)
+    png_file.close()
+
+def read_png_extent(png_filename):
+    """
+    Returns (bounding_box, cell_size) from a PNG image, or None if it has none.
+    """
+    png_file = open(png_filename, 'rb')
+    png_file.seek(8)
+    
+    extent = None
+    
+    # walk the chunks, skipping over their data
+    while (True):
+        header = png_file.read(8)
+        
+        if (len(header) < 8):
+            break
+        
+        (length, chunk_type) = (struct.unpack(">I", header[0:4])[0], header[4:8])
+        
+        if (chunk_type == "IEND"):
+            break
+        
+        if (chunk_type == "tEXt"):
+            (keyword, text) = png_file.read(length).split("\0", 1)
+            png_file.seek(4, os.SEEK_CUR)
+            
+            if (keyword == png_keyword):
+                extent = parse_extent(text.split())
+        else:
+            png_file.seek(length + 4, os.SEEK_CUR)
+    
+    png_file.close()
+    
+    return extent
+
+def write_raster_info(raster_filename, shape, dtype, extent=None):
+    """
+    Writes the info file of a numpy raster: its shape and dtype, and extent,
+    a (bounding_box, cell_size) tuple, if given.
+    """
+    info = str(shape[0]) + " " + str(shape[1]) + " " + np.dtype(dtype).str
+    
+    if (extent is not None):
+        info += " " + extent_text(*extent)
+    
+    info_file = open(raster_filename + ".txt", 'w')
+    info_file.write(info + "\n")
+    info_file.close()
+
+def read_raster_info(raster_filename):
+    """
+    Returns (shape, dtype, extent) from the info file of a numpy raster, with
+    extent as (bounding_box, cell_size), or None if it has none.
+    """
+    info_file = open(raster_filename + ".txt", 'r')
+    values = info_file.readline().split()
+    info_file.close()
+    
+    extent = (parse_extent(values[3:8]) if (len(values) >= 8) else None)
+    
+    return ((int(values[0]), int(values[1])), np.dtype(values[2]), extent)
+
+def read_raster_extent(raster_filename):
+    """
+    Returns (bounding_box, cell_size) of a PNG image or numpy raster, or None
+    if it was stored without them.
+    """
+    if (raster_filename.lower().endswith(".png")):
+        return read_png_extent(raster_filename)
+    
+    if (not os.path.exists(raster_filename + ".txt")):
+        return None
+    
+    return read_raster_info(raster_filename)[2]
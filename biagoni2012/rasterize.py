@@ -0,0 +1,310 @@
+#
+# Vectorized trip rasterization for KDE histograms.
+#
+# Each trip segment is drawn as an anti-aliased (Xiaolin Wu style) line of
+# intensity line_value, touching only the pixels the segment covers. Within a
+# trip every pixel keeps the maximum intensity of the segments crossing it, so
+# a trip counts at most once per pixel, like drawing it into an 8-bit scratch
+# image before adding it to the histogram.
+#
+
+import numpy as np
+
+# number of trip locations rasterized per vectorized batch
+batch_locations = 200000
+
+class RasterGrid:
+    def __init__(self, min_lat, min_lon, height, width, yscale, xscale):
+        self.min_lat = min_lat
+        self.min_lon = min_lon
+        self.height = height
+        self.width = width
+        self.yscale = yscale # pixels per lat
+        self.xscale = xscale # pixels per lon
+    
+    def bounding_box(self):
+        return (self.min_lat, self.min_lon, self.min_lat + (self.height / self.yscale), self.min_lon + (self.width / self.xscale))
+    
+    def pixel_coords(self, latitudes, longitudes):
+        
+        # same truncation as int() on the (non-negative) scaled offsets
+        rows = self.height - (self.yscale * (np.asarray(latitudes) - self.min_lat)).astype(np.int64)
+        cols = (self.xscale * (np.asarray(longitudes) - self.min_lon)).astype(np.int64)
+        
+        return (rows, cols)
+
+def line_pixels(rows0, cols0, rows1, cols1, window=None):
+    """
+    Returns (segment, rows, cols, weights) for anti-aliased lines between
+    integer pixel endpoints, one entry per touched pixel, with weights in [0, 1].
+    If window (row0, col0, height, width) is given, samples outside it along
+    each line's major axis are skipped.
+    """
+    rows0 = np.asarray(rows0, dtype=np.int64)
+    cols0 = np.asarray(cols0, dtype=np.int64)
+    d_rows = np.asarray(rows1, dtype=np.int64) - rows0
+    d_cols = np.asarray(cols1, dtype=np.int64) - cols0
+    
+    # step along the major axis, one sample per pixel
+    steep = (np.abs(d_rows) > np.abs(d_cols))
+    major = np.where(steep, d_rows, d_cols)
+    minor = np.where(steep, d_cols, d_rows)
+    num_samples = np.abs(major) + 1
+    first_k = np.zeros(len(rows0), dtype=np.int64)
+    
+    # long lines only cost the samples that can fall in the window
+    if (window is not None):
+        (row0, col0, window_height, window_width) = window
+        major0 = np.where(steep, rows0, cols0)
+        low = np.where(steep, row0, col0) - major0
+        high = np.where(steep, row0 + window_height, col0 + window_width) - 1 - major0
+        
+        # sample k lies at major0 + k * sign(major)
+        backwards = (major < 0)
+        first_k = np.maximum(np.where(backwards, -high, low), 0)
+        last_k = np.minimum(np.where(backwards, -low, high), np.abs(major))
+        num_samples = np.maximum(last_k - first_k + 1, 0)
+    
+    segment = np.repeat(np.arange(len(rows0)), num_samples)
+    first_sample = np.cumsum(num_samples) - num_samples
+    k = np.arange(num_samples.sum()) - np.repeat(first_sample, num_samples) + first_k[segment]
+    
+    # position along the minor axis, split between the two nearest pixels
+    slope = minor.astype(np.float64) / np.maximum(np.abs(major), 1)
+    major_offset = k * np.sign(major)[segment]
+    minor_offset = k * slope[segment]
+    minor_floor = np.floor(minor_offset)
+    frac = minor_offset - minor_floor
+    minor_floor = minor_floor.astype(np.int64)
+    
+    seg_steep = steep[segment]
+    rows = rows0[segment] + np.where(seg_steep, major_offset, minor_floor)
+    cols = cols0[segment] + np.where(seg_steep, minor_floor, major_offset)
+    
+    # second pixel lies one step further along the minor axis
+    rows2 = rows + np.where(seg_steep, 0, 1)
+    cols2 = cols + np.where(seg_steep, 1, 0)
+    
+    return (np.concatenate((segment, segment)), np.concatenate((rows, rows2)), np.concatenate((cols, cols2)), np.concatenate((1.0 - frac, frac)))
+
+def trip_segments(offsets, num_locations):
+    
+    # consecutive location pairs that do not cross a trip boundary
+    same_trip = np.ones(max(num_locations - 1, 0), dtype=np.bool_)
+    
+    # boundaries of empty trips at either end fall outside the pairs
+    boundaries = np.asarray(offsets[1:-1], dtype=np.int64)
+    boundaries = boundaries[(boundaries > 0) & (boundaries < num_locations)]
+    same_trip[boundaries - 1] = False
+    starts = np.nonzero(same_trip)[0]
+    
+    # trip index of every segment
+    trip_index = np.searchsorted(offsets, starts, side='right') - 1
+    
+    return (starts, trip_index)
+
+def trip_pixel_values(grid, latitudes, longitudes, offsets, line_value=32, window=None):
+    """
+    Returns (pixel_indices, values) of the per-trip saturated intensities
+    for a batch of trips, as flat indices into the window (row0, col0,
+    height, width), which defaults to the whole grid.
+    """
+    (starts, trip_index) = trip_segments(offsets, len(latitudes))
+    
+    return segment_pixel_values(grid, latitudes, longitudes, starts, trip_index, line_value, window)
+
+def segment_pixel_values(grid, latitudes, longitudes, starts, trip_index, line_value=32, window=None):
+    """
+    Returns (pixel_indices, values) like trip_pixel_values, for the segments
+    from location starts[i] to starts[i] + 1 of trip trip_index[i], in trip order.
+    """
+    if (window is None):
+        window = (0, 0, grid.height, grid.width)
+    
+    (row0, col0, window_height, window_width) = window
+    
+    if (len(starts) == 0):
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    
+    (rows0, cols0) = grid.pixel_coords(latitudes[starts], longitudes[starts])
+    (rows1, cols1) = grid.pixel_coords(latitudes[starts + 1], longitudes[starts + 1])
+    
+    (segment, pixel_rows, pixel_cols, weights) = line_pixels(rows0, cols0, rows1, cols1, window)
+    values = np.rint(weights * line_value).astype(np.int64)
+    
+    # clip to the window, dropping zero-intensity samples
+    pixel_rows -= row0
+    pixel_cols -= col0
+    inside = (pixel_rows >= 0) & (pixel_rows < window_height) & (pixel_cols >= 0) & (pixel_cols < window_width) & (values > 0)
+    
+    pixel_indices = (pixel_rows[inside] * window_width) + pixel_cols[inside]
+    values = values[inside]
+    trip_keys = trip_index[segment[inside]] - trip_index[0]
+    
+    # keep the maximum intensity per (trip, pixel): pack (trip, pixel, inverted value)
+    # into one integer key so a single sort groups pixels with the brightest first
+    value_base = line_value + 1
+    packed = (((trip_keys * (window_height * window_width)) + pixel_indices) * value_base) + (line_value - values)
+    packed.sort()
+    
+    keys = packed // value_base
+    first = np.ones(len(packed), dtype=np.bool_)
+    first[1:] = (keys[1:] != keys[:-1])
+    
+    return (keys[first] % (window_height * window_width), line_value - (packed[first] % value_base))
+
+def accumulate(histogram, pixel_indices, values):
+    
+    # flat indices address the histogram memory directly
+    if (not histogram.flags.c_contiguous):
+        raise ValueError("histogram must be C-contiguous")
+    
+    # sum contributions per pixel, then add them with saturation
+    (unique_indices, inverse) = np.unique(pixel_indices, return_inverse=True)
+    sums = np.bincount(inverse, weights=values).astype(np.int64)
+    
+    flat = histogram.reshape(-1)
+    
+    # floating-point accumulators do not saturate
+    if (histogram.dtype.kind == 'f'):
+        flat[unique_indices] += sums
+        return
+    
+    max_value = np.iinfo(histogram.dtype).max
+    flat[unique_indices] = np.minimum(flat[unique_indices].astype(np.int64) + sums, max_value)
+
+def draw_max(image, pixel_indices, values):
+    
+    # flat indices address the image memory directly
+    if (not image.flags.c_contiguous):
+        raise ValueError("image must be C-contiguous")
+    
+    if (len(pixel_indices) == 0):
+        return
+    
+    # keep the brightest value per pixel: pack (pixel, value) into one key, sort, take the last of each pixel
+    value_base = np.iinfo(image.dtype).max + 1
+    packed = (pixel_indices * value_base) + np.minimum(values, value_base - 1)
+    packed.sort()
+    
+    last = np.ones(len(packed), dtype=np.bool_)
+    last[:-1] = ((packed[1:] // value_base) != (packed[:-1] // value_base))
+    
+    unique_indices = packed[last] // value_base
+    
+    flat = image.reshape(-1)
+    flat[unique_indices] = np.maximum(flat[unique_indices], packed[last] % value_base)
+
+def trip_batches(trip_store):
+    
+    # split trips into batches of roughly batch_locations locations
+    trip_start = 0
+    
+    while (trip_start < trip_store.num_trips):
+        trip_end = np.searchsorted(trip_store.offsets, trip_store.offsets[trip_start] + batch_locations, side='right') - 1
+        trip_end = min(max(trip_end, trip_start + 1), trip_store.num_trips)
+        
+        yield (trip_start, trip_end)
+        trip_start = trip_end
+
+def rasterize_trips(grid, trip_store, histogram, line_value=32, window=None, lines=None, lines_value=255):
+    """
+    Adds the trips to histogram. If lines is given, the trips are also drawn
+    into it at lines_value, keeping the brightest value per pixel, like
+    drawing every trip into one image.
+    """
+    # iterate through trip batches
+    for (trip_start, trip_end) in trip_batches(trip_store):
+        start, end = trip_store.offsets[trip_start], trip_store.offsets[trip_end]
+        batch_offsets = trip_store.offsets[trip_start:trip_end + 1] - start
+        
+        (pixel_indices, values) = trip_pixel_values(grid, trip_store.latitudes[start:end], trip_store.longitudes[start:end], batch_offsets, line_value, window)
+        accumulate(histogram, pixel_indices, values)
+        
+        if (lines is not None):
+            draw_max(lines, pixel_indices, np.rint(values * (float(lines_value) / line_value)).astype(np.int64))
+    
+    return histogram
+
+def rasterize_segments(grid, trip_store, starts, histogram, line_value=32, window=None, lines=None, lines_value=255):
+    """
+    Adds the segments starting at locations starts (ascending) to histogram,
+    like rasterize_trips, for the pixels in window.
+    """
+    trip_index = np.searchsorted(trip_store.offsets, starts, side='right') - 1
+    begin = 0
+    
+    # batches of roughly batch_locations segments, never splitting a trip
+    while (begin < len(starts)):
+        end = np.searchsorted(trip_index, trip_index[min(begin + batch_locations, len(starts)) - 1], side='right')
+        
+        (pixel_indices, values) = segment_pixel_values(grid, trip_store.latitudes, trip_store.longitudes, starts[begin:end], trip_index[begin:end], line_value, window)
+        accumulate(histogram, pixel_indices, values)
+        
+        if (lines is not None):
+            draw_max(lines, pixel_indices, np.rint(values * (float(lines_value) / line_value)).astype(np.int64))
+        
+        begin = end
+    
+    return histogram
+
+def tile_segments(grid, trip_store, tile_size, halo):
+    """
+    Returns (tile_offsets, segment_starts), the segments that can touch each
+    padded tile of tile_windows(grid.height, grid.width, tile_size, halo):
+    tile k gets segment_starts[tile_offsets[k]:tile_offsets[k + 1]], the
+    locations its segments start at, in trip order. Segments are bucketed by
+    their own pixel bounding box, so a tile never sees the rest of a trip.
+    """
+    num_tile_rows = -(-grid.height // tile_size)
+    num_tile_cols = -(-grid.width // tile_size)
+    
+    all_tile_ids = [np.zeros(0, dtype=np.int64)]
+    all_starts = [np.zeros(0, dtype=np.int64)]
+    
+    # iterate through trip batches
+    for (trip_start, trip_end) in trip_batches(trip_store):
+        start, end = trip_store.offsets[trip_start], trip_store.offsets[trip_end]
+        (rows, cols) = grid.pixel_coords(trip_store.latitudes[start:end], trip_store.longitudes[start:end])
+        (starts, trip_index) = trip_segments(trip_store.offsets[trip_start:trip_end + 1] - start, len(rows))
+        
+        # tiles whose padded windows meet the segment's bounding box, widened by one pixel for anti-aliasing
+        first_rows = np.maximum((np.minimum(rows[starts], rows[starts + 1]) - 1 - halo) // tile_size, 0)
+        last_rows = np.minimum((np.maximum(rows[starts], rows[starts + 1]) + 1 + halo) // tile_size, num_tile_rows - 1)
+        first_cols = np.maximum((np.minimum(cols[starts], cols[starts + 1]) - 1 - halo) // tile_size, 0)
+        last_cols = np.minimum((np.maximum(cols[starts], cols[starts + 1]) + 1 + halo) // tile_size, num_tile_cols - 1)
+        
+        num_rows = np.maximum(last_rows - first_rows + 1, 0)
+        num_cols = np.maximum(last_cols - first_cols + 1, 0)
+        counts = num_rows * num_cols
+        
+        # one (tile, segment) pair per tile of every bounding box
+        segment = np.repeat(np.arange(len(starts)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        
+        all_tile_ids.append(((first_rows[segment] + (k // num_cols[segment])) * num_tile_cols) + first_cols[segment] + (k % num_cols[segment]))
+        all_starts.append(starts[segment] + start)
+    
+    tile_ids = np.concatenate(all_tile_ids)
+    
+    # stable sort keeps every tile's segments in trip order
+    order = np.argsort(tile_ids, kind='mergesort')
+    tile_offsets = np.concatenate(([0], np.cumsum(np.bincount(tile_ids, minlength=num_tile_rows * num_tile_cols))))
+    
+    return (tile_offsets, np.concatenate(all_starts)[order])
+
+def tile_windows(height, width, tile_size, halo):
+    """
+    Yields (tile, padded) windows as (row0, col0, height, width) tuples that
+    cover the raster, where padded extends tile by halo pixels on every side,
+    clipped to the raster.
+    """
+    for row0 in range(0, height, tile_size):
+        for col0 in range(0, width, tile_size):
+            tile = (row0, col0, min(tile_size, height - row0), min(tile_size, width - col0))
+            
+            padded_row0 = max(row0 - halo, 0)
+            padded_col0 = max(col0 - halo, 0)
+            padded = (padded_row0, padded_col0, min(row0 + tile[2] + halo, height) - padded_row0, min(col0 + tile[3] + halo, width) - padded_col0)
+            
+            yield (tile, padded)
@@ -1,6 +1,6 @@
 from streetmap import StreetMap, Node
 from pylibs import spatialfunclib
-import sqlite3
+from pylibs.graphdb_writer import write_graphdb
 import math
 
 class RefineTopology:
@@ -291,43 +291,27 @@ class RefineTopology:
         sys.stdout.write("Saving new map... ")
         sys.stdout.flush()
         
-        try:
-            os.remove(output_db_filename)
-        except OSError:
-            pass
-        
-        conn = sqlite3.connect(output_db_filename)
-        cur = conn.cursor()
-        
-        cur.execute("CREATE TABLE nodes (id INTEGER, latitude FLOAT, longitude FLOAT, weight FLOAT)")
-        cur.execute("CREATE TABLE edges (id INTEGER, in_node INTEGER, out_node INTEGER, weight FLOAT)")
-        cur.execute("CREATE TABLE segments (id INTEGER, edge_ids TEXT)")
-        cur.execute("CREATE TABLE intersections (node_id INTEGER)")
-        conn.commit()
+        segment_rows = []
+        edge_rows = []
         
         valid_nodes = set()
-        valid_intersections = set()
         
         for segment in self.graphdb.segments.values():
-            cur.execute("INSERT INTO segments VALUES (" + str(segment.id) + ",'" + str(map(lambda edge: edge.id, segment.edges)) + "')")
+            segment_rows.append((segment.id, map(lambda edge: edge.id, segment.edges)))
             
             segment_weight = min(map(lambda edge: edge.weight, segment.edges))
             #print map(lambda edge: edge.weight, segment.edges), min(map(lambda edge: edge.weight, segment.edges))
             
             for edge in segment.edges:
-                cur.execute("INSERT INTO edges VALUES (" + str(edge.id) + "," + str(edge.in_node.id) + "," + str(edge.out_node.id) + "," + str(segment_weight) + ")")
+                edge_rows.append((edge.id, edge.in_node.id, edge.out_node.id, segment_weight))
                 
                 valid_nodes.add(edge.in_node)
                 valid_nodes.add(edge.out_node)
         
-        for node in valid_nodes:
-            cur.execute("INSERT INTO nodes VALUES (" + str(node.id) + "," + str(node.latitude) + "," + str(node.longitude) + "," + str(node.weight) + ")")
-            
-            if (node.id in self.graphdb.intersections):
-                cur.execute("INSERT INTO intersections VALUES (" + str(node.id) + ")")
+        node_rows = [(node.id, node.latitude, node.longitude, node.weight) for node in valid_nodes]
+        intersection_ids = [node.id for node in valid_nodes if (node.id in self.graphdb.intersections)]
         
-        conn.commit()
-        conn.close()
+        write_graphdb(output_db_filename, node_rows, edge_rows, segment_rows, intersection_ids)
         
         sys.stdout.write("done.\n")
         sys.stdout.flush()
@@ -4,25 +4,123 @@ import numpy as np
 import scipy.ndimage as nd
 from scipy.ndimage import imread
 from scipy.misc import imsave, toimage
-from scipy.stats import threshold
 from itertools import izip
 from multiprocessing import Process, Manager, cpu_count
 from threading import Thread
-from scipy.ndimage.morphology import grey_closing
+from morphology import grey_closing_disk
 import math
+import time
+from Queue import Queue
+from quantize import quantize_kde
+import thinning
+from sparse_skeleton import SparseSkeleton, read_bounding_box
+from raster_extent import read_raster_extent, write_png_extent
 
 skeleton_images_path = "skeleton_images/"
+num_workers = int(math.ceil(float(cpu_count()) * 0.75)) # thinning processes, used for large frontiers only
+incremental_ladder = True # walk the threshold ladder over sorted pixels instead of whole images
+skip_unchanged_levels = False # also skip levels that add no foreground (faster, but not identical)
+debug_images = None # DebugImagePolicy for the binary_/skeleton_ images of each level; None writes none
+skeleton_dtype = np.uint8 # skeleton sum images; level counts stay far below 255
+closing_tile_size = 2048 # grey closing tiles (plus a 16 pixel halo); None closes the whole image at once
+
+class DebugImagePolicy:
+    """
+    Which per-level debug images (binary_<threshold>.png and
+    skeleton_<threshold>.png) skeletonize writes into path.
+    
+    levels is a collection of thresholds, or None for every level. With a
+    downsample factor above 1, previews are written instead of full-size
+    images; every preview pixel is the maximum of a downsample x downsample
+    block, so one pixel wide skeleton lines stay visible.
+    
+    Images are encoded and written by a background thread, so thinning does
+    not wait for them; at most max_pending images are queued. close() waits
+    for the writes and re-raises the first error of the writer thread.
+    """
+    def __init__(self, levels=None, downsample=1, path=skeleton_images_path, max_pending=4):
+        if (downsample < 1):
+            raise ValueError("debug image downsample factor must be at least 1")
+        
+        self.levels = (None if (levels is None) else set(levels))
+        self.downsample = int(downsample)
+        self.path = path
+        self.queue = Queue(max_pending)
+        self.writer = None
+        self.error = None
+    
+    def wants(self, threshold):
+        return ((self.levels is None) or (threshold in self.levels))
+    
+    def preview(self, image):
+        
+        # always a copy, since the skeleton keeps changing while the image waits in the queue
+        if (self.downsample == 1):
+            return np.array(image, dtype=np.uint8)
+        
+        factor = self.downsample
+        num_rows = -(-image.shape[0] // factor)
+        num_cols = -(-image.shape[1] // factor)
+        
+        # zero-pad to whole blocks, then take the maximum of every block
+        blocks = np.zeros((num_rows * factor, num_cols * factor), dtype=np.uint8)
+        blocks[:image.shape[0], :image.shape[1]] = image
+        
+        return blocks.reshape(num_rows, factor, num_cols, factor).max(axis=3).max(axis=1)
+    
+    def save(self, name, threshold, image):
+        if (not self.wants(threshold)):
+            return
+        
+        if (self.writer is None):
+            self.writer = Thread(target=self._write_images)
+            self.writer.daemon = True
+            self.writer.start()
+        
+        self.queue.put((self.path + name + "_" + str(threshold) + ".png", self.preview(image)))
+    
+    def _write_images(self):
+        while True:
+            item = self.queue.get()
+            
+            if (item is None):
+                break
+            
+            # keep draining the queue after an error, so that save() never blocks
+            if (self.error is None):
+                try:
+                    imsave(item[0], item[1])
+                except Exception, e:
+                    self.error = e
+    
+    def close(self):
+        if (self.writer is not None):
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        
+        if (self.error is not None):
+            error = self.error
+            self.error = None
+            raise error
 
 class GrayscaleSkeleton:
     def __init__(self):
         pass
     
-    def skeletonize(self, image):
-        image = grey_closing(image, footprint=circle(8), mode='constant', cval=0.0)
-        image = add_zero_mat(image)
-        prev_binary_image = np.zeros_like(image)
+    def skeletonize(self, image, image_bit_depth=None):
+        if (image_bit_depth is None):
+            image_bit_depth = (image.dtype.itemsize * 8) / 2
+        
+        # the ladder only depends on the bit depth, so the values can be kept in 16 bits
+        image = narrow_kde(image)
+        
+        if (incremental_ladder):
+            return self.skeletonize_incremental(image, image_bit_depth)
+        
+        image = self.close_image(image)
+        prev_binary_image = np.zeros(image.shape, dtype=skeleton_dtype)
         
-        image_bit_depth = (image.dtype.itemsize * 8) / 2
         print "image_bit_depth: " + str(image_bit_depth)
         
         #image_thresholds = range(2**image_bit_depth,-1,-16)
@@ -32,21 +130,102 @@ class GrayscaleSkeleton:
         for curr_threshold in image_thresholds:
             print "curr_threshold: " + str(curr_threshold)
             
-            curr_thresh_image = threshold(image, curr_threshold)
+            # pixels kept by scipy.stats.threshold(image, curr_threshold)
+            curr_binary_image = (image >= curr_threshold).view(np.uint8)
             
-            curr_binary_image = curr_thresh_image.astype(np.bool).astype(np.int)
-            imsave(skeleton_images_path + "binary_" + str(curr_threshold) + ".png", curr_binary_image)
+            if (debug_images is not None):
+                debug_images.save("binary", curr_threshold, curr_binary_image)
             
             curr_sum_image = (prev_binary_image + curr_binary_image)
             curr_skeleton_image = self.thin_pixels(curr_sum_image)
-            imsave(skeleton_images_path + "skeleton_" + str(curr_threshold) + ".png", curr_skeleton_image)
+            
+            if (debug_images is not None):
+                debug_images.save("skeleton", curr_threshold, curr_skeleton_image)
+            
             print "curr_skeleton max: " + str(curr_skeleton_image.max())
             
             prev_binary_image = curr_skeleton_image
         
+        if (debug_images is not None):
+            debug_images.close()
+        
         return remove_zero_mat(prev_binary_image)
     
-    def thin_pixels(self, image):
+    def skeletonize_incremental(self, image, image_bit_depth):
+        image = self.close_image(image)
+        
+        print "image_bit_depth: " + str(image_bit_depth)
+        
+        image_thresholds = [2**x for x in range(image_bit_depth, 3, -1)] + range(15, 0, -1)
+        print "image_thresholds: " + str(image_thresholds)
+        
+        # foreground pixels sorted by decreasing intensity, so that every level only visits the pixels it adds
+        # (an ascending sort, reversed: negating would wrap the unsigned 16-bit values)
+        fg_pixels = np.flatnonzero(image)
+        fg_values = image.reshape(-1)[fg_pixels]
+        order = np.argsort(fg_values, kind='mergesort')[::-1]
+        fg_pixels = fg_pixels[order]
+        fg_values = fg_values[order]
+        
+        # sum of the previous skeleton and the current binary image
+        skeleton_image = np.zeros(image.shape, dtype=skeleton_dtype)
+        skeleton_flat = skeleton_image.reshape(-1)
+        num_fg_pixels = 0
+        
+        print "level  threshold  new pixels  foreground  removable  skeleton  seconds"
+        
+        for curr_threshold in image_thresholds:
+            level_start_time = time.time()
+            
+            # pixels at or above the threshold, as kept by threshold()
+            curr_num_fg_pixels = len(fg_values) - np.searchsorted(fg_values[::-1], curr_threshold, side='left')
+            num_new_pixels = curr_num_fg_pixels - num_fg_pixels
+            num_fg_pixels = curr_num_fg_pixels
+            
+            # nothing to thin yet; optionally skip levels that add nothing either
+            if ((num_fg_pixels == 0) or (skip_unchanged_levels and (num_new_pixels == 0))):
+                continue
+            
+            curr_fg_pixels = fg_pixels[:num_fg_pixels]
+            
+            if ((debug_images is not None) and debug_images.wants(curr_threshold)):
+                curr_binary_image = np.zeros(image.shape, dtype=np.uint8)
+                curr_binary_image.reshape(-1)[curr_fg_pixels] = 1
+                debug_images.save("binary", curr_threshold, curr_binary_image)
+            
+            # previous skeleton pixels become >= 2 (kept), all other foreground pixels become 1 (removable)
+            skeleton_flat[curr_fg_pixels] += 1
+            num_removable_pixels = int((skeleton_flat[curr_fg_pixels] == 1).sum())
+            
+            self.thin_pixels(skeleton_image, curr_fg_pixels)
+            
+            if (debug_images is not None):
+                debug_images.save("skeleton", curr_threshold, skeleton_image)
+            
+            num_skeleton_pixels = int((skeleton_flat[curr_fg_pixels] > 0).sum())
+            
+            print "%5d  %9d  %10d  %10d  %9d  %8d  %7.2f" % (image_thresholds.index(curr_threshold), curr_threshold, num_new_pixels, num_fg_pixels, num_removable_pixels, num_skeleton_pixels, time.time() - level_start_time)
+        
+        if (debug_images is not None):
+            debug_images.close()
+        
+        return remove_zero_mat(skeleton_image)
+    
+    def close_image(self, image):
+        
+        # grey closing with the radius 8 disk (same result as scipy's grey_closing, see morphology.py),
+        # written straight into the zero-padded image
+        closed_image = np.zeros((image.shape[0] + 2, image.shape[1] + 2), dtype=image.dtype)
+        grey_closing_disk(image, 8, closing_tile_size, out=closed_image[1:-1, 1:-1])
+        
+        return closed_image
+    
+    def thin_pixels(self, image, candidate_pixels=None):
+        
+        # lookup-table thinning on whole arrays; same result as thin_pixels_subiterations (see check_thinning.py)
+        return thinning.thin(np.ascontiguousarray(image), num_workers, candidate_pixels)
+    
+    def thin_pixels_subiterations(self, image):
         pixel_removed = True
         
         neighbors = nd.convolve((image>0).astype(np.int),[[1,1,1],[1,0,1],[1,1,1]],mode='constant',cval=0.0)
@@ -189,23 +368,20 @@ class GrayscaleSkeleton:
 def add_zero_mat(image):
     num_rows, num_cols = image.shape
     
-    image = np.insert(image, num_rows, np.zeros(num_cols, dtype=np.int), 0)
-    image = np.insert(image, 0, np.zeros(num_cols, dtype=np.int), 0)
-    
-    num_rows, num_cols = image.shape
+    # one zero border pixel on every side, copied once into a preallocated array
+    padded_image = np.zeros((num_rows + 2, num_cols + 2), dtype=image.dtype)
+    padded_image[1:-1, 1:-1] = image
     
-    image = np.insert(image, num_cols, np.zeros(num_rows, dtype=np.int), 1)
-    image = np.insert(image, 0, np.zeros(num_rows, dtype=np.int), 1)
-    
-    return image
+    return padded_image
 
 def remove_zero_mat(image):
-    num_rows, num_cols = image.shape
+    return image[1:-1, 1:-1].copy()
+
+def narrow_kde(image):
     
-    image = np.delete(image, num_rows - 1, 0)
-    image = np.delete(image, 0, 0)
-    image = np.delete(image, num_cols - 1, 1)
-    image = np.delete(image, 0, 1)
+    # 16-bit PNGs come back from imread as int32; keep them in uint16 when the values fit
+    if ((image.dtype.kind in "iu") and (image.dtype.itemsize > 2) and (image.size > 0) and (image.min() >= 0) and (image.max() <= 65535)):
+        return image.astype(np.uint16)
     
     return image
 
@@ -214,20 +390,115 @@ def circle(radius):
     circle = (x - radius) ** 2 + (y - radius) ** 2
     return (circle <= (radius ** 2)).astype(np.int)
 
-import sys, time
+import sys, time, getopt
 if __name__ == '__main__':
-    input_filename = str(sys.argv[1])
-    output_filename = str(sys.argv[2])
+    debug_levels = None
+    debug_downsample = None
+    bounding_box_filename = None
+    cell_size = None
+    graph_filename = None
+    
+    # options come before the file names
+    (opts, args) = getopt.getopt(sys.argv[1:],"l:s:p:b:c:g:h")
+    
+    for o,a in opts:
+        if o == "-l":
+            debug_levels = str(a)
+        elif o == "-s":
+            debug_downsample = int(a)
+        elif o == "-p":
+            skeleton_images_path = str(a)
+        elif o == "-b":
+            bounding_box_filename = str(a)
+        elif o == "-c":
+            cell_size = float(a)
+        elif o == "-g":
+            graph_filename = str(a)
+        elif o == "-h":
+            print "Usage: python skeleton.py [-l <debug_levels>|all] [-s <debug_downsample>] [-p <skeleton_images_path>] [-b <bounding_box_filename>] [-c <cell_size>] [-g <graph_db>] [-h] <input_kde> <output_skeleton> [<num_workers>]"
+            exit()
+    
+    input_filename = str(args[0])
+    output_filename = str(args[1])
+    
+    # optional number of thinning processes
+    if (len(args) > 2):
+        num_workers = int(args[2])
+    
+    # per-level debug images, only when asked for
+    if ((debug_levels is not None) or (debug_downsample is not None)):
+        if ((debug_levels is None) or (debug_levels == "all")):
+            levels = None
+        else:
+            levels = [int(level) for level in debug_levels.split(",")]
+        
+        debug_images = DebugImagePolicy(levels, debug_downsample or 1, skeleton_images_path)
     
     print "input filename: " + str(input_filename)
     print "output filename: " + str(output_filename)
+    print "thinning processes: " + str(num_workers)
+    
+    # bounding box and cell size of the KDE, stored with it by kde.py unless given here
+    raster_extent = read_raster_extent(input_filename)
+    
+    if (bounding_box_filename is not None):
+        bounding_box = read_bounding_box(bounding_box_filename)
+    elif (raster_extent is not None):
+        bounding_box = raster_extent[0]
+    else:
+        bounding_box = None
+    
+    if (cell_size is None):
+        cell_size = (raster_extent[1] if (raster_extent is not None) else 1.0)
     
-    input_kde = imread(input_filename)
+    if (bounding_box is not None):
+        print "bounding box: " + str(bounding_box) + ", cell size: " + str(cell_size) + " m"
+    
+    # sparse skeletons (.npz) and graphs need the bounding box
+    elif (output_filename.endswith(".npz") or (graph_filename is not None)):
+        print "Error! " + str(input_filename) + " has no bounding box; give one with -b."
+        sys.exit()
+    
+    if (debug_images is not None):
+        print "debug images: " + ("all levels" if (debug_images.levels is None) else str(sorted(debug_images.levels))) + ", downsampled " + str(debug_images.downsample) + "x, in " + str(debug_images.path)
+    
+    # tiled KDE rasters (kde.py -t) are numpy arrays on disk; wide ones are quantized
+    # to 16 bits and use the same threshold ladder as 16-bit PNGs (which imread returns as int32)
+    if (input_filename.endswith(".npy")):
+        input_kde = quantize_kde(np.load(input_filename, mmap_mode='r'))
+        image_bit_depth = 16
+    else:
+        input_kde = imread(input_filename)
+        image_bit_depth = (input_kde.dtype.itemsize * 8) / 2
+        input_kde = narrow_kde(input_kde)
     
     s = GrayscaleSkeleton()
     
     start_time = time.time()
-    skeleton = s.skeletonize(input_kde)
+    skeleton = s.skeletonize(input_kde, image_bit_depth)
     print "total elapsed time: " + str(time.time() - start_time) + " seconds"
     
-    toimage(skeleton, cmin=0, cmax=255).save(output_filename)
+    del input_kde
+    
+    # skeleton pixels only, with the bounding box and cell size, for graph_extract.py
+    if (output_filename.endswith(".npz") or (graph_filename is not None)):
+        sparse_skeleton = SparseSkeleton.from_image(skeleton, bounding_box, cell_size)
+        print "skeleton pixels: " + str(sparse_skeleton.num_pixels)
+    
+    if (output_filename.endswith(".npz")):
+        sparse_skeleton.save(output_filename)
+    else:
+        toimage(skeleton, cmin=0, cmax=255).save(output_filename)
+        
+        # the skeleton image keeps the KDE's bounding box, for graph_extract.py
+        if ((bounding_box is not None) and output_filename.lower().endswith(".png")):
+            write_png_extent(output_filename, bounding_box, cell_size)
+    
+    # extract the graph from the skeleton in memory, without reading it back
+    if (graph_filename is not None):
+        from graph_extract import Graph
+        
+        print "graph filename: " + str(graph_filename)
+        
+        del skeleton
+        Graph().extract_sparse(sparse_skeleton, graph_filename)
@@ -0,0 +1,133 @@
+#
+# Gaussian smoothing of intensity maps with interchangeable backends.
+#
+#   opencv      cv.Smooth(CV_GAUSSIAN), the original implementation
+#   separable   two 1-D Gaussian passes (scipy.ndimage.correlate1d)
+#   fft         2-D convolution by FFT; cost does not grow with the kernel
+#   box         three box-filter passes approximating the Gaussian (not exact)
+#   auto        opencv (or separable without OpenCV), switching to fft for kernels
+#               of fft_kernel_size and up; box is only used when asked for
+#
+# All backends use OpenCV's default sigma for a kernel size and its default
+# border (reflection without repeating the edge pixel). Only the bounding box
+# of the non-zero pixels, widened by the kernel radius plus one, is smoothed:
+# outside it the result is zero, and the zero margin makes the reflected border
+# exact, so sparse maps (such as the Davies sector maps) only pay for their
+# busy area.
+#
+# Images are smoothed in place, so numpy.memmap tiles can be passed directly.
+# Integer images are rounded and clipped to their dtype.
+#
+
+import numpy as np
+import scipy.ndimage as nd
+from scipy.signal import fftconvolve
+
+try:
+    import cv
+except ImportError:
+    cv = None
+
+# kernel size from which "auto" switches to FFT smoothing (separable passes are faster below it)
+fft_kernel_size = 121
+
+def gaussian_sigma(kernel_size):
+    
+    # OpenCV's sigma for a given kernel size
+    return 0.3 * (((kernel_size - 1) * 0.5) - 1) + 0.8
+
+def gaussian_kernel(kernel_size):
+    x = np.arange(kernel_size) - ((kernel_size - 1) / 2.0)
+    kernel = np.exp(-(x ** 2) / (2.0 * (gaussian_sigma(kernel_size) ** 2)))
+    
+    return kernel / kernel.sum()
+
+def smooth_separable(image, kernel_size):
+    kernel = gaussian_kernel(kernel_size)
+    
+    smoothed = nd.correlate1d(image.astype(np.float32), kernel, axis=0, mode='mirror')
+    return nd.correlate1d(smoothed, kernel, axis=1, mode='mirror')
+
+def smooth_fft(image, kernel_size):
+    kernel = gaussian_kernel(kernel_size)
+    radius = kernel_size / 2
+    
+    # pad with the reflected border, then keep only the fully overlapped part
+    padded = np.pad(image.astype(np.float32), radius, mode='reflect')
+    
+    return fftconvolve(padded, np.outer(kernel, kernel).astype(np.float32), mode='valid')
+
+def smooth_box(image, kernel_size):
+    
+    # three box passes of equal width have the variance of the Gaussian
+    box_size = int(round(np.sqrt((4.0 * (gaussian_sigma(kernel_size) ** 2)) + 1)))
+    box_size += (1 - (box_size % 2))
+    
+    smoothed = image.astype(np.float32)
+    
+    for i in range(0, 3):
+        for axis in (0, 1):
+            smoothed = nd.uniform_filter1d(smoothed, box_size, axis=axis, mode='mirror')
+    
+    return smoothed
+
+def smooth_opencv(image, kernel_size):
+    
+    # OpenCV blurs 16-bit and float images in place; other integer images are blurred as float32
+    if ((image.dtype not in (np.uint8, np.uint16, np.float32)) or (not image.flags.c_contiguous)):
+        image = np.ascontiguousarray(image, dtype=np.float32)
+    else:
+        image = image.copy()
+    
+    image_map = cv.fromarray(image)
+    cv.Smooth(image_map, image_map, cv.CV_GAUSSIAN, kernel_size, kernel_size)
+    
+    return image
+
+smoothing_backends = {"opencv": smooth_opencv, "separable": smooth_separable, "fft": smooth_fft, "box": smooth_box}
+
+def select_backend(kernel_size):
+    if (kernel_size >= fft_kernel_size):
+        return "fft"
+    elif (cv is not None):
+        return "opencv"
+    else:
+        return "separable"
+
+def smooth(image, kernel_size, backend="auto"):
+    """
+    Smooths a 2-D image in place with a kernel_size x kernel_size Gaussian
+    and returns it.
+    """
+    if (backend == "auto"):
+        backend = select_backend(kernel_size)
+    
+    if (backend not in smoothing_backends):
+        raise ValueError("unknown smoothing backend: " + str(backend))
+    
+    # the reflected border repeats radius pixels inside the window, so one more zero pixel is needed
+    margin = (kernel_size / 2) + 1
+    
+    # find the non-zero area of the image, widened by the margin
+    nonzero_rows = np.flatnonzero(np.any(image, axis=1))
+    nonzero_cols = np.flatnonzero(np.any(image, axis=0))
+    
+    if (len(nonzero_rows) == 0):
+        return image
+    
+    row0 = max(nonzero_rows[0] - margin, 0)
+    row1 = min(nonzero_rows[-1] + margin + 1, image.shape[0])
+    col0 = max(nonzero_cols[0] - margin, 0)
+    col1 = min(nonzero_cols[-1] + margin + 1, image.shape[1])
+    
+    window = image[row0:row1, col0:col1]
+    smoothed = smoothing_backends[backend](window, kernel_size)
+    
+    # store result, rounding and clipping for integer images
+    if (image.dtype.kind in "ui"):
+        dtype_info = np.iinfo(image.dtype)
+        smoothed = np.clip(np.rint(smoothed), dtype_info.min, dtype_info.max)
+    
+    window[...] = smoothed
+    
+    return image
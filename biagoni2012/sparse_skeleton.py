@@ -0,0 +1,81 @@
+#
+# Sparse grayscale skeleton, handed from skeleton.py to graph_extract.py.
+#
+# Skeletons cover a small fraction of the raster, so instead of a full-size
+# PNG only the skeleton pixels are kept, as a coordinate list, together with
+# the raster shape, its bounding box and the cell size. Writing and reading it
+# costs time proportional to the skeleton, not the raster, and the bounding
+# box no longer travels in a separate text file.
+#
+# Skeleton files are compressed numpy .npz archives holding:
+#
+#   rows           int32[num_pixels], pixel rows (counted from the top)
+#   cols           int32[num_pixels], pixel columns
+#   values         uint8[num_pixels], skeleton values (threshold levels kept)
+#   shape          int64[2], (height, width) of the raster
+#   bounding_box   float64[4], (min_lat, min_lon, max_lat, max_lon)
+#   cell_size      float64[1], meters per pixel
+#
+
+import numpy as np
+
+class SparseSkeleton:
+    def __init__(self, rows, cols, values, shape, bounding_box, cell_size):
+        if (not (len(rows) == len(cols) == len(values))):
+            raise ValueError("rows, cols and values must have the same length")
+        
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.cols = np.asarray(cols, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.uint8)
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.bounding_box = tuple(float(value) for value in bounding_box)
+        self.cell_size = float(cell_size)
+    
+    @property
+    def num_pixels(self):
+        return len(self.rows)
+    
+    @staticmethod
+    def from_image(image, bounding_box, cell_size):
+        (rows, cols) = np.nonzero(image)
+        
+        # same values as the skeleton PNG (toimage with cmin=0, cmax=255)
+        values = np.clip(np.asarray(image)[rows, cols], 0, 255)
+        
+        return SparseSkeleton(rows, cols, values, image.shape, bounding_box, cell_size)
+    
+    @staticmethod
+    def load(skeleton_filename):
+        skeleton = np.load(skeleton_filename)
+        
+        return SparseSkeleton(skeleton["rows"], skeleton["cols"], skeleton["values"], skeleton["shape"], skeleton["bounding_box"], skeleton["cell_size"][0])
+    
+    def save(self, skeleton_filename):
+        np.savez_compressed(skeleton_filename, rows=self.rows, cols=self.cols, values=self.values, shape=np.array(self.shape, dtype=np.int64), bounding_box=np.array(self.bounding_box, dtype=np.float64), cell_size=np.array([self.cell_size], dtype=np.float64))
+    
+    def to_image(self, dtype=np.uint8):
+        """
+        Returns the full-size skeleton image, with the skeleton values.
+        """
+        image = np.zeros(self.shape, dtype=dtype)
+        image[self.rows, self.cols] = self.values
+        
+        return image
+    
+    def to_binary_image(self, dtype=np.int8):
+        """
+        Returns the full-size binary skeleton (1 on the skeleton, 0 elsewhere).
+        """
+        image = np.zeros(self.shape, dtype=dtype)
+        image[self.rows, self.cols] = 1
+        
+        return image
+
+def read_bounding_box(bounding_box_filename):
+    
+    # "min_lat min_lon max_lat max_lon", as in bounding_boxes/bounding_box_1m.txt
+    bounding_box_file = open(bounding_box_filename, 'r')
+    bounding_box_values = bounding_box_file.readline().strip("\n").split(" ")
+    bounding_box_file.close()
+    
+    return tuple(float(value) for value in bounding_box_values[0:4])
@@ -6,13 +6,22 @@
 #
 
 import sqlite3
+import math
+from itertools import groupby
 import pyximport; pyximport.install()
 from pylibs import spatialfunclib
 from pylibs import spatialfunclib_accel
+from pylibs import graphdb_reader
+from pylibs import osmdb_reader
 from rtree import Rtree
 
 # global parameters
 intersection_size = 50.0 # meters
+region_margin = 200.0 # meters
+region_tile_size = 2000.0 # meters
+
+# highway tag values of the ways loaded from OpenStreetMap
+valid_highway_values = set(['primary', 'secondary', 'tertiary', 'residential'])
 
 class Node:
     id_counter = 1
@@ -144,6 +153,8 @@ class StreetMap:
         self.edge_coords_lookup_table = {} # indexed by (in_node.coords, out_node.coords)
         self.segments = {} # indexed by segment id
         self.segment_lookup_table = {} # indexed by (head_edge.in_node, tail_edge.out_node)
+        self.region_node_edges = {} # indexed by node, edges in and out of it (loaded regions only)
+        self.loaded_region_tiles = set() # (graphdb_filename, tile_row, tile_col) of load_region_around
     
     def load_osmdb(self, osmdb_filename):
         
@@ -153,12 +164,25 @@ class StreetMap:
         # grab cursor
         cur = conn.cursor()
         
+        # output that we are loading ways
+        sys.stdout.write("\nLoading ways... ")
+        sys.stdout.flush()
+        
+        # read highway ways, with tags and node lists decoded (never evaluated)
+        highway_ways = [(id, way_tags_dict, way_nodes_list) for (id, way_tags_dict, way_nodes_list) in osmdb_reader.read_highway_ways(cur) if self._valid_highway_edge(way_tags_dict['highway'])]
+        
+        print "done."
+        
         # output that we are loading nodes
-        sys.stdout.write("\nLoading nodes... ")
+        sys.stdout.write("Loading nodes... ")
         sys.stdout.flush()
         
+        # only the nodes of highway ways are read
+        cur.execute("CREATE TEMPORARY TABLE way_node_ids (id INTEGER PRIMARY KEY)")
+        cur.executemany("INSERT OR IGNORE INTO way_node_ids VALUES (?)", ((node_id,) for (_, _, way_nodes_list) in highway_ways for node_id in way_nodes_list))
+        
         # execute query on nodes table
-        cur.execute("select id, lat, lon from nodes")
+        cur.execute("select nodes.id, nodes.lat, nodes.lon from nodes join way_node_ids on (way_node_ids.id = nodes.id)")
         query_result = cur.fetchall()
         
         # iterate through all query results
@@ -173,75 +197,66 @@ class StreetMap:
         sys.stdout.write("Loading edges... ")
         sys.stdout.flush()
         
-        # execute query on ways table
-        cur.execute("select id, tags, nds from ways")
-        query_result = cur.fetchall()
-        
         # storage for nodes used in valid edges
         valid_edge_nodes = {} # indexed by node id
         
-        # iterate through all query results
-        for id, tags, nodes in query_result:
-            
-            # grab tags associated with current way
-            way_tags_dict = eval(tags)
+        # iterate through all valid highway ways
+        for id, way_tags_dict, way_nodes_list in highway_ways:
             
-            # if current way is a valid highway
-            if ('highway' in way_tags_dict.keys() and self._valid_highway_edge(way_tags_dict['highway'])):
+            # iterate through list of way nodes
+            for i in range(1, len(way_nodes_list)):
                 
-                # grab all nodes that compose this way
-                way_nodes_list = eval(nodes)
+                # skip edges whose nodes are not in the database (ways cut at the border of an extract)
+                if ((way_nodes_list[i - 1] not in self.nodes) or (way_nodes_list[i] not in self.nodes)):
+                    continue
                 
-                # iterate through list of way nodes
-                for i in range(1, len(way_nodes_list)):
+                # grab in_node from nodes dictionary
+                in_node = self.nodes[int(way_nodes_list[i - 1])]
+                
+                # grab out_node from nodes dictionary
+                out_node = self.nodes[int(way_nodes_list[i])]
+                
+                # create edge_id based on way id
+                edge_id = int(str(id) + str(i - 1) + "000000")
+                
+                # if either node on the edge is valid
+                if (True): #self._valid_node(in_node) or self._valid_node(out_node)):
                     
-                    # grab in_node from nodes dictionary
-                    in_node = self.nodes[int(way_nodes_list[i - 1])]
+                    # create and store edge in edges dictionary
+                    self.edges[int(edge_id)] = Edge(in_node, out_node,int(edge_id))
                     
-                    # grab out_node from nodes dictionary
-                    out_node = self.nodes[int(way_nodes_list[i])]
+                    # store in_node in out_node's in_nodes list
+                    if (in_node not in out_node.in_nodes):
+                        out_node.in_nodes.append(in_node)
                     
-                    # create edge_id based on way id
-                    edge_id = int(str(id) + str(i - 1) + "000000")
+                    # store out_node in in_node's out_nodes list
+                    if (out_node not in in_node.out_nodes):
+                        in_node.out_nodes.append(out_node)
                     
-                    # if either node on the edge is valid
-                    if (True): #self._valid_node(in_node) or self._valid_node(out_node)):
-                        
-                        # create and store edge in edges dictionary
-                        self.edges[int(edge_id)] = Edge(in_node, out_node,int(edge_id))
+                    # if edge is bidirectional
+                    if ('oneway' not in way_tags_dict):
                         
-                        # store in_node in out_node's in_nodes list
-                        if (in_node not in out_node.in_nodes):
-                            out_node.in_nodes.append(in_node)
+                        # create new symmetric edge id
+                        symmetric_edge_id = int(str(edge_id / 10) + "1")
                         
-                        # store out_node in in_node's out_nodes list
-                        if (out_node not in in_node.out_nodes):
-                            in_node.out_nodes.append(out_node)
+                        # create and store symmetric edge in edges dictionary
+                        self.edges[int(symmetric_edge_id)] = Edge(out_node, in_node, int(symmetric_edge_id))
                         
-                        # if edge is bidirectional
-                        if ('oneway' not in way_tags_dict.keys()):
-                            
-                            # create new symmetric edge id
-                            symmetric_edge_id = int(str(edge_id / 10) + "1")
-                            
-                            # create and store symmetric edge in edges dictionary
-                            self.edges[int(symmetric_edge_id)] = Edge(out_node, in_node, int(symmetric_edge_id))
-                            
-                            # store in_node in out_node's out_nodes list
-                            if (in_node not in out_node.out_nodes):
-                                out_node.out_nodes.append(in_node)
-                            
-                            # store out_node in in_node's in_nodes list
-                            if (out_node not in in_node.in_nodes):
-                                in_node.in_nodes.append(out_node)
+                        # store in_node in out_node's out_nodes list
+                        if (in_node not in out_node.out_nodes):
+                            out_node.out_nodes.append(in_node)
                         
-                        # store in_node in valid_edge_nodes dictionary
-                        if (in_node.id not in valid_edge_nodes.keys()):
-                            valid_edge_nodes[in_node.id] = in_node
-                        
-                        # store out_node in valid_edge_nodes dictionary
-                        if (out_node.id not in valid_edge_nodes.keys()):
-                            valid_edge_nodes[out_node.id] = out_node
+                        # store out_node in in_node's in_nodes list
+                        if (out_node not in in_node.in_nodes):
+                            in_node.in_nodes.append(out_node)
+                    
+                    # store in_node in valid_edge_nodes dictionary
+                    if (in_node.id not in valid_edge_nodes):
+                        valid_edge_nodes[in_node.id] = in_node
+                    
+                    # store out_node in valid_edge_nodes dictionary
+                    if (out_node.id not in valid_edge_nodes):
+                        valid_edge_nodes[out_node.id] = out_node
         
         print "done."
         
@@ -322,19 +337,18 @@ class StreetMap:
                     in_node.out_nodes.append(out_node)
                 
                 # store in_node in valid_edge_nodes dictionary
-                if (in_node.id not in valid_edge_nodes.keys()):
+                if (in_node.id not in valid_edge_nodes):
                     valid_edge_nodes[in_node.id] = in_node
                 
                 # store out_node in valid_edge_nodes dictionary
-                if (out_node.id not in valid_edge_nodes.keys()):
+                if (out_node.id not in valid_edge_nodes):
                     valid_edge_nodes[out_node.id] = out_node
         
-        # execute query on segments table
-        cur.execute("select id, edge_ids from segments")
-        query_result = cur.fetchall()
+        # read segments (edge id lists of schema version 1, segment_edges rows of version 2)
+        query_result = graphdb_reader.read_segments(cur)
         
         for id, edge_ids in query_result:
-            segment_edges = map(lambda edge_id: self.edges[edge_id], eval(edge_ids))
+            segment_edges = map(lambda edge_id: self.edges[edge_id], edge_ids)
             self.segments[id] = Segment(id, segment_edges)
             
             self.segment_lookup_table[(self.segments[id].head_edge.in_node, self.segments[id].tail_edge.out_node)] = self.segments[id]
@@ -380,6 +394,145 @@ class StreetMap:
         # output map statistics
         print "Map has " + str(len(self.nodes)) + " nodes, " + str(len(self.edges)) + " edges, " + str(len(self.segments)) + " segments and " + str(len(self.intersections)) + " intersections."
     
+    # loads the part of a graph database (schema version 2) that touches bounding_box
+    # ((min_lat, min_lon, max_lat, max_lon), as in bounding_box.txt) grown by margin meters:
+    # the segments and the edges outside segments whose bounding boxes overlap it, in full,
+    # their nodes and the intersections among those nodes. regions can be loaded one after
+    # another into the same map as they are needed; each call adds only what is not loaded
+    # yet, and links it to what is.
+    def load_region(self, graphdb_filename, bounding_box, margin=region_margin):
+        
+        # connect to graph database
+        conn = sqlite3.connect(graphdb_filename)
+        
+        # grab cursor
+        cur = conn.cursor()
+        
+        if (graphdb_reader.schema_version(cur) != 2):
+            conn.close()
+            raise ValueError("regions can only be loaded from schema version 2 graph databases (see graphdb_migrate.py): " + str(graphdb_filename))
+        
+        tables = graphdb_reader.table_names(cur)
+        weighted = ("weight" in graphdb_reader.table_columns(cur, "nodes"))
+        
+        # output that we are loading a region
+        sys.stdout.write("\nLoading region... ")
+        sys.stdout.flush()
+        
+        # grow bounding box by margin
+        (min_lat, min_lon, max_lat, max_lon) = bounding_box
+        lat_margin = (margin / spatialfunclib.METERS_PER_DEGREE_LATITUDE)
+        lon_margin = (margin / spatialfunclib.METERS_PER_DEGREE_LONGITUDE)
+        overlap = (min_lon - lon_margin, max_lon + lon_margin, min_lat - lat_margin, max_lat + lat_margin)
+        
+        # find segments and edges outside segments overlapping the region, in the R*Tree indexes
+        cur.execute("CREATE TEMPORARY TABLE region_segments (id INTEGER PRIMARY KEY)")
+        cur.execute("CREATE TEMPORARY TABLE region_edges (id INTEGER PRIMARY KEY)")
+        
+        if ("segment_rtree" in tables):
+            cur.execute("INSERT INTO region_segments SELECT id FROM segment_rtree WHERE (max_lon >= ?) AND (min_lon <= ?) AND (max_lat >= ?) AND (min_lat <= ?)", overlap)
+            cur.execute("INSERT OR IGNORE INTO region_edges SELECT segment_edges.edge_id FROM segment_edges JOIN region_segments ON (segment_edges.segment_id = region_segments.id)")
+        
+        cur.execute("INSERT OR IGNORE INTO region_edges SELECT id FROM edge_rtree WHERE (max_lon >= ?) AND (min_lon <= ?) AND (max_lat >= ?) AND (min_lat <= ?)", overlap)
+        
+        # nodes of region edges
+        region_node_ids = "SELECT edges.in_node FROM edges JOIN region_edges ON (edges.id = region_edges.id) UNION SELECT edges.out_node FROM edges JOIN region_edges ON (edges.id = region_edges.id)"
+        
+        if (weighted):
+            cur.execute("SELECT id, latitude, longitude, weight FROM nodes WHERE id IN (" + region_node_ids + ")")
+        else:
+            cur.execute("SELECT id, latitude, longitude, 0.0 FROM nodes WHERE id IN (" + region_node_ids + ")")
+        
+        # storage for newly loaded nodes
+        new_nodes = []
+        
+        for id, latitude, longitude, weight in cur.fetchall():
+            if (id not in self.nodes):
+                self.nodes[id] = Node(latitude, longitude, id, weight)
+                new_nodes.append(self.nodes[id])
+        
+        if (weighted):
+            cur.execute("SELECT edges.id, edges.in_node, edges.out_node, edges.weight FROM edges JOIN region_edges ON (edges.id = region_edges.id)")
+        else:
+            cur.execute("SELECT edges.id, edges.in_node, edges.out_node, 0.0 FROM edges JOIN region_edges ON (edges.id = region_edges.id)")
+        
+        # storage for newly loaded edges
+        new_edges = []
+        
+        for id, in_node_id, out_node_id, weight in cur.fetchall():
+            if (id in self.edges):
+                continue
+            
+            # grab in_node and out_node from nodes dictionary
+            in_node = self.nodes[in_node_id]
+            out_node = self.nodes[out_node_id]
+            
+            # create and store edge in edges dictionary
+            self.edges[id] = Edge(in_node, out_node, id, weight)
+            new_edges.append(self.edges[id])
+            
+            # store in_node in out_node's in_nodes list
+            if (in_node not in out_node.in_nodes):
+                out_node.in_nodes.append(in_node)
+            
+            # store out_node in in_node's out_nodes list
+            if (out_node not in in_node.out_nodes):
+                in_node.out_nodes.append(out_node)
+        
+        # segments of the region, whole
+        if ("segment_rtree" in tables):
+            cur.execute("SELECT segment_edges.segment_id, segment_edges.edge_id FROM segment_edges JOIN region_segments ON (segment_edges.segment_id = region_segments.id) ORDER BY segment_edges.segment_id, segment_edges.seq")
+            
+            for id, rows in groupby(cur.fetchall(), lambda row: row[0]):
+                if (id in self.segments):
+                    continue
+                
+                segment_edges = [self.edges[edge_id] for (_, edge_id) in rows]
+                self.segments[id] = Segment(id, segment_edges)
+                
+                self.segment_lookup_table[(self.segments[id].head_edge.in_node, self.segments[id].tail_edge.out_node)] = self.segments[id]
+                
+                for segment_edge in segment_edges:
+                    segment_edge.segment = self.segments[id]
+        
+        # intersections among the region's nodes
+        if ("intersections" in tables):
+            cur.execute("SELECT node_id FROM intersections WHERE node_id IN (" + region_node_ids + ")")
+            
+            for (node_id,) in cur.fetchall():
+                self.intersections[node_id] = self.nodes[node_id]
+        
+        print "done."
+        
+        # close connection to graph db
+        conn.close()
+        
+        # index new nodes and edges
+        self._index_region(new_nodes, new_edges)
+        
+        # output map statistics
+        print "Map has " + str(len(self.nodes)) + " nodes, " + str(len(self.edges)) + " edges, " + str(len(self.segments)) + " segments and " + str(len(self.intersections)) + " intersections."
+    
+    # lazily loads the region tile (region_tile_size meters square, on a fixed grid) holding
+    # the given location from a graph database, unless it is loaded already; returns True if
+    # a tile was loaded
+    def load_region_around(self, graphdb_filename, latitude, longitude):
+        
+        # find tile of location
+        tile_lat_size = (region_tile_size / spatialfunclib.METERS_PER_DEGREE_LATITUDE)
+        tile_lon_size = (region_tile_size / spatialfunclib.METERS_PER_DEGREE_LONGITUDE)
+        tile = (graphdb_filename, int(math.floor(latitude / tile_lat_size)), int(math.floor(longitude / tile_lon_size)))
+        
+        if (tile in self.loaded_region_tiles):
+            return False
+        
+        (_, tile_row, tile_col) = tile
+        self.load_region(graphdb_filename, (tile_row * tile_lat_size, tile_col * tile_lon_size, (tile_row + 1) * tile_lat_size, (tile_col + 1) * tile_lon_size))
+        
+        self.loaded_region_tiles.add(tile)
+        
+        return True
+    
     def load_shapedb(self, shapedb_filename):
         
         # connect to graph database
@@ -573,6 +726,50 @@ class StreetMap:
         
         print "done."
     
+    def _index_region(self, new_nodes, new_edges):
+        
+        # output that we are indexing the region
+        sys.stdout.write("Indexing region... ")
+        sys.stdout.flush()
+        
+        # iterate through new nodes
+        for curr_node in new_nodes:
+            
+            # insert node into spatial index
+            self.node_spatial_index.insert(curr_node.id, (curr_node.longitude, curr_node.latitude))
+        
+        # storage for nodes whose edges changed
+        linked_nodes = set()
+        
+        # iterate through new edges
+        for curr_edge in new_edges:
+            
+            # determine current edge minx, miny, maxx, maxy values
+            curr_edge_minx = min(curr_edge.in_node.longitude, curr_edge.out_node.longitude)
+            curr_edge_miny = min(curr_edge.in_node.latitude, curr_edge.out_node.latitude)
+            curr_edge_maxx = max(curr_edge.in_node.longitude, curr_edge.out_node.longitude)
+            curr_edge_maxy = max(curr_edge.in_node.latitude, curr_edge.out_node.latitude)
+            
+            # insert current edge into spatial index
+            self.edge_spatial_index.insert(curr_edge.id, (curr_edge_minx, curr_edge_miny, curr_edge_maxx, curr_edge_maxy))
+            
+            # insert current edge into lookup table
+            self.edge_lookup_table[(curr_edge.in_node, curr_edge.out_node)] = curr_edge
+            self.edge_coords_lookup_table[(curr_edge.in_node.coords(), curr_edge.out_node.coords())] = curr_edge
+            
+            # store current edge with its nodes
+            for node in set([curr_edge.in_node, curr_edge.out_node]):
+                self.region_node_edges.setdefault(node, []).append(curr_edge)
+                linked_nodes.add(node)
+        
+        # relink all edges at nodes that got new edges, including edges of earlier regions
+        for node in linked_nodes:
+            for edge in self.region_node_edges[node]:
+                edge.out_edges = [self.edge_lookup_table[(edge.out_node, out_node_neighbor)] for out_node_neighbor in edge.out_node.out_nodes]
+                edge.in_edges = [self.edge_lookup_table[(in_node_neighbor, edge.in_node)] for in_node_neighbor in edge.in_node.in_nodes]
+        
+        print "done."
+    
     def _find_and_index_intersections(self):
         
         # output that we are finding and indexing intersections
@@ -678,14 +875,7 @@ class StreetMap:
             return False
     
     def _valid_highway_edge(self, highway_tag_value):
-        if ((highway_tag_value == 'primary') or 
-            (highway_tag_value == 'secondary') or 
-            (highway_tag_value == 'tertiary') or 
-            (highway_tag_value == 'residential')):
-            
-            return True
-        else:
-            return False
+        return (highway_tag_value in valid_highway_values)
     
     def reset_node_visited_flags(self):
         
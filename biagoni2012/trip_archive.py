@@ -0,0 +1,138 @@
+#
+# Single-file binary trip archive, opened with numpy.memmap.
+#
+# Layout (little-endian, every section starts on an 8-byte boundary):
+#
+#   header       64 bytes: magic "GPXTRIPS", uint32 version, uint32 reserved,
+#                uint64 num_trips, uint64 num_locations, zero padding
+#   offsets      int32[num_trips + 1], trip k spans [offsets[k], offsets[k + 1])
+#   trip_ids     int64[num_trips]
+#   ids          int64[num_locations]
+#   latitudes    float64[num_locations]
+#   longitudes   float64[num_locations]
+#   times        float64[num_locations]
+#
+
+import struct
+import numpy as np
+from location import TripLoader, TripStore
+
+ARCHIVE_MAGIC = "GPXTRIPS"
+ARCHIVE_VERSION = 1
+HEADER_FORMAT = "<8sIIQQ"
+HEADER_SIZE = 64
+
+def _aligned(num_bytes):
+    return (num_bytes + 7) & ~7
+
+def _archive_sections(num_trips, num_locations):
+    sections = [("offsets", "<i4", num_trips + 1),
+                ("trip_ids", "<i8", num_trips),
+                ("ids", "<i8", num_locations),
+                ("latitudes", "<f8", num_locations),
+                ("longitudes", "<f8", num_locations),
+                ("times", "<f8", num_locations)]
+    
+    # compute byte offset of every section
+    layout = []
+    position = HEADER_SIZE
+    
+    for name, dtype, count in sections:
+        layout.append((name, dtype, count, position))
+        position += _aligned(np.dtype(dtype).itemsize * count)
+    
+    return layout
+
+def write_trip_archive(trip_store, archive_filename):
+    num_trips = trip_store.num_trips
+    num_locations = trip_store.num_locations
+    
+    # open archive file
+    archive_file = open(archive_filename, 'wb')
+    
+    # write header
+    header = struct.pack(HEADER_FORMAT, ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, num_trips, num_locations)
+    archive_file.write(header + ("\0" * (HEADER_SIZE - len(header))))
+    
+    # write sections
+    for name, dtype, count, position in _archive_sections(num_trips, num_locations):
+        archive_file.seek(position)
+        np.ascontiguousarray(getattr(trip_store, name), dtype=dtype).tofile(archive_file)
+    
+    # pad file to the end of the last section
+    archive_file.write("\0" * (_aligned(archive_file.tell()) - archive_file.tell()))
+    
+    # close archive file
+    archive_file.close()
+
+def open_trip_archive(archive_filename):
+    
+    # read header
+    archive_file = open(archive_filename, 'rb')
+    header = archive_file.read(struct.calcsize(HEADER_FORMAT))
+    archive_file.close()
+    
+    if (len(header) != struct.calcsize(HEADER_FORMAT)):
+        raise ValueError(str(archive_filename) + " is not a trip archive (truncated header)")
+    
+    magic, version, _, num_trips, num_locations = struct.unpack(HEADER_FORMAT, header)
+    
+    if (magic != ARCHIVE_MAGIC):
+        raise ValueError(str(archive_filename) + " is not a trip archive")
+    
+    if (version != ARCHIVE_VERSION):
+        raise ValueError("unsupported trip archive version: " + str(version))
+    
+    # map every section read-only, without copying or parsing
+    columns = {}
+    
+    for name, dtype, count, position in _archive_sections(num_trips, num_locations):
+        if (count > 0):
+            columns[name] = np.memmap(archive_filename, dtype=dtype, mode='r', offset=position, shape=(count,))
+        else:
+            columns[name] = np.zeros(0, dtype=dtype)
+    
+    return TripStore(columns["latitudes"], columns["longitudes"], columns["times"], columns["offsets"], columns["ids"], columns["trip_ids"])
+
+import sys, getopt
+if __name__ == '__main__':
+    trips_path = None
+    plt_filename = None
+    archive_filename = "trips.bin"
+    
+    (opts, args) = getopt.getopt(sys.argv[1:],"p:f:o:h")
+    
+    for o,a in opts:
+        if o == "-p":
+            trips_path = str(a)
+        elif o == "-f":
+            plt_filename = str(a)
+        elif o == "-o":
+            archive_filename = str(a)
+        elif o == "-h":
+            print "Usage: python trip_archive.py (-p <trips_path> | -f <plt_filename>) [-o <archive_filename>] [-h]"
+            print "(reading .plt input requires PYTHONPATH=../converters)"
+            exit()
+    
+    if (trips_path is not None):
+        print "trips path: " + str(trips_path)
+        trip_store = TripLoader.load_trip_store(trips_path)
+    
+    elif (plt_filename is not None):
+        from plt_trip_loader import PltTripLoader
+        
+        print "plt filename: " + str(plt_filename)
+        trip_store = TripStore.from_trips(filter(lambda trip: len(trip.locations) >= 2, PltTripLoader.get_all_trips(plt_filename)))
+    
+    else:
+        print "Error! Either a trips path (-p) or a .plt file (-f) is required."
+        exit()
+    
+    print "archive filename: " + str(archive_filename)
+    
+    sys.stdout.write("Writing " + str(trip_store.num_trips) + " trips (" + str(trip_store.num_locations) + " locations)... ")
+    sys.stdout.flush()
+    
+    write_trip_archive(trip_store, archive_filename)
+    
+    print "done."
@@ -8,8 +8,9 @@
 import time
 import math
 import sys
-import sqlite3
 from pylibs import spatialfunclib, mathfunclib
+from pylibs.simplify import simplify_graph
+from pylibs.graphdb_writer import write_graphdb
 from rtree import Rtree
 
 # global parameters
@@ -17,6 +18,7 @@ max_path_length = 4 # hops
 min_graph_edge_volume = 3 # count
 location_projection_distance_limit = 20.0 # meters
 location_bearing_difference_limit = math.cos(math.radians(45.0)) # degrees
+simplify_epsilon = None # meters (None: graph written as generated)
 
 class Edge:
     def __init__(self, id, in_node, out_node):
@@ -384,47 +386,24 @@ class Graph:
         sys.stdout.write("\nOutputting graph to database... ")
         sys.stdout.flush()
         
-        # connect to database
-        conn = sqlite3.connect("cao_graph.db")
+        # graph edges with volume greater than or equal to 3
+        output_edges = [graph_edge for graph_edge in self.graph_edges.values() if (graph_edge.volume >= min_graph_edge_volume)]
         
-        # grab cursor
-        cur = conn.cursor()
+        # graph nodes and edges as (id, latitude, longitude) and (id, in_node, out_node) rows
+        node_rows = [(node.id, node.latitude, node.longitude) for node in self.graph_nodes.values()]
+        edge_rows = [(graph_edge.id, graph_edge.in_node.id, graph_edge.out_node.id) for graph_edge in output_edges]
         
-        # create nodes table
-        cur.execute("CREATE TABLE nodes (id INTEGER, latitude FLOAT, longitude FLOAT)")
-        
-        # create edges table
-        cur.execute("CREATE TABLE edges (id INTEGER, in_node INTEGER, out_node INTEGER)")
-        
-        # remove values from nodes table
-        #cur.execute("DELETE FROM nodes")
-        
-        # remove values from edges table
-        #cur.execute("DELETE FROM edges")
-        
-        # commit creates
-        conn.commit()
-        
-        # iterate through all graph nodes
-        for graph_node in self.graph_nodes.values():
+        # if requested, drop chain nodes with Douglas-Peucker (edges get new ids)
+        if (simplify_epsilon is not None):
+            node_coords = dict((node_id, (latitude, longitude)) for (node_id, latitude, longitude) in node_rows)
+            (kept_nodes, kept_edges) = simplify_graph(node_coords, [(in_node, out_node) for (_, in_node, out_node) in edge_rows], simplify_epsilon)
             
-            # insert graph node into nodes table
-            cur.execute("INSERT INTO nodes VALUES (" + str(graph_node.id) + "," + str(graph_node.latitude) + "," + str(graph_node.longitude) + ")")
-        
-        # iterate through all graph edges
-        for graph_edge in self.graph_edges.values():
-            
-            # if the graph edge has volume greater than or equal to 3
-            if (graph_edge.volume >= min_graph_edge_volume):
-                
-                # insert graph edge into edges table
-                cur.execute("INSERT INTO edges VALUES (" + str(graph_edge.id) + "," + str(graph_edge.in_node.id) + "," + str(graph_edge.out_node.id) + ")")
-        
-        # commit inserts
-        conn.commit()
+            kept_nodes = set(kept_nodes)
+            node_rows = [node_row for node_row in node_rows if (node_row[0] in kept_nodes)]
+            edge_rows = [(edge_id, in_node, out_node) for (edge_id, (in_node, out_node)) in enumerate(kept_edges)]
         
-        # close database connection
-        conn.close()
+        # write graph nodes and edges to database
+        write_graphdb("cao_graph.db", node_rows, edge_rows, weighted=False)
         
         print "done."
     
@@ -467,8 +446,9 @@ if __name__ == '__main__':
     # default values
     trip_round = 0
     trip_max = 889
+    num_workers = 1
     
-    (opts, args) = getopt.getopt(sys.argv[1:],"p:v:d:b:r:n:h")
+    (opts, args) = getopt.getopt(sys.argv[1:],"p:v:d:b:r:n:w:e:h")
     
     for o,a in opts:
         if o == "-p":
@@ -483,11 +463,15 @@ if __name__ == '__main__':
             trip_round = int(a)
         if o == "-n":
             trip_max = int(a)
+        if o == "-w":
+            num_workers = int(a)
+        if o == "-e":
+            simplify_epsilon = float(a)
         if o == "-h":
-            print "Usage: python cao2009_generate_graph.py [-p <max_path_length>] [-v <min_graph_edge_volume>] [-d <location_projection_distance_limit>] [-b <location_bearing_difference_limit>] [-r <clarified_trips_round>] [-n <trip_max>] [-h]\n"
+            print "Usage: python cao2009_generate_graph.py [-p <max_path_length>] [-v <min_graph_edge_volume>] [-d <location_projection_distance_limit>] [-b <location_bearing_difference_limit>] [-r <clarified_trips_round>] [-n <trip_max>] [-w <num_workers>] [-e <simplify_epsilon>] [-h]\n"
             exit()
     
-    all_trips = TripLoader.get_all_trips("clarified_trips/n" + str(trip_max) + "/round" + str(trip_round) + "/")
+    all_trips = TripLoader.get_all_trips("clarified_trips/n" + str(trip_max) + "/round" + str(trip_round) + "/", num_workers)
     
     start_time = time.time()
     g = Graph(all_trips[:trip_max])
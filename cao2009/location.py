@@ -6,6 +6,10 @@
 #
 
 import os
+import math
+import time
+from array import array
+from multiprocessing import Pool
 
 class Location:
     def __init__(self, id, latitude, longitude, time):
@@ -56,52 +60,125 @@ class Trip:
     def time_span(self):
         return (self.locations[-1].time - self.locations[0].time)
 
+def _parse_trip_shard((trips_path, trip_filenames)):
+    
+    # storage for parsed trip columns and per-file (locations, seconds) timings
+    shard_columns = []
+    file_timings = []
+    
+    # iterate through shard trip filenames
+    for trip_filename in trip_filenames:
+        start_time = time.time()
+        
+        # parse trip file into columns
+        trip_columns = TripLoader.parse_trip_file(trips_path + trip_filename)
+        
+        shard_columns.append(trip_columns)
+        file_timings.append((len(trip_columns[0]), time.time() - start_time))
+    
+    # return columns as arrays, not location objects
+    return (shard_columns, file_timings)
+
+def _report_parse_throughput(file_timings, elapsed_time):
+    num_files = len(file_timings)
+    
+    if (num_files == 0):
+        return
+    
+    num_locations = sum(map(lambda timing: timing[0], file_timings))
+    parse_times = map(lambda timing: timing[1], file_timings)
+    
+    print "Parsed " + str(num_files) + " trip files (" + str(num_locations) + " locations) in " + str(round(elapsed_time, 2)) + " seconds: " + str(int(num_files / max(elapsed_time, 1e-9))) + " files/s, " + str(int(num_locations / max(elapsed_time, 1e-9))) + " locations/s."
+    print "Per-file parse time: mean " + str(round(1000.0 * sum(parse_times) / num_files, 3)) + " ms, max " + str(round(1000.0 * max(parse_times), 3)) + " ms; per-file throughput " + str(int(num_locations / max(sum(parse_times), 1e-9))) + " locations/s."
+
 class TripLoader:
     
     @staticmethod
-    def get_all_trips(trips_path):
-        
-        # storage for all trips
-        all_trips = []
+    def get_all_trips(trips_path, num_workers=1):
         
         # get trip filenames
-        trip_filenames = os.listdir(trips_path)
+        trip_filenames = filter(lambda x: x.startswith("trip_"), os.listdir(trips_path))
         
-        # iterate through all trip filenames
-        for trip_filename in trip_filenames:
-            
-            # if filename starts with "trip_"
-            if (trip_filename.startswith("trip_") is True):
-                
-                # load trip from file
-                curr_trip = TripLoader.load_trip_from_file(trips_path + trip_filename)
-                
-                # add trip to all_trips list
-                all_trips.append(curr_trip)
-        
-        # return all trips
-        return all_trips
+        # parse trip files into columns, then create trips from them
+        return map(TripLoader.trip_from_columns, TripLoader.parse_trip_files(trips_path, trip_filenames, num_workers))
     
     @staticmethod
-    def load_trip_from_file(trip_filename):
+    def parse_trip_files(trips_path, trip_filenames, num_workers=1):
         
-        # create new trip object
-        new_trip = Trip()
+        # split trip filenames into contiguous shards, several per worker to balance load
+        num_shards = max(1, min(len(trip_filenames), num_workers * 4))
+        shard_size = max(1, int(math.ceil(float(len(trip_filenames)) / float(num_shards))))
+        shards = [(trips_path, trip_filenames[i:i + shard_size]) for i in range(0, len(trip_filenames), shard_size)]
         
-        # create new trip locations dictionary
-        new_trip_locations = {} # indexed by location id
+        start_time = time.time()
+        
+        # parse shards, in a process pool if requested; results stream back in order
+        if (num_workers > 1):
+            pool = Pool(num_workers)
+            shard_results = list(pool.imap(_parse_trip_shard, shards))
+            pool.close()
+            pool.join()
+        else:
+            shard_results = map(_parse_trip_shard, shards)
+        
+        # report parse throughput
+        _report_parse_throughput([timing for shard_result in shard_results for timing in shard_result[1]], time.time() - start_time)
+        
+        # return all trip columns, in trip filename order
+        return [trip_columns for shard_result in shard_results for trip_columns in shard_result[0]]
+    
+    @staticmethod
+    def load_trip_from_file(trip_filename):
+        return TripLoader.trip_from_columns(TripLoader.parse_trip_file(trip_filename))
+    
+    @staticmethod
+    def parse_trip_file(trip_filename):
+        
+        # storage for location columns
+        ids = []
+        latitudes = array('d')
+        longitudes = array('d')
+        times = array('d')
         
         # open trip file
         trip_file = open(trip_filename, 'r')
-        prev_location = None
+        
         # read through trip file, a line at a time
         for trip_location in trip_file:
             
             # parse out location elements
             location_elements = trip_location.strip('\n').split(',')
             
+            # append location to columns
+            ids.append(str(location_elements[0]))
+            latitudes.append(float(location_elements[1]))
+            longitudes.append(float(location_elements[2]))
+            times.append(float(location_elements[3]))
+        
+        # close trip file
+        trip_file.close()
+        
+        # return trip columns
+        return (ids, latitudes, longitudes, times)
+    
+    @staticmethod
+    def trip_from_columns(trip_columns):
+        
+        # grab trip columns
+        (ids, latitudes, longitudes, times) = trip_columns
+        
+        # create new trip object
+        new_trip = Trip()
+        
+        # create new trip locations dictionary
+        new_trip_locations = {} # indexed by location id
+        
+        prev_location = None
+        # iterate through trip columns, a location at a time
+        for i in range(0, len(ids)):
+            
             # create new location object
-            new_location = Location(str(location_elements[0]), float(location_elements[1]), float(location_elements[2]), float(location_elements[3]))
+            new_location = Location(ids[i], latitudes[i], longitudes[i], times[i])
             
             # store new trip location
             new_trip_locations[new_location.id] = new_location
@@ -111,19 +188,11 @@ class TripLoader:
             else:
               new_location.prev_location_id = "None"
             prev_location = new_location
-            # store prev/next_location id
-            #new_location.prev_location_id = "None"#str(location_elements[4])
-            #new_location.next_location_id = "None"#str(location_elements[5])
-            #new_location.prev_location_id = str(location_elements[4])
-            #new_location.next_location_id = str(location_elements[5])
             
             # add new location to trip
             new_trip.add_location(new_location)
         new_location.prev_location_id = prev_location.id
         prev_location.next_location_id = new_location.id
-
-        # close trip file
-        trip_file.close()
         
         # iterate through trip locations, and connect pointers
         for trip_location in new_trip.locations:
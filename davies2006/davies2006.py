@@ -4,6 +4,8 @@ import sys,getopt,os
 from plt_trip_loader import PltTripLoader
 from pylibs import spatialfunclib
 from itertools import tee, izip
+import numpy as np
+from smoothing import smooth
 
 
 ##
@@ -13,12 +15,14 @@ from itertools import tee, izip
 cell_size = 2 # meters
 mask_threshold = 100 # turns grayscale into binary
 gaussian_blur = 17
+blur_backend = "auto" # smoothing backend: "auto", "opencv", "separable", "fft" or "box"
 voronoi_sampling_interval = 10 # sample one point every so many pixels along the outline
 MIN_DIR_COUNT = 10
 shave_until = 0.9999
 trip_max = None
+accumulator = "uint16" # intensity map dtype: "uint16" (saturates after ~2000 trips on a pixel), "uint32" or "float32"
 
-opts,args = getopt.getopt(sys.argv[1:],"c:t:b:s:f:hn:d:")
+opts,args = getopt.getopt(sys.argv[1:],"c:t:b:g:s:f:hn:d:a:")
 for o,a in opts:
     if o == "-c":
 	cell_size=int(a)
@@ -26,6 +30,8 @@ for o,a in opts:
 	mask_threshold=int(a)
     elif o == "-b":
 	gaussian_blur = int(a)	
+    elif o == "-g":
+	blur_backend = a
     elif o == "-s":
 	voronoi_sampling_interval = int(a)
     elif o == "-f":
@@ -34,8 +40,10 @@ for o,a in opts:
 	shave_until = float(a)
     elif o == "-n":
 	trip_max = int(a)
+    elif o == "-a":
+	accumulator = a
     elif o == "-h":
-	print "Usage: davies2006.py [-c <cell_size>] [-t <mask_threshold>] [-b <gaussian_blur_size>] [-s <voronoi_sampling_interval>] [-d <shave_until_fraction>] [-n <max_trips>] [-f <trips_path>] [-h]\n"
+	print "Usage: davies2006.py [-c <cell_size>] [-t <mask_threshold>] [-b <gaussian_blur_size>] [-g auto|opencv|separable|fft|box] [-s <voronoi_sampling_interval>] [-d <shave_until_fraction>] [-n <max_trips>] [-a uint16|uint32|float32] [-f <trips_path>] [-h]\n"
 	sys.exit()
 
 print "Loading %s..." % filename
@@ -82,8 +90,11 @@ height = int(diff_lat * spatialfunclib.METERS_PER_DEGREE_LATITUDE / cell_size)
 yscale = height / diff_lat # pixels per lat
 xscale = width / diff_lon # pixels per lon
 
+# OpenCV matrix type of the intensity maps
+map_type = {"uint16": cv.CV_16UC1, "uint32": cv.CV_32SC1, "float32": cv.CV_32FC1}[accumulator]
+
 # aggregate intensity map for all traces
-themap = cv.CreateMat(height,width,cv.CV_16UC1)
+themap = cv.CreateMat(height,width,map_type)
 cv.SetZero(themap)
 
 # aggregate intensity map for all traces, split by sector heading
@@ -93,28 +104,31 @@ sector_maps = {}
 ## Build an aggregate intensity map from all the edges
 ##
 
-filename = "tmp/cache/n%d_c%d.xml"%(trip_max,cell_size)
+# wide intensity maps are cached separately
+cache_suffix = "" if accumulator == "uint16" else "_"+accumulator
+
+filename = "tmp/cache/n%d_c%d%s.xml"%(trip_max,cell_size,cache_suffix)
 if os.access(filename,os.F_OK):
     print "Found cached intensity map %s, loading."%(filename)
     themap = cv.Load(filename)
     for sector in range(8):
-	sector_maps[sector]=cv.Load("tmp/cache/n%d_c%d_s%d.xml"%(trip_max,cell_size,sector))
+	sector_maps[sector]=cv.Load("tmp/cache/n%d_c%d_s%d%s.xml"%(trip_max,cell_size,sector,cache_suffix))
 else:
     print "Making new intensity map %s."%(filename)
     sector_temp = {}
     sector_temp2 = {}
     for sector in range(8):
-        sector_maps[sector]=cv.CreateMat(height,width,cv.CV_16UC1)
+        sector_maps[sector]=cv.CreateMat(height,width,map_type)
         cv.SetZero(sector_maps[sector])
         sector_temp[sector]=cv.CreateMat(height,width,cv.CV_8UC1)
         cv.SetZero(sector_temp[sector])
-        sector_temp2[sector]=cv.CreateMat(height,width,cv.CV_16UC1)
+        sector_temp2[sector]=cv.CreateMat(height,width,map_type)
         cv.SetZero(sector_temp2[sector])
 
     for trip in all_trips[:trip_max]:
         temp = cv.CreateMat(height,width,cv.CV_8UC1)
         cv.SetZero(temp)
-        temp16 = cv.CreateMat(height,width,cv.CV_16UC1)
+        temp16 = cv.CreateMat(height,width,map_type)
         cv.SetZero(temp16)
 
         for (orig,dest) in pairwise(trip.locations):
@@ -140,7 +154,7 @@ else:
 	
     cv.Save(filename,themap)
     for sector in range(8):
-	cv.Save("tmp/cache/n%d_c%d_s%d.xml"%(trip_max,cell_size,sector),sector_maps[sector])
+	cv.Save("tmp/cache/n%d_c%d_s%d%s.xml"%(trip_max,cell_size,sector,cache_suffix),sector_maps[sector])
 
     lines = cv.CreateMat(height,width,cv.CV_8U)
     cv.SetZero(lines)
@@ -162,6 +176,14 @@ print "Intensity map acquired."
 ## Processing of intensity map below this line 
 ## 
 
+# OpenCV cannot blur 32-bit integer maps, so they are blurred as float32
+def smoothable(intensity_map):
+    if cv.GetElemType(intensity_map) != cv.CV_32SC1:
+        return intensity_map
+    float_map = cv.CreateMat(intensity_map.rows,intensity_map.cols,cv.CV_32FC1)
+    cv.ConvertScale(intensity_map,float_map,1,0)
+    return float_map
+
 def sector_count(line):
     (orig,dest)=line
     sector = getsector(orig[0],orig[1],dest[0],dest[1])
@@ -292,7 +314,8 @@ def paint_voronoi( subdiv, contour, img ):
 for sector in range(8):
     mask = cv.CreateMat(height,width,cv.CV_8U)
     cv.SetZero(mask)
-    cv.Smooth(sector_maps[sector], sector_maps[sector], cv.CV_GAUSSIAN, gaussian_blur,gaussian_blur)       
+    sector_maps[sector] = smoothable(sector_maps[sector])
+    smooth(np.asarray(sector_maps[sector]), gaussian_blur, blur_backend)
     cv.ConvertScale(sector_maps[sector],mask,1,0);
     cv.SaveImage("tmp/sector"+`sector`+".png",mask)
 # # create the mask and compute the contour
@@ -309,10 +332,18 @@ cv.SetZero(mask)
 #cv.Pow(temp,temp2,0.5)
 #cv.SaveImage("histogram.png",temp2)
 
-cv.Smooth(themap, themap, cv.CV_GAUSSIAN, gaussian_blur,gaussian_blur)
-cv.SaveImage("tmp/map.png",themap)
+themap = smoothable(themap)
+smooth(np.asarray(themap), gaussian_blur, blur_backend)
 (minval,maxval,minloc,maxloc)=cv.MinMaxLoc(themap)
 print "Min: "+`minval`+" max: "+`maxval`
+
+# wide maps are scaled into 16 bits for viewing only; thresholds below use the unscaled map
+if accumulator == "uint16":
+    cv.SaveImage("tmp/map.png",themap)
+else:
+    map16 = cv.CreateMat(height,width,cv.CV_16UC1)
+    cv.ConvertScale(themap,map16,min(1.0,65535.0/max(maxval,1.0)),0)
+    cv.SaveImage("tmp/map.png",map16)
 cv.ConvertScale(themap,mask,255.0/maxval,0);
 cv.SaveImage("tmp/mask.png",mask)
 cv.CmpS(themap,mask_threshold,mask,cv.CV_CMP_GT)
@@ -8,8 +8,9 @@
 import time
 import math
 import sys
-import sqlite3
 from pylibs import spatialfunclib, mathfunclib
+from pylibs.simplify import simplify_graph
+from pylibs.graphdb_writer import write_graphdb
 from location import Location, Trip
 from rtree import Rtree
 from location import TripLoader
@@ -22,6 +23,7 @@ cluster_bearing_difference_limit = math.cos(math.radians(45.0)) # degrees
 intra_cluster_distance_limit = 20.0 # meters
 edge_bounding_box_size = 80.0 # meters
 cluster_distance_moved_threshold = 0.01 # meters per seed
+simplify_epsilon = None # meters (None: graph written as generated)
 trip_max=len(all_trips)
 
 class Edge:
@@ -621,44 +623,21 @@ class Graph:
         sys.stdout.write("\nOutputting graph to database... ")
         sys.stdout.flush()
         
-        # connect to database
-        conn = sqlite3.connect("edelkamp_graph.db")
+        # graph nodes and edges as (id, latitude, longitude) and (id, in_node, out_node) rows
+        node_rows = [(cluster_seed.id, cluster_seed.latitude, cluster_seed.longitude) for cluster_seed in self.cluster_seeds.values()]
+        edge_rows = [(graph_edge.id, graph_edge.in_node.id, graph_edge.out_node.id) for graph_edge in self.graph_edges.values()]
         
-        # grab cursor
-        cur = conn.cursor()
-        
-        # create nodes table
-        cur.execute("CREATE TABLE nodes (id INTEGER, latitude FLOAT, longitude FLOAT)")
-        
-        # create edges table
-        cur.execute("CREATE TABLE edges (id INTEGER, in_node INTEGER, out_node INTEGER)")
-        
-        # remove values from nodes table
-        #cur.execute("DELETE FROM nodes")
-        
-        # remove values from edges table
-        #cur.execute("DELETE FROM edges")
-        
-        # commit creates
-        conn.commit()
-        
-        # iterate through all cluster seeds
-        for cluster_seed in self.cluster_seeds.values():
-            
-            # insert cluster seed into nodes table
-            cur.execute("INSERT INTO nodes VALUES (" + str(cluster_seed.id) + "," + str(cluster_seed.latitude) + "," + str(cluster_seed.longitude) + ")")
-        
-        # iterate through all graph edges
-        for graph_edge in self.graph_edges.values():
+        # if requested, drop chain nodes with Douglas-Peucker (edges get new ids)
+        if (simplify_epsilon is not None):
+            node_coords = dict((node_id, (latitude, longitude)) for (node_id, latitude, longitude) in node_rows)
+            (kept_nodes, kept_edges) = simplify_graph(node_coords, [(in_node, out_node) for (_, in_node, out_node) in edge_rows], simplify_epsilon)
             
-            # insert graph edge into edges table
-            cur.execute("INSERT INTO edges VALUES (" + str(graph_edge.id) + "," + str(graph_edge.in_node.id) + "," + str(graph_edge.out_node.id) + ")")
-        
-        # commit inserts
-        conn.commit()
+            kept_nodes = set(kept_nodes)
+            node_rows = [node_row for node_row in node_rows if (node_row[0] in kept_nodes)]
+            edge_rows = [(edge_id, in_node, out_node) for (edge_id, (in_node, out_node)) in enumerate(kept_edges)]
         
-        # close database connection
-        conn.close()
+        # write graph nodes and edges to database
+        write_graphdb("edelkamp_graph.db", node_rows, edge_rows, weighted=False)
         
         print "done."
 
@@ -666,7 +645,7 @@ import sys, getopt, time
 from location import TripLoader
 if __name__ == '__main__':
     
-    (opts, args) = getopt.getopt(sys.argv[1:],"i:b:d:s:t:n:h")
+    (opts, args) = getopt.getopt(sys.argv[1:],"i:b:d:s:t:n:e:h")
     
     for o,a in opts:
         if o == "-i":
@@ -681,8 +660,10 @@ if __name__ == '__main__':
             cluster_distance_moved_threshold = float(a)
         if o == "-n":
             trip_max = int(a)
+        if o == "-e":
+            simplify_epsilon = float(a)
         if o == "-h":
-            print "Usage: python edelkamp2003.py [-i <cluster_seed_interval>] [-b <cluster_bearing_difference_limit>] [-d <intra_cluster_distance_limit>] [-s <edge_bounding_box_size>] [-t <cluster_distance_moved_threshold>] [-n <trip_max>] [-h]\n"
+            print "Usage: python edelkamp2003.py [-i <cluster_seed_interval>] [-b <cluster_bearing_difference_limit>] [-d <intra_cluster_distance_limit>] [-s <edge_bounding_box_size>] [-t <cluster_distance_moved_threshold>] [-n <trip_max>] [-e <simplify_epsilon>] [-h]\n"
             exit()
     
     start_time = time.time()